@@ -0,0 +1,170 @@
+"""Compact binary encoding of numeric time series chunks.
+
+Chunk format (before zlib compression):
+- 1 byte: value encoding, ENCODING_DECIMAL or ENCODING_XOR
+- varint: number of samples
+- 1 byte: decimal scale (only for ENCODING_DECIMAL)
+- timestamps: first timestamp, first delta and then delta-of-deltas, all as
+  zigzag varints
+- values: for ENCODING_DECIMAL, the first value and then deltas of the
+  values multiplied by 10^scale as zigzag varints, for ENCODING_XOR, the
+  IEEE 754 bits of the first value and then the XOR of the bits of each
+  value with the previous one as varints
+
+Sensor readings usually have a few decimal digits and change slowly, so
+most samples take a byte or two before compression.
+"""
+import struct
+import zlib
+
+# Value encodings.
+ENCODING_DECIMAL = 1
+ENCODING_XOR = 2
+
+# Maximum number of decimal digits tried for decimal encoding.
+MAX_DECIMAL_SCALE = 6
+
+# Largest integer that is exactly representable as a float.
+MAX_EXACT_INTEGER = 2 ** 53
+
+
+def zigzag(value):
+    """Map signed integer to unsigned, so small magnitudes stay small."""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+def write_varint(output, value):
+    """Append unsigned integer to bytearray as a varint."""
+    while value > 0x7f:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def read_varint(data, position):
+    """Read varint from bytearray.
+
+    :return: Tuple (value, position)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _float_bits(value):
+    return struct.unpack('<Q', struct.pack('<d', value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+
+def _decimal_scale(values):
+    """Find the smallest decimal scale that represents all values exactly.
+
+    :return: Tuple (scale, integers) or (None, None)
+    """
+    for scale in range(MAX_DECIMAL_SCALE + 1):
+        factor = 10 ** scale
+        integers = []
+        for value in values:
+            try:
+                integer = int(round(value * factor))
+            except (OverflowError, ValueError):
+                # Infinity or NaN.
+                break
+            if abs(integer) >= MAX_EXACT_INTEGER or float(integer) / factor != value:
+                break
+            integers.append(integer)
+        else:
+            return scale, integers
+
+    return None, None
+
+
+def encode_chunk(timestamps, values):
+    """Encode a series of samples.
+
+    :param timestamps: List of integer timestamps, in ascending order
+    :param values: List of float values
+    :return: Compressed chunk
+    """
+    output = bytearray()
+    scale, integers = _decimal_scale(values)
+    output.append(ENCODING_DECIMAL if scale is not None else ENCODING_XOR)
+    write_varint(output, len(timestamps))
+    if scale is not None:
+        output.append(scale)
+
+    previous = 0
+    previous_delta = 0
+    for index, timestamp in enumerate(timestamps):
+        delta = timestamp - previous
+        write_varint(output, zigzag(delta if index < 2 else delta - previous_delta))
+        previous = timestamp
+        previous_delta = delta
+
+    if scale is not None:
+        previous = 0
+        for integer in integers:
+            write_varint(output, zigzag(integer - previous))
+            previous = integer
+    else:
+        previous = 0
+        for value in values:
+            bits = _float_bits(value)
+            write_varint(output, bits ^ previous)
+            previous = bits
+
+    return zlib.compress(bytes(output))
+
+
+def decode_chunk(data):
+    """Decode a series of samples.
+
+    :param data: Compressed chunk
+    :return: Tuple (timestamps, values) of lists
+    """
+    data = bytearray(zlib.decompress(bytes(data)))
+    encoding = data[0]
+    count, position = read_varint(data, 1)
+    if encoding == ENCODING_DECIMAL:
+        scale = data[position]
+        position += 1
+    elif encoding != ENCODING_XOR:
+        raise ValueError("Unknown chunk encoding {}.".format(encoding))
+
+    timestamps = []
+    previous = 0
+    delta = 0
+    for index in range(count):
+        value, position = read_varint(data, position)
+        delta = unzigzag(value) if index < 2 else delta + unzigzag(value)
+        previous += delta
+        timestamps.append(previous)
+
+    values = []
+    previous = 0
+    if encoding == ENCODING_DECIMAL:
+        factor = 10 ** scale
+        for _ in range(count):
+            value, position = read_varint(data, position)
+            previous += unzigzag(value)
+            values.append(float(previous) / factor)
+    else:
+        for _ in range(count):
+            value, position = read_varint(data, position)
+            previous ^= value
+            values.append(_bits_float(previous))
+
+    return timestamps, values
@@ -1,12 +1,19 @@
 from __future__ import print_function
 
 import collections
+import functools
+import heapq
 import importlib
 import os
 import subprocess
 import time
 import traceback
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import RPi.GPIO as gpio
 import pigpio
 
@@ -20,7 +27,34 @@ except ImportError:
 from .hardware import devices, bq2429x, mcp3021, rtc
 from .state import State
 from .log import Log
-from .const import LOG_SYSTEM, LOG_DEVICE_VOLTAGE, LOG_DEVICE_TEMPERATURE
+from .bus import MeasurementBus
+from .sensors import Sensors
+from .jobs import Job
+from .trace import Tracer, monotonic
+from .watchdog import Watchdog, BudgetExceeded
+from .const import LOG_SYSTEM, LOG_DEVICE_VOLTAGE, LOG_DEVICE_TEMPERATURE, LOG_WATCHDOG_OVERRUN, \
+    LOG_BOOT_PROFILE, LOG_BOOT_DURATION, LOG_BOOT_UPTIME, LOG_SHUTDOWN_DURATION, LOG_SHUTDOWN_ABANDONED
+
+# Default interval (in seconds) of device measurements and module processing.
+DEFAULT_LOOP_INTERVAL = 30
+
+# Default time limit (in seconds) for initializing a single module.
+DEFAULT_MODULE_INIT_TIMEOUT = 30
+
+# Default time budget (in seconds) of a single module process or shutdown call.
+DEFAULT_MODULE_BUDGET = 60
+
+# Default number of budget overruns after which a module is not processed any more.
+DEFAULT_MODULE_MAX_OVERRUNS = 3
+
+# Default time limit (in seconds) for shutting down all modules.
+DEFAULT_SHUTDOWN_TIMEOUT = 60
+
+# Interval (in seconds) at which running background jobs are checked.
+BACKGROUND_POLL_INTERVAL = 5
+
+# Interval (in seconds) at which the trace of a running wake cycle is saved.
+TRACE_SAVE_INTERVAL = 600
 
 
 class Boot(object):
@@ -31,14 +65,18 @@ class Boot(object):
     BOOT_REASON_CHARGER = 'charger'
     BOOT_REASON_RTC = 'rtc'
 
+    BOOT_PROFILE_FULL = 'full'
+    BOOT_PROFILE_LEAN = 'lean'
+    BOOT_PROFILE_AUTO = 'auto'
+
     # Modules that should be loaded.
     enabled_modules = [
         'pira.modules.scheduler',
         # Sensor modules.
         'pira.modules.ultrasonic',
         'pira.modules.camera',
-        # Reporting modules should come after all sensor modules, so they can get
-        # the latest values.
+        # Reporting modules are processed after the sensor modules publishing the
+        # measurements they subscribe to, regardless of the order here.
         'pira.modules.lora',
         'pira.modules.rockblock',
         'pira.modules.nodewatcher',
@@ -48,9 +86,21 @@ class Boot(object):
 
     def __init__(self):
         self.reason = Boot.BOOT_REASON_UNKNOWN
+        self.profile = Boot.BOOT_PROFILE_FULL
         self.shutdown = False
+        self._started = monotonic()
         self._charging_status = collections.deque(maxlen=4)
         self._wifi = None
+        self.tracer = Tracer()
+        self._trace_saved = None
+        self.watchdog = Watchdog()
+        self._budgets = {}
+        self._overruns = collections.Counter()
+        self._skipped = set()
+        self._background = set()
+        # Running background jobs of modules.
+        self._jobs = collections.OrderedDict()
+        self._overrun_jobs = set()
 
         if RESIN_ENABLED:
             self._resin = resin.Resin()
@@ -87,6 +137,7 @@ class Boot(object):
         self.sensor_bq = bq2429x.BQ2429x()
         self.sensor_mcp = mcp3021.MCP3021()
         self.rtc = rtc.RTC()
+        self.sensors = Sensors(self)
 
     def setup_wifi(self):
         """Setup wifi."""
@@ -113,14 +164,21 @@ class Boot(object):
             while True:
                 time.sleep(1)
 
-        self.setup_gpio()
-        self.setup_devices()
-        self.setup_wifi()
+        with self.tracer.span('setup_gpio'):
+            self.setup_gpio()
+        with self.tracer.span('setup_devices'):
+            self.setup_devices()
 
-        self.state = State()
-        self.log = Log()
+        with self.tracer.span('open_state'):
+            self.state = State()
+        with self.tracer.span('open_log'):
+            self.log = Log()
         self.log.insert(LOG_SYSTEM, 'boot')
 
+        self.bus = MeasurementBus(self.log)
+        self.bus.declare(LOG_DEVICE_VOLTAGE, __name__)
+        self.bus.declare(LOG_DEVICE_TEMPERATURE, __name__)
+
         self._update_charging()
 
         # Determine boot reason.
@@ -171,6 +229,17 @@ class Boot(object):
         )
 
         print("Boot reason: {}".format(self.reason))
+        self.tracer.metadata['boot_reason'] = self.reason
+
+        self.profile = self._select_profile()
+        print("Boot profile: {}".format(self.profile))
+        self.tracer.metadata['boot_profile'] = self.profile
+        self.log.insert(LOG_BOOT_PROFILE, self.profile)
+
+        # Networking is not needed when we only measure and go back to sleep.
+        if self.profile == Boot.BOOT_PROFILE_FULL:
+            with self.tracer.span('setup_wifi'):
+                self.setup_wifi()
 
         print("RTC Time: {}".format(self.rtc.current_time.isoformat()))
         print("RTC Alarm 1: {}".format(self.rtc.alarm1_time.isoformat()))
@@ -198,12 +267,13 @@ class Boot(object):
             print("Only loading configured modules.")
             self.enabled_modules = override_modules.strip().split(',')
 
-        # Initialize modules.
+        # Import modules.
         print("Initializing modules...")
-        self.modules = collections.OrderedDict()
+        imported = collections.OrderedDict()
         for module_name in self.enabled_modules:
             try:
-                module = importlib.import_module(module_name)
+                with self.tracer.span(module_name, 'import'):
+                    module = importlib.import_module(module_name)
             except ImportError:
                 print("ImportError  * {} [IMPORT FAILED]".format(module_name))
                 continue
@@ -211,61 +281,466 @@ class Boot(object):
                 print("ValueError  * {} [IMPORT FAILED]".format(module_name))
                 continue
 
+            # Modules may tell that they have nothing to do in a lean wake cycle.
+            if self.profile == Boot.BOOT_PROFILE_LEAN and not getattr(module.Module, 'is_due', lambda boot: True)(self):
+                print("  * {} [NOT DUE]".format(module.__name__))
+                continue
+
             print("  * {}".format(module.__name__))
+            imported[module.__name__] = module
 
-            try:
-                instance = module.Module(self)
-                self.modules[module.__name__] = instance
-            except:
-                print("Error while initializing a module.")
-                traceback.print_exc()
+        self.modules = self._initialize_modules(imported)
+        for name, module in self.modules.items():
+            for key in getattr(module, 'publishes', ()):
+                self.bus.declare(key, name)
 
         self.log.insert(LOG_SYSTEM, 'main_loop')
 
+        # Periodic tasks. Tasks that are due at the same time run in this order,
+        # so modules see fresh device measurements and housekeeping comes last.
+        intervals = self.module_intervals
+        budgets = self.module_budgets
+        background = self.background_modules
+        self._tasks = [('measure', self._measure, self.loop_interval)]
+        for name, module in self.modules.items():
+            # Modules may declare their interval and time budget, which can be
+            # overriden by configuration.
+            interval = intervals.get(name) or getattr(module, 'interval', None) or self.loop_interval
+            self._budgets[name] = budgets.get(name) or getattr(module, 'budget', None) or self.module_budget
+            if name in background or getattr(module, 'background', False):
+                self._background.add(name)
+            print("Processing module '{}' every {} seconds (budget {} seconds{}).".format(
+                name, interval, self._budgets[name], ', in background' if name in self._background else ''))
+            self._tasks.append((name, functools.partial(self._process_module, name, module), interval))
+        self._tasks.append(('housekeeping', self._housekeeping, self.loop_interval))
+
+        # Schedule of (deadline, task index) ordered by deadline.
+        now = monotonic()
+        self._schedule = [(now, index) for index in range(len(self._tasks))]
+        heapq.heapify(self._schedule)
+
+        # Names of tasks that have not completed a run yet in the lean profile.
+        single_pass = set(name for name, _, _ in self._tasks) if self.profile == Boot.BOOT_PROFILE_LEAN else None
+
         # Enter main loop.
         print("Starting processing loop.")
         while True:
-            self._update_charging()
-
-            # Store some general log entries.
-            self.log.insert(LOG_DEVICE_VOLTAGE, self.sensor_mcp.get_voltage())
-            self.log.insert(LOG_DEVICE_TEMPERATURE, self.rtc.temperature)
-
-            # Process all modules.
-            for name, module in self.modules.items():
-                try:
-                    module.process(self.modules)
-                except:
-                    print("Error while running processing in module '{}'.".format(name))
-                    traceback.print_exc()
-
-            # Check if battery voltage is below threshold and shutdown
-            if (self.sensor_mcp.get_voltage() <= os.environ.get('SHUTDOWN_VOLTAGE', '2.6')):
-                print("Voltage is under the threshold, need to shutdown.")
-                self.shutdown = True
-
-            # Save state.
+            deadline, index = heapq.heappop(self._schedule)
+            delay = deadline - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            name, task, interval = self._tasks[index]
+            with self.tracer.span(name, 'process'):
+                next_run = task()
+
+            # Tasks may request their next run, otherwise they run periodically
+            # without catching up on runs missed while they were late.
+            now = monotonic()
+            if next_run is not None:
+                deadline = now + max(0, next_run)
+            else:
+                deadline = max(deadline + interval, now)
+            if name not in self._skipped:
+                heapq.heappush(self._schedule, (deadline, index))
+
+            # In the lean profile, go to sleep after every task has run once.
+            if single_pass is not None and name not in self._jobs:
+                single_pass.discard(name)
+                if not single_pass:
+                    print("All modules have been processed once, need to shutdown.")
+                    self.shutdown = True
+                    single_pass = None
+
+            if self.shutdown and (not self._schedule or self._schedule[0][0] > now):
+                # Perform shutdown when requested, once all tasks that were due have
+                # run. This will either request the Resin supervisor to shut down and
+                # block forever or the shutdown request will be ignored and we will
+                # continue processing.
+                self.shutdown = False
+                self._perform_shutdown()
+
+    def _select_profile(self):
+        """Select boot profile.
+
+        The automatic profile selects the lean profile for timer and RTC
+        wakes when the unit is not going to stay awake anyway.
+        """
+        profile = os.environ.get('BOOT_PROFILE', Boot.BOOT_PROFILE_FULL)
+        if profile == Boot.BOOT_PROFILE_AUTO:
+            if self.reason in (Boot.BOOT_REASON_TIMER, Boot.BOOT_REASON_RTC) and \
+                    not self.should_never_sleep and not self.is_charging and not self.is_wifi_enabled:
+                return Boot.BOOT_PROFILE_LEAN
+
+            return Boot.BOOT_PROFILE_FULL
+
+        if profile not in (Boot.BOOT_PROFILE_FULL, Boot.BOOT_PROFILE_LEAN):
+            print("ERROR: Unknown boot profile '{}', using full profile.".format(profile))
+            return Boot.BOOT_PROFILE_FULL
+
+        return profile
+
+    def _module_dependencies(self, imported):
+        """Determine dependencies between modules.
+
+        A module depends on the modules listed in the `depends` attribute of
+        its class and on the modules publishing measurements listed in its
+        `subscribes` attribute (see `publishes`), if they are loaded.
+
+        :param imported: Ordered dictionary of imported module packages
+        :return: Ordered dictionary of module names to lists of dependencies
+        """
+        publishers = collections.defaultdict(list)
+        for name, module in imported.items():
+            for key in getattr(module.Module, 'publishes', ()):
+                publishers[key].append(name)
+
+        dependencies = collections.OrderedDict()
+        for name, module in imported.items():
+            names = list(getattr(module.Module, 'depends', ()))
+            for key in getattr(module.Module, 'subscribes', ()):
+                names.extend(publishers[key])
+            dependencies[name] = [dependency for dependency in names if dependency in imported and dependency != name]
+
+        return dependencies
+
+    def _dependency_order(self, dependencies):
+        """Order modules after their dependencies, otherwise keeping the
+        configured order.
+
+        :param dependencies: Ordered dictionary as returned by
+            `_module_dependencies`
+        :return: List of module names
+        """
+        ordered = []
+        remaining = collections.OrderedDict(dependencies)
+        while remaining:
+            for name, names in remaining.items():
+                if not any(dependency in remaining for dependency in names):
+                    break
+            else:
+                # Circular dependencies, keep the configured order.
+                name = next(iter(remaining))
+
+            ordered.append(name)
+            del remaining[name]
+
+        return ordered
+
+    def _initialize_modules(self, imported):
+        """Initialize modules concurrently.
+
+        A module is initialized once all modules it depends on have been
+        initialized. Modules that take longer than the init timeout are left
+        behind.
+
+        :param imported: Ordered dictionary of imported module packages
+        :return: Ordered dictionary of module instances, in dependency order
+        """
+        timeout = self.module_init_timeout
+        finished = queue.Queue()
+        dependencies = self._module_dependencies(imported)
+        waiting = collections.OrderedDict(dependencies)
+        running = {}
+        instances = {}
+
+        while waiting or running:
+            # Start modules whose dependencies are done.
+            for name, required in list(waiting.items()):
+                if not any(dependency in waiting or dependency in running for dependency in required):
+                    del waiting[name]
+                    running[name] = (Job(name, self._initialize_module, (name, imported[name]), finished.put), monotonic())
+
+            if not running:
+                name = next(iter(waiting))
+                print("ERROR: Circular dependencies of module '{}', initializing it anyway.".format(name))
+                waiting[name] = []
+                continue
+
             try:
-                self.state.save()
+                job = finished.get(timeout=max(0, min(started for _, started in running.values()) + timeout - monotonic()))
+            except queue.Empty:
+                for name, (job, started) in list(running.items()):
+                    if not job.done and monotonic() - started >= timeout:
+                        print("ERROR: Initialization of module '{}' timed out, not loading it.".format(name))
+                        del running[name]
+                continue
+
+            if running.get(job.name, (None,))[0] is not job:
+                # Finished after it timed out.
+                continue
+
+            del running[job.name]
+            if job.exc_info is not None:
+                print("Error while initializing module '{}'.".format(job.name))
+                job.print_exception()
+            else:
+                instances[job.name] = job.result
+
+        return collections.OrderedDict(
+            (name, instances[name]) for name in self._dependency_order(dependencies) if name in instances
+        )
+
+    def _initialize_module(self, name, module):
+        """Construct module instance."""
+        with self.tracer.span(name, 'init'):
+            return module.Module(self)
+
+    def _measure(self):
+        """Store device measurements."""
+        # Take fresh readings, which are shared with modules during this tick.
+        self.sensors.refresh()
+        self._update_charging()
+
+        # Store some general log entries.
+        self.bus.publish(LOG_DEVICE_VOLTAGE, self.sensors.voltage)
+        self.bus.publish(LOG_DEVICE_TEMPERATURE, self.sensors.temperature)
+
+    def _process_module(self, name, module):
+        """Run processing of a module.
+
+        :return: Number of seconds until the module should run next, if
+            requested by the module
+        """
+        if name in self._background:
+            result = self._process_in_background(name, module)
+        else:
+            result = self._call_module(name, 'processing', self._budgets[name], module.process)
+
+        if self._overruns[name] >= self.module_max_overruns and name not in self._jobs:
+            print("ERROR: Module '{}' has exceeded its budget {} times, not processing it any more.".format(
+                name, self._overruns[name]))
+            self._skipped.add(name)
+
+        return result
+
+    def _call_module(self, name, phase, budget, function):
+        """Call module function within its time budget.
+
+        Overruns are recorded in the log. Calls that do not return on their
+        own are interrupted.
+
+        :return: Result of the call or None on error
+        """
+        started = monotonic()
+        try:
+            with self.watchdog.budget(budget):
+                return function(self.modules)
+        except BudgetExceeded:
+            print("ERROR: Interrupted {} in module '{}'.".format(phase, name))
+        except:
+            print("Error while running {} in module '{}'.".format(phase, name))
+            traceback.print_exc()
+        finally:
+            duration = monotonic() - started
+            if duration > budget:
+                self._record_overrun(name, phase, budget, duration)
+
+    def _record_overrun(self, name, phase, budget, duration):
+        """Record budget overrun of a module."""
+        print("ERROR: Module '{}' exceeded its {} budget of {} seconds ({:.1f} seconds).".format(
+            name, phase, budget, duration))
+        self._overruns[name] += 1
+        try:
+            self.log.insert(LOG_WATCHDOG_OVERRUN, '{} {} {:.1f}'.format(name, phase, duration))
+        except:
+            print("Error while logging budget overrun.")
+            traceback.print_exc()
+
+    def _process_in_background(self, name, module):
+        """Run processing of a module in a background job.
+
+        The job is started on the first call and checked on later calls until
+        it has finished, so the main loop keeps running meanwhile. Jobs can not
+        be interrupted, so overruns are only recorded.
+
+        :return: Number of seconds until the module should run next
+        """
+        budget = self._budgets[name]
+        job = self._jobs.get(name)
+        if job is None:
+            self._jobs[name] = Job(name, self._run_background, (name, module))
+            return min(budget, BACKGROUND_POLL_INTERVAL)
+
+        if job.duration > budget and name not in self._overrun_jobs:
+            self._overrun_jobs.add(name)
+            self._record_overrun(name, 'background processing', budget, job.duration)
+
+        if not job.done:
+            return BACKGROUND_POLL_INTERVAL
+
+        del self._jobs[name]
+        self._overrun_jobs.discard(name)
+        if job.exc_info is not None:
+            print("Error while running background processing in module '{}'.".format(name))
+            job.print_exception()
+
+        return job.result
+
+    def _run_background(self, name, module):
+        """Background job entry point."""
+        with self.tracer.span(name, 'background'):
+            return module.process(self.modules)
+
+    def _finish_background_jobs(self, deadline):
+        """Wait until the deadline for background jobs to finish.
+
+        Jobs that are still running are abandoned and left to the shutdown of
+        their modules.
+        """
+        for name, job in list(self._jobs.items()):
+            print("Waiting for background processing in module '{}'.".format(name))
+            if not job.wait(max(0, deadline - monotonic())):
+                print("ERROR: Background processing in module '{}' did not finish in time, cancelling it.".format(name))
+                self.tracer.instant(name, 'cancel')
+                continue
+
+            del self._jobs[name]
+            if job.exc_info is not None:
+                print("Error while running background processing in module '{}'.".format(name))
+                job.print_exception()
+
+    def _shutdown_modules(self, deadline):
+        """Shut down modules concurrently.
+
+        The shutdown of a module starts once the shutdowns of all modules
+        listed in the `shutdown_after` attribute of the module have finished,
+        if they are loaded. Shutdowns are limited by the module budget and the
+        deadline, only modules with `shutdown_required` set (e.g. scheduler,
+        which programs the wakeup alarm) get their full budget past the
+        deadline. Shutdowns that run out of time are left behind.
+
+        :param deadline: Shutdown deadline (monotonic time)
+        """
+        def time_limit(name, job):
+            limit = job.started + self._budgets.get(name, self.module_budget)
+            if getattr(self.modules[name], 'shutdown_required', False):
+                return limit
+            return min(limit, deadline)
+
+        finished = queue.Queue()
+        waiting = collections.OrderedDict(
+            (name, [after for after in getattr(module, 'shutdown_after', ()) if after in self.modules and after != name])
+            for name, module in self.modules.items()
+        )
+        running = {}
+
+        while waiting or running:
+            # Start shutdowns whose ordering constraints are met.
+            for name, after in list(waiting.items()):
+                if any(other in waiting or other in running for other in after):
+                    continue
+
+                del waiting[name]
+                if monotonic() >= deadline and not getattr(self.modules[name], 'shutdown_required', False):
+                    print("ERROR: Shutdown timed out, not shutting down module '{}'.".format(name))
+                    continue
+
+                running[name] = Job(name, self._run_shutdown, (name, self.modules[name]), finished.put)
+
+            # Modules that do not (indirectly) wait for a running shutdown only
+            # wait for each other.
+            unblocked = set(running)
+            while True:
+                more = set(name for name, after in waiting.items() if name not in unblocked and unblocked.intersection(after))
+                if not more:
+                    break
+                unblocked.update(more)
+
+            stuck = [name for name in waiting if name not in unblocked]
+            if stuck:
+                print("ERROR: Circular shutdown order of module '{}', shutting it down anyway.".format(stuck[0]))
+                waiting[stuck[0]] = []
+                continue
+
+            if not running:
+                continue
+
+            try:
+                job = finished.get(timeout=max(0, min(time_limit(name, job) for name, job in running.items()) - monotonic()))
+            except queue.Empty:
+                for name, job in list(running.items()):
+                    if job.done or monotonic() < time_limit(name, job):
+                        continue
+
+                    del running[name]
+                    duration = job.duration
+                    self.log.insert(LOG_SHUTDOWN_DURATION, '{} {:.2f}'.format(name, duration))
+                    budget = self._budgets.get(name, self.module_budget)
+                    if duration >= budget:
+                        print("ERROR: Shutdown of module '{}' exceeded its budget, leaving it behind.".format(name))
+                        self._record_overrun(name, 'shutdown', budget, duration)
+                    else:
+                        print("ERROR: Shutdown of module '{}' still running at the deadline after {:.2f} seconds, "
+                              "leaving it behind.".format(name, duration))
+                        self.log.insert(LOG_SHUTDOWN_ABANDONED, name)
+                continue
+
+            if running.get(job.name) is not job:
+                # Finished after it was left behind.
+                continue
+
+            del running[job.name]
+            print("Module '{}' shut down in {:.2f} seconds.".format(job.name, job.duration))
+            self.log.insert(LOG_SHUTDOWN_DURATION, '{} {:.2f}'.format(job.name, job.duration))
+            if job.exc_info is not None:
+                print("Error while running shutdown in module '{}'.".format(job.name))
+                job.print_exception()
+
+            budget = self._budgets.get(job.name, self.module_budget)
+            if job.duration > budget:
+                self._record_overrun(job.name, 'shutdown', budget, job.duration)
+
+    def _run_shutdown(self, name, module):
+        """Module shutdown job entry point."""
+        with self.tracer.span(name, 'shutdown'):
+            module.shutdown(self.modules)
+
+    def _housekeeping(self):
+        """Check battery, save state and maintain the log."""
+        # Check if battery voltage is below threshold and shutdown
+        if self.sensors.voltage <= self.shutdown_voltage:
+            print("Voltage is under the threshold, need to shutdown.")
+            self.shutdown = True
+
+        # Save state.
+        try:
+            self.state.save()
+        except:
+            print("Error while saving state.")
+            traceback.print_exc()
+
+        # Move old measurements into the compressed archive.
+        if self.should_archive_log:
+            try:
+                rows, size = self.log.archive(timeout=5)
+                if rows:
+                    print("Log archive stored {} rows ({} bytes reclaimed).".format(rows, size))
             except:
-                print("Error while saving state.")
+                print("Error while archiving log.")
                 traceback.print_exc()
 
-            if self.shutdown:
-                # Perform shutdown when requested. This will either request the Resin
-                # supervisor to shut down and block forever or the shutdown request will
-                # be ignored and we will continue processing.
-                self.shutdown = False
-                self._perform_shutdown()
+        # Apply log retention policies in small steps while we are idle.
+        if self.should_compact_log:
+            try:
+                rows, size = self.log.compact(timeout=5)
+                if rows:
+                    print("Log compaction reclaimed {} rows ({} bytes).".format(rows, size))
+            except:
+                print("Error while compacting log.")
+                traceback.print_exc()
 
-            time.sleep(30)
+        # Save the trace of this wake cycle, so it is available even if we lose power.
+        if self._trace_saved is None or monotonic() - self._trace_saved >= TRACE_SAVE_INTERVAL:
+            self.tracer.save()
+            self._trace_saved = monotonic()
 
     def _update_charging(self):
         """Update charging status."""
         not_charging = (
-            self.sensor_bq.get_status(bq2429x.VBUS_STAT) == 'No input' and
-            self.sensor_bq.get_status(bq2429x.CHRG_STAT) == 'Not charging' and
-            self.sensor_bq.get_status(bq2429x.PG_STAT) == 'Not good power'
+        self.sensors.charger_status(bq2429x.VBUS_STAT) == 'No input' and
+        self.sensors.charger_status(bq2429x.CHRG_STAT) == 'Not charging' and
+        self.sensors.charger_status(bq2429x.PG_STAT) == 'Not good power'
         )
         self._charging_status.append(not not_charging)
 
@@ -277,6 +752,89 @@ class Boot(object):
     def should_never_sleep(self):
         return os.environ.get('SLEEP_NEVER', '0') == '1'
 
+    @property
+    def loop_interval(self):
+        try:
+            return float(os.environ.get('LOOP_INTERVAL', DEFAULT_LOOP_INTERVAL))
+        except ValueError:
+            print("ERROR: Malformed loop interval.")
+            return DEFAULT_LOOP_INTERVAL
+
+    @property
+    def module_init_timeout(self):
+        try:
+            return float(os.environ.get('MODULE_INIT_TIMEOUT', DEFAULT_MODULE_INIT_TIMEOUT))
+        except ValueError:
+            print("ERROR: Malformed module init timeout.")
+            return DEFAULT_MODULE_INIT_TIMEOUT
+
+    @property
+    def module_intervals(self):
+        return self._module_settings('MODULE_INTERVALS')
+
+    @property
+    def module_budget(self):
+        try:
+            return float(os.environ.get('MODULE_BUDGET', DEFAULT_MODULE_BUDGET))
+        except ValueError:
+            print("ERROR: Malformed module budget.")
+            return DEFAULT_MODULE_BUDGET
+
+    @property
+    def module_budgets(self):
+        return self._module_settings('MODULE_BUDGETS')
+
+    @property
+    def background_modules(self):
+        return set(name.strip() for name in os.environ.get('MODULE_BACKGROUND', '').split(',') if name.strip())
+
+    @property
+    def module_max_overruns(self):
+        try:
+            return int(os.environ.get('MODULE_MAX_OVERRUNS', DEFAULT_MODULE_MAX_OVERRUNS))
+        except ValueError:
+            print("ERROR: Malformed maximum number of module overruns.")
+            return DEFAULT_MODULE_MAX_OVERRUNS
+
+    @property
+    def shutdown_voltage(self):
+        try:
+            return float(os.environ.get('SHUTDOWN_VOLTAGE', '2.6'))
+        except ValueError:
+            print("ERROR: Malformed shutdown voltage.")
+            return 2.6
+
+    @property
+    def shutdown_timeout(self):
+        try:
+            return float(os.environ.get('SHUTDOWN_TIMEOUT', DEFAULT_SHUTDOWN_TIMEOUT))
+        except ValueError:
+            print("ERROR: Malformed shutdown timeout.")
+            return DEFAULT_SHUTDOWN_TIMEOUT
+
+    def _module_settings(self, variable):
+        """Parse per-module numeric settings (name:value,name:value)."""
+        settings = {}
+        for item in os.environ.get(variable, '').split(','):
+            if not item.strip():
+                continue
+
+            try:
+                name, value = item.rsplit(':', 1)
+                settings[name.strip()] = float(value)
+            except ValueError:
+                print("ERROR: Malformed {} entry '{}'.".format(variable, item))
+
+        return settings
+
+    @property
+    def should_archive_log(self):
+        return os.environ.get('LOG_ARCHIVE', '0') == '1'
+
+    @property
+    def should_compact_log(self):
+        return os.environ.get('LOG_RETENTION', '0') == '1'
+
     @property
     def is_charging(self):
         return any(self._charging_status)
@@ -325,13 +883,15 @@ class Boot(object):
 
         self.log.insert(LOG_SYSTEM, 'shutdown')
 
+        deadline = monotonic() + self.shutdown_timeout
+
+        # Give background jobs up to half of the shutdown time to finish.
+        with self.tracer.span('background_jobs', 'shutdown'):
+            self._finish_background_jobs(monotonic() + self.shutdown_timeout / 2.0)
+
         print("Requesting all modules to shut down.")
-        for name, module in self.modules.items():
-            try:
-                module.shutdown(self.modules)
-            except:
-                print("Error while running shutdown in module '{}'.".format(name))
-                traceback.print_exc()
+        with self.tracer.span('modules', 'shutdown'):
+            self._shutdown_modules(deadline)
 
         # Shut down devices.
         try:
@@ -343,13 +903,37 @@ class Boot(object):
 
         # Save state.
         try:
-            self.state.save()
+            with self.tracer.span('save_state', 'shutdown'):
+                self.state.save()
         except:
             print("Error while saving state.")
             traceback.print_exc()
 
+        # Record how long this wake cycle took, uptime also includes booting the OS.
+        duration = monotonic() - self._started
+        print("Wake cycle took {:.1f} seconds ({} profile).".format(duration, self.profile))
+        self.log.insert(LOG_BOOT_DURATION, round(duration, 1))
+        self.tracer.metadata['boot_duration'] = duration
+        try:
+            with open('/proc/uptime') as uptime:
+                self.log.insert(LOG_BOOT_UPTIME, float(uptime.read().split()[0]))
+        except (IOError, ValueError, IndexError):
+            print("Error while reading system uptime.")
+            traceback.print_exc()
+
         self.log.insert(LOG_SYSTEM, 'halt')
-        self.log.close()
+        # Closing the log waits until all queued entries have been written.
+        with self.tracer.span('close_log', 'shutdown'):
+            self.log.close()
+
+        print("Sensor readings: {} read, {} reused ({} I2C transactions saved).".format(
+            sum(self.sensors.reads.values()),
+            sum(self.sensors.hits.values()),
+            self.sensors.i2c_transactions_saved,
+        ))
+        self.tracer.metadata['i2c_transactions_saved'] = self.sensors.i2c_transactions_saved
+        self.tracer.instant('halt', 'shutdown')
+        self.tracer.save()
 
         # Force filesystem sync.
         try:
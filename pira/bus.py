@@ -0,0 +1,182 @@
+from __future__ import print_function
+
+import collections
+import datetime
+import numbers
+import threading
+import traceback
+
+from .writepolicy import weighted_statistics
+
+# Default number of samples per key kept in memory.
+DEFAULT_BUS_HISTORY = 1000
+
+# Measurement sample.
+Sample = collections.namedtuple('Sample', ['key', 'timestamp', 'value'])
+
+
+def _numeric(sample):
+    """Return the value of a numeric sample as float or None."""
+    if isinstance(sample.value, numbers.Real) and not isinstance(sample.value, bool):
+        return float(sample.value)
+    return None
+
+
+def _seconds(timestamp):
+    """Convert datetime to a timestamp in seconds, like the log stores it."""
+    return int(timestamp.strftime('%s'))
+
+
+class MeasurementBus(object):
+    """Measurements published during a wake cycle.
+
+    Modules that measure something publish their samples to the bus, which
+    records them in the log and delivers them to subscribed modules. Recent
+    samples are kept in memory, so reports covering the current wake cycle do
+    not need to query the log. Samples may be published from any thread,
+    subscribers are called in the publishing thread.
+    """
+
+    def __init__(self, log, history=DEFAULT_BUS_HISTORY):
+        """Construct measurement bus.
+
+        :param log: Log instance
+        :param history: Number of samples per key kept in memory
+        """
+        self._log = log
+        self._history = history
+        self._started = datetime.datetime.now().replace(microsecond=0)
+        self._samples = {}
+        # Timestamp of the newest sample per key that no longer is in memory.
+        self._dropped = {}
+        self._publishers = collections.defaultdict(list)
+        self._subscribers = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def declare(self, key, publisher):
+        """Declare that a publisher provides measurements of key.
+
+        :param key: Measurement key
+        :param publisher: Publisher name, e.g. module name
+        """
+        with self._lock:
+            self._publishers[key].append(publisher)
+
+    def publishers(self, key):
+        """Return names of publishers that provide measurements of key."""
+        with self._lock:
+            return list(self._publishers.get(key, ()))
+
+    def publish(self, key, value, timestamp=None):
+        """Publish measurement sample.
+
+        :param key: Measurement key
+        :param value: Measured value
+        :param timestamp: Optional sample datetime, defaults to now
+        """
+        sample = Sample(key, timestamp or datetime.datetime.now(), value)
+        self._log.insert(key, value, sample.timestamp)
+
+        with self._lock:
+            samples = self._samples.setdefault(key, collections.deque())
+            samples.append(sample)
+            if len(samples) > self._history:
+                self._dropped[key] = samples.popleft().timestamp
+            subscribers = list(self._subscribers[key])
+
+        for callback in subscribers:
+            try:
+                callback(sample)
+            except:
+                print("Error while delivering measurement '{}'.".format(key))
+                traceback.print_exc()
+
+    def subscribe(self, key, callback):
+        """Call callback with every sample published for key.
+
+        :param key: Measurement key
+        :param callback: Callable taking a Sample
+        """
+        with self._lock:
+            self._subscribers[key].append(callback)
+
+    def latest(self, key):
+        """Return the latest sample of key or None."""
+        with self._lock:
+            samples = self._samples.get(key)
+            return samples[-1] if samples else None
+
+    def samples(self, key, start_ts):
+        """Return samples of key published at or after start_ts.
+
+        :param key: Measurement key
+        :param start_ts: Start datetime, compared with second resolution like
+            log queries
+        :return: List of samples or None when not all of them are in memory
+        """
+        if start_ts is None:
+            return None
+
+        start_ts = start_ts.replace(microsecond=0)
+        with self._lock:
+            dropped = self._dropped.get(key)
+            if start_ts < self._started or (dropped is not None and dropped >= start_ts):
+                return None
+
+            return [sample for sample in self._samples.get(key, ()) if sample.timestamp >= start_ts]
+
+    def aggregate(self, start_ts, key):
+        """Compute statistics of numeric samples, like Log.aggregate.
+
+        Averages of keys that have a write policy in the log are weighted by
+        how long each value held, and the value published last before the
+        window is carried into it.
+
+        :return: Tuple (count, average, min, max) or None when not all samples
+            are in memory
+        """
+        policy = self._log.write_policy(key)
+        if policy is not None:
+            return self._aggregate_weighted(start_ts, key, policy.heartbeat)
+
+        samples = self.samples(key, start_ts)
+        if samples is None:
+            return None
+
+        values = [_numeric(sample) for sample in samples]
+        values = [value for value in values if value is not None]
+        if not values:
+            return 0, None, None, None
+
+        return len(values), sum(values) / len(values), min(values), max(values)
+
+    def _aggregate_weighted(self, start_ts, key, hold):
+        """Compute statistics weighted like Log.aggregate under write policies.
+
+        :param hold: Maximum number of seconds a value holds, None for no limit
+        """
+        if start_ts is None:
+            return None
+
+        start_ts = _seconds(start_ts)
+        end_ts = _seconds(datetime.datetime.now())
+        with self._lock:
+            samples = [
+                (_seconds(sample.timestamp), _numeric(sample)) for sample in self._samples.get(key, ())
+            ]
+            dropped = self._dropped.get(key)
+            complete_since = max(_seconds(self._started), _seconds(dropped) + 1 if dropped is not None else 0)
+
+        samples = [sample for sample in samples if sample[1] is not None]
+        if not (samples and samples[0][0] <= start_ts):
+            # The value in effect at the start of the window may only be in
+            # the log, unless it can not hold that long.
+            if hold is None or start_ts - hold < complete_since:
+                return None
+
+        count = sum(1 for timestamp, _ in samples if start_ts <= timestamp < end_ts)
+        average, min_value, max_value = weighted_statistics(samples, start_ts, end_ts, hold)
+        if average is None:
+            return 0, None, None, None
+
+        return count, average, min_value, max_value
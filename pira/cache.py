@@ -0,0 +1,76 @@
+"""In-memory cache of recent log entries."""
+import bisect
+import threading
+
+
+class RecentCache(object):
+    """Most recent entries of each key, at most `size` entries and `age`
+    seconds per key.
+
+    Entries are prepared log rows (timestamp, key_id, value, numeric_value).
+    All entries of a key with timestamps at or after its coverage timestamp
+    are in the cache, so windows starting there are answered from memory.
+    Coverage starts when the cache is created and moves forward as entries
+    are evicted. The cache may be used from several threads.
+    """
+
+    def __init__(self, size, age, opened):
+        """Construct cache.
+
+        :param size: Maximum number of entries per key, no entries are cached
+            when it is not positive
+        :param age: Maximum age of entries in seconds, relative to the newest
+            entry of the key
+        :param opened: Timestamp from which entries are cached
+        """
+        self._size = size
+        self._age = age
+        self._opened = opened
+        self._entries = {}
+        self._since = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_id, start_ts):
+        """Return cached entries of a key starting at the given timestamp.
+
+        :return: List of entries or None when the window is not fully cached
+        """
+        with self._lock:
+            if self._size <= 0 or start_ts < self._since.get(key_id, self._opened):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entries = self._entries.get(key_id, [])
+            return entries[bisect.bisect_left([row[0] for row in entries], start_ts):]
+
+    def insert(self, rows):
+        """Add prepared rows to the cache."""
+        if self._size <= 0:
+            return
+
+        with self._lock:
+            for row in rows:
+                key_id = row[1]
+                since = self._since.get(key_id, self._opened)
+                if row[0] < since:
+                    # Older than the cached window, only stored in the database.
+                    continue
+
+                entries = self._entries.setdefault(key_id, [])
+                if not entries or row[0] >= entries[-1][0]:
+                    entries.append(row)
+                else:
+                    entries.insert(bisect.bisect_right([entry[0] for entry in entries], row[0]), row)
+
+                # Evict by count and age, cache coverage starts after the evicted entries.
+                evict = max(0, len(entries) - self._size)
+                while evict < len(entries) and entries[evict][0] < entries[-1][0] - self._age:
+                    evict += 1
+                if evict:
+                    since = max(since, entries[evict - 1][0] + 1)
+                    del entries[:evict]
+
+                self._since[key_id] = since
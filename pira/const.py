@@ -4,6 +4,12 @@ from .messages import MeasurementConfig
 LOG_SYSTEM = 'system'
 LOG_DEVICE_VOLTAGE = 'device.voltage'
 LOG_DEVICE_TEMPERATURE = 'device.temperature'
+LOG_WATCHDOG_OVERRUN = 'watchdog.overrun'
+LOG_BOOT_PROFILE = 'boot.profile'
+LOG_BOOT_DURATION = 'boot.duration'
+LOG_BOOT_UPTIME = 'boot.uptime'
+LOG_SHUTDOWN_DURATION = 'shutdown.duration'
+LOG_SHUTDOWN_ABANDONED = 'shutdown.abandoned'
 
 # Measurement configuration.
 MEASUREMENT_DEVICE_VOLTAGE = MeasurementConfig(LOG_DEVICE_VOLTAGE, lambda value: int(value * 1000))
@@ -0,0 +1,215 @@
+"""Streaming export of log entries.
+
+Entries are exported in timestamp order, either as CSV or in a compact
+columnar format, and written to the output in blocks, so exports of any
+size run in constant memory. Every export can be resumed from a cursor,
+identifying the last entry that was received.
+
+CSV exports have the columns timestamp, id, key and value. The cursor of
+an entry is "<timestamp>:<id>".
+
+Columnar exports start with EXPORT_MAGIC, followed by blocks of:
+- varint: length of the block
+- varint: number of keys in the block, then for each key:
+  - varint length and UTF-8 name of the key
+  - varint length and numeric samples encoded with pira.archive.encode_chunk
+  - varint number of non-numeric entries, then for each entry the zigzag
+    varint timestamp delta to the previous one and varint length and UTF-8
+    value
+- varint timestamp and varint id of the cursor after this block
+
+Numeric values are stored as floats, so their formatting is not kept.
+"""
+import collections
+import csv
+
+from .archive import encode_chunk, decode_chunk, zigzag, unzigzag, write_varint, read_varint
+
+# Header of columnar exports.
+EXPORT_MAGIC = b'PIRALOG\x01'
+
+# Number of entries written at once.
+DEFAULT_BLOCK_ROWS = 4096
+
+
+class _Lines(list):
+    """Collects lines written by a CSV writer as UTF-8."""
+
+    def write(self, line):
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        self.append(line)
+
+
+def _csv_row(entry):
+    """Prepare entry for the CSV writer, which only handles byte strings on
+    Python 2."""
+    if str is not bytes:
+        return entry
+
+    return [item.encode('utf-8') if isinstance(item, type(u'')) else item for item in entry]
+
+
+def _float(value):
+    """Convert value to float, returning None for non-numeric values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _blocks(entries, block_rows):
+    """Split entries into lists of at most block_rows entries."""
+    block = []
+    for entry in entries:
+        block.append(entry)
+        if len(block) == block_rows:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def format_cursor(cursor):
+    """Format (timestamp, id) cursor as text."""
+    return '{}:{}'.format(*cursor)
+
+
+def parse_cursor(text):
+    """Parse cursor text.
+
+    :raises ValueError: When the cursor is malformed
+    """
+    timestamp, entry_id = text.split(':')
+    return int(timestamp), int(entry_id)
+
+
+def export_csv(log, output, keys=None, start_ts=None, end_ts=None, cursor=None, block_rows=DEFAULT_BLOCK_ROWS):
+    """Export log entries as CSV.
+
+    :param log: Log instance
+    :param output: Binary file-like object
+    :param keys: Optional list of measurement keys, defaults to all keys
+    :param start_ts: Optional start datetime
+    :param end_ts: Optional end datetime (exclusive)
+    :param cursor: Optional cursor of the last entry already exported
+    :param block_rows: Number of entries written at once
+    :return: Cursor of the last exported entry
+    """
+    lines = _Lines()
+    writer = csv.writer(lines)
+    writer.writerow(['timestamp', 'id', 'key', 'value'])
+    for block in _blocks(log.iter_entries(keys, start_ts, end_ts, cursor), block_rows):
+        writer.writerows(_csv_row(entry) for entry in block)
+        output.write(b''.join(lines))
+        del lines[:]
+        cursor = block[-1][:2]
+
+    if lines:
+        output.write(b''.join(lines))
+
+    return cursor
+
+
+def export_columnar(log, output, keys=None, start_ts=None, end_ts=None, cursor=None, block_rows=DEFAULT_BLOCK_ROWS):
+    """Export log entries in the columnar format.
+
+    See `export_csv` for the parameters.
+
+    :return: Cursor of the last exported entry
+    """
+    output.write(EXPORT_MAGIC)
+    for block in _blocks(log.iter_entries(keys, start_ts, end_ts, cursor), block_rows):
+        columns = collections.OrderedDict()
+        for timestamp, _, key, value in block:
+            column = columns.setdefault(key, ([], [], []))
+            number = _float(value)
+            if number is not None:
+                column[0].append(timestamp)
+                column[1].append(number)
+            else:
+                column[2].append((timestamp, value))
+
+        data = bytearray()
+        write_varint(data, len(columns))
+        for key, (timestamps, values, texts) in columns.items():
+            name = key.encode('utf-8')
+            write_varint(data, len(name))
+            data.extend(name)
+
+            chunk = encode_chunk(timestamps, values)
+            write_varint(data, len(chunk))
+            data.extend(chunk)
+
+            write_varint(data, len(texts))
+            previous = 0
+            for timestamp, value in texts:
+                value = value.encode('utf-8')
+                write_varint(data, zigzag(timestamp - previous))
+                write_varint(data, len(value))
+                data.extend(value)
+                previous = timestamp
+
+        cursor = block[-1][:2]
+        write_varint(data, cursor[0])
+        write_varint(data, cursor[1])
+
+        header = bytearray()
+        write_varint(header, len(data))
+        output.write(bytes(header + data))
+
+    return cursor
+
+
+def read_columnar(stream):
+    """Read a columnar export.
+
+    Blocks that were cut off are ignored, so the cursor of the last complete
+    block can be used to resume the export.
+
+    :param stream: Binary file-like object
+    :return: Iterator over (cursor, entries) tuples, one for each block, where
+        entries is a list of (timestamp, key, value) tuples ordered by
+        timestamp and values are floats or strings
+    """
+    if stream.read(len(EXPORT_MAGIC)) != EXPORT_MAGIC:
+        raise ValueError("Not a columnar log export.")
+
+    while True:
+        header = bytearray()
+        while not header or header[-1] & 0x80:
+            byte = stream.read(1)
+            if not byte:
+                return
+            header.extend(byte)
+
+        length, _ = read_varint(header, 0)
+        data = bytearray(stream.read(length))
+        if len(data) < length:
+            return
+
+        entries = []
+        count, position = read_varint(data, 0)
+        for _ in range(count):
+            length, position = read_varint(data, position)
+            key = bytes(data[position:position + length]).decode('utf-8')
+            position += length
+
+            length, position = read_varint(data, position)
+            timestamps, values = decode_chunk(data[position:position + length])
+            position += length
+            entries.extend((timestamp, key, value) for timestamp, value in zip(timestamps, values))
+
+            texts, position = read_varint(data, position)
+            timestamp = 0
+            for _ in range(texts):
+                delta, position = read_varint(data, position)
+                timestamp += unzigzag(delta)
+                length, position = read_varint(data, position)
+                entries.append((timestamp, key, bytes(data[position:position + length]).decode('utf-8')))
+                position += length
+
+        timestamp, position = read_varint(data, position)
+        entry_id, position = read_varint(data, position)
+        entries.sort(key=lambda entry: entry[0])
+        yield (timestamp, entry_id), entries
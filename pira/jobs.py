@@ -0,0 +1,75 @@
+from __future__ import print_function
+
+import sys
+import threading
+import traceback
+
+from .trace import monotonic
+
+
+class Job(object):
+    """Call running in a background thread.
+
+    Python 2 has no concurrent.futures, so this is a minimal future. Threads
+    can not be stopped, so a job that is given up on keeps running until the
+    call returns, but it never prevents the process from exiting.
+    """
+
+    def __init__(self, name, target, args=(), on_done=None):
+        """Start job.
+
+        :param name: Job name, used for the thread name
+        :param target: Callable to run
+        :param args: Arguments of the callable
+        :param on_done: Optional callable, called with the job from its thread
+            when the call has finished
+        """
+        self.name = name
+        self.result = None
+        self.exc_info = None
+        self.started = monotonic()
+        self.finished = None
+        self._target = target
+        self._args = args
+        self._on_done = on_done
+        self._done = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """Job thread entry point."""
+        try:
+            self.result = self._target(*self._args)
+        except:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.finished = monotonic()
+            self._done.set()
+
+        if self._on_done is not None:
+            self._on_done(self)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def duration(self):
+        """Running time of the job so far in seconds."""
+        return (self.finished or monotonic()) - self.started
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish.
+
+        :param timeout: Optional timeout in seconds
+        :return: True when the job has finished
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def print_exception(self):
+        """Print traceback of the exception raised by the call, if any."""
+        if self.exc_info is not None:
+            traceback.print_exception(*self.exc_info)
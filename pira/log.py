@@ -1,49 +1,349 @@
+from __future__ import print_function
+
 import datetime
+import heapq
 import os
-import hashlib
+import threading
+import time
+import traceback
 
 import sqlite3
 
+from .archive import decode_chunk
+from .cache import RecentCache
+from .retention import Retention
+from .salvage import check, corrupted_files, quarantine, salvage_file
+from .schema import DEFAULT_STORAGE_PROFILE, ROLLUP_WIDTH, STORAGE_PROFILES, format_numeric, numeric, setup
+from .watchdog import deferred
+from .writepolicy import WRITE_POLICIES, WriteFilter, weighted_statistics
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# NumPy is only needed for array queries.
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
 # Log file location.
 LOG_FILE = '/data/pira-zero-log.db'
 
-# Log schema.
-LOG_TABLE_SCHEMA = '''
-CREATE TABLE IF NOT EXISTS log (
-    id integer primary key,
-    timestamp integer,
-    key varchar,
-    value varchar
-)
+# Upper bound for open-ended time windows.
+MAX_TIMESTAMP = 2 ** 62
+
+# Window statistics, combining whole rollup buckets with raw rows at the edges.
+LOG_AGGREGATE = '''
+SELECT sum(count), total(total), min(min), max(max) FROM log_rollup
+WHERE key_id = :key_id AND bucket >= :first_bucket AND bucket < :last_bucket
+UNION ALL
+SELECT count(numeric_value), total(numeric_value), min(numeric_value), max(numeric_value) FROM log
+WHERE key_id = :key_id AND timestamp >= :start AND timestamp < :first_bucket
+UNION ALL
+SELECT count(numeric_value), total(numeric_value), min(numeric_value), max(numeric_value) FROM log
+WHERE key_id = :key_id AND timestamp >= :last_bucket AND timestamp < :end
+UNION ALL
+SELECT sum(count), total(total), min(min), max(max) FROM log_archive
+WHERE key_id = :key_id AND start_timestamp >= :start AND end_timestamp < :end
 '''
 
-LOG_TABLE_INDEX = '''
-CREATE INDEX IF NOT EXISTS log_timestamp_key_index ON log (timestamp, key)
+# Numeric samples, including the means of compacted rollup buckets.
+LOG_QUERY_NUMERIC = '''
+SELECT bucket, total / count FROM log_rollup
+WHERE key_id = :key_id AND bucket >= :start AND bucket < :end AND width > 60
+UNION ALL
+SELECT timestamp, numeric_value FROM log
+WHERE key_id = :key_id AND timestamp >= :start AND timestamp < :end AND numeric_value IS NOT NULL
 '''
 
-class Log(object):
-    """Persistent log store."""
+LOG_COUNT_NUMERIC = '''
+SELECT
+    (SELECT count(*) FROM log_rollup
+     WHERE key_id = :key_id AND bucket >= :start AND bucket < :end AND width > 60) +
+    (SELECT count(numeric_value) FROM log
+     WHERE key_id = :key_id AND timestamp >= :start AND timestamp < :end)
+'''
 
-    def __init__(self):
-        while True:
-            try:
-                self._db = sqlite3.connect(LOG_FILE)
+# Minimum and maximum sample per slot of a downsampled window, together with
+# the timestamp of the sample. Rollup buckets are timestamped with their start.
+LOG_DOWNSAMPLE_RAW = '''
+SELECT (timestamp - :start) / :width AS slot, timestamp, min(numeric_value) FROM log
+WHERE key_id = :key_id AND timestamp >= :start AND timestamp < :end AND numeric_value IS NOT NULL
+GROUP BY slot
+UNION ALL
+SELECT (timestamp - :start) / :width AS slot, timestamp, max(numeric_value) FROM log
+WHERE key_id = :key_id AND timestamp >= :start AND timestamp < :end AND numeric_value IS NOT NULL
+GROUP BY slot
+'''
+
+LOG_DOWNSAMPLE_ROLLUP = '''
+SELECT (bucket - :start) / :width AS slot, bucket, min(min) FROM log_rollup
+WHERE key_id = :key_id AND bucket >= :start AND bucket < :end AND width > :min_width
+GROUP BY slot
+UNION ALL
+SELECT (bucket - :start) / :width AS slot, bucket, max(max) FROM log_rollup
+WHERE key_id = :key_id AND bucket >= :start AND bucket < :end AND width > :min_width
+GROUP BY slot
+'''
+
+LOG_INSERT = 'INSERT INTO log (timestamp, key_id, value, numeric_value) VALUES(?, ?, ?, ?)'
+
+# Default write buffering configuration. A buffer size of 1 commits every
+# entry immediately.
+DEFAULT_BUFFER_SIZE = 1
+DEFAULT_BUFFER_AGE = 60
+
+# Maximum number of insert batches waiting for the writer thread.
+DEFAULT_QUEUE_SIZE = 1000
+
+# Time limit (in seconds) for the integrity check when opening the log.
+DEFAULT_CHECK_TIMEOUT = 3
+
+# Number of rows fetched at once by array queries.
+DEFAULT_CHUNK_SIZE = 4096
+
+# Default number of points returned by downsampled queries.
+DEFAULT_MAX_POINTS = 500
+
+# Default size of the in-memory cache of recent entries, per key, in entries
+# and in seconds.
+DEFAULT_CACHE_SIZE = 1000
+DEFAULT_CACHE_AGE = 3600
+
+
+def _env_number(name, default, convert=int):
+    """Parse numeric configuration from environment."""
+    try:
+        return convert(os.environ.get(name, default))
+    except ValueError:
+        print("ERROR: Malformed value for '{}', using default.".format(name))
+        return default
+
+
+class Log(Retention):
+    """Persistent log store.
+
+    Inserted entries may be buffered in memory and committed as a single
+    transaction once the buffer holds `buffer_size` entries or the oldest
+    buffered entry is older than `buffer_age` seconds. The buffer is also
+    flushed before queries and when the log is closed.
+
+    When `writer_thread` is enabled, entries are instead handed to a
+    background thread through a bounded queue and the thread performs the
+    (group) commits, so callers never wait on the SD card. Inserts block
+    only when the queue is full. Queries include entries that are queued
+    but not yet written.
+
+    The SQLite journal, synchronous and page settings are taken from one of
+    the `STORAGE_PROFILES`. Existing databases are migrated to the selected
+    profile and to the latest schema when the log is opened.
+
+    Keys are stored as integer ids referencing the keys table. The mapping
+    is cached in memory, so the public API keeps using string keys.
+
+    The most recent entries of each key (at most `cache_size` entries and
+    `cache_age` seconds) are also kept in memory. Queries for windows that
+    are entirely covered by this cache do not touch the database.
+
+    When opening, the database gets a quick integrity check limited to
+    `check_timeout` seconds. A corrupted database is moved aside and the log
+    starts with a fresh one, while a background thread copies all readable
+    rows from the corrupted file into it.
+
+    Old numeric samples can be moved into compressed archive chunks by
+    `archive` or replaced by rollups by `compact` (see pira.retention). All
+    queries and statistics include archived and compacted samples.
 
-                # Create database schema.
-                with self._db:
-                    self._db.execute(LOG_TABLE_SCHEMA)
-                    self._db.execute(LOG_TABLE_INDEX)
+    Queries may also be run from other threads, which use their own
+    database connections. Entries buffered by the thread that opened the
+    log are not visible to them until the buffer is flushed. Entries
+    inserted by other threads are handed over to the thread that opened the
+    log, which writes them with its next insert or flush.
 
+    When `write_policies` are enabled, numeric samples of keys listed in
+    `WRITE_POLICIES` are only written when they change. Statistics of these
+    keys weight each value by how long it held.
+    """
+
+    def __init__(self, filename=None, buffer_size=None, buffer_age=None, writer_thread=None, queue_size=None,
+                 profile=None, cache_size=None, cache_age=None, check_timeout=None, write_policies=None):
+        self._filename = filename or LOG_FILE
+
+        if profile is None:
+            profile = os.environ.get('LOG_STORAGE_PROFILE', DEFAULT_STORAGE_PROFILE)
+        if profile not in STORAGE_PROFILES:
+            print("ERROR: Unknown log storage profile '{}', using default.".format(profile))
+            profile = DEFAULT_STORAGE_PROFILE
+        self._profile = STORAGE_PROFILES[profile]
+
+        if buffer_size is None:
+            buffer_size = _env_number('LOG_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+        if buffer_age is None:
+            buffer_age = _env_number('LOG_BUFFER_AGE', DEFAULT_BUFFER_AGE, float)
+        if writer_thread is None:
+            writer_thread = os.environ.get('LOG_WRITER_THREAD', '0') == '1'
+        if queue_size is None:
+            queue_size = _env_number('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+        if cache_size is None:
+            cache_size = _env_number('LOG_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        if cache_age is None:
+            cache_age = _env_number('LOG_CACHE_AGE', DEFAULT_CACHE_AGE)
+        if check_timeout is None:
+            check_timeout = _env_number('LOG_CHECK_TIMEOUT', DEFAULT_CHECK_TIMEOUT, float)
+        if write_policies is None:
+            write_policies = os.environ.get('LOG_WRITE_POLICY', '0') == '1'
+
+        self._buffer_size = max(1, buffer_size)
+        self._buffer_age = buffer_age
+        self._buffer = []
+        self._buffer_started = None
+        self._key_ids = {}
+        # Held while committing, so queries never see a batch both in the
+        # database and in the pending list of the writer thread.
+        self._commit_lock = threading.Lock()
+
+        # Recent entries of each key.
+        self._cache = RecentCache(cache_size, cache_age, self._convert_timestamp(datetime.datetime.now()))
+
+        # Samples suppressed by write policies are written when the log is
+        # closed, together with the number of suppressed samples.
+        self._filter = WriteFilter(WRITE_POLICIES if write_policies else {})
+
+        # Connections of other threads running queries.
+        self._owner = threading.current_thread()
+        self._readers = threading.local()
+
+        # Entries inserted by other threads, waiting for the owner thread.
+        self._handover = []
+        self._handover_lock = threading.Lock()
+
+        self._db = None
+        try:
+            self._db = self._connect()
+            check(self._db, check_timeout)
+            self._setup()
+        except sqlite3.DatabaseError as error:
+            # Subclasses report locked or full databases, I/O and programming
+            # errors, which starting over does not fix.
+            if type(error) is not sqlite3.DatabaseError:
+                raise
+
+            # Database is malformed, move it aside and re-create. Failing to open
+            # the fresh database is not recoverable here.
+            print("ERROR: Log database is corrupted, starting a new one.")
+            if self._db is not None:
+                self._db.close()
+            quarantine(self._filename)
+            self._db = self._connect()
+            self._setup()
+
+        # Copy readable rows from corrupted databases in the background.
+        self._salvage_stop = threading.Event()
+        self._salvage = None
+        corrupted = corrupted_files(self._filename)
+        if corrupted:
+            self._salvage = threading.Thread(target=self._salvage_loop, args=(corrupted,))
+            self._salvage.daemon = True
+            self._salvage.start()
+
+        self._writer = None
+        if writer_thread:
+            self._queue = queue.Queue(maxsize=max(1, queue_size))
+            # Batches that have been queued but not yet committed.
+            self._pending = []
+            self._pending_lock = threading.Lock()
+
+            self._writer = threading.Thread(target=self._writer_loop)
+            self._writer.daemon = True
+            self._writer.start()
+
+    @property
+    def suppressed_count(self):
+        """Number of samples not written due to write policies."""
+        return self._filter.suppressed_count
+
+    @property
+    def cache_hits(self):
+        """Number of queries answered from the cache of recent entries."""
+        return self._cache.hits
+
+    @property
+    def cache_misses(self):
+        """Number of queries that could not be answered from the cache."""
+        return self._cache.misses
+
+    def _connect(self):
+        """Open a database connection."""
+        db = sqlite3.connect(self._filename)
+        db.execute('PRAGMA synchronous = {}'.format(self._profile.synchronous))
+        db.execute('PRAGMA mmap_size = {}'.format(self._profile.mmap_size))
+        return db
+
+    def _connection(self):
+        """Return a database connection for queries in the calling thread."""
+        if threading.current_thread() is self._owner:
+            return self._db
+
+        db = getattr(self._readers, 'db', None)
+        if db is None:
+            db = self._readers.db = self._connect()
+        return db
+
+    def _salvage_loop(self, paths):
+        """Salvage thread entry point."""
+        db = self._connect()
+        db.execute('PRAGMA busy_timeout = 30000')
+
+        for path in paths:
+            try:
+                rows = salvage_file(db, path, self._salvage_stop)
+            except Exception:
+                # Keep the file for the next start, it may still hold entries.
+                print("ERROR: Failed to salvage log entries from '{}'.".format(path))
+                traceback.print_exc()
+                continue
+
+            if self._salvage_stop.is_set():
+                # Resumed on next start, already copied rows are skipped.
                 break
-            except sqlite3.DatabaseError:
-                # Database may be malformed, rename and re-create.
-                try:
-                    os.rename(
-                        LOG_FILE,
-                        '{}.corrupted.{}'.format(LOG_FILE, hashlib.md5(os.urandom(4)).hexdigest())
-                    )
-                except OSError:
-                    raise
+
+            print("Salvaged {} log entries from '{}'.".format(rows, path))
+            os.rename(path, path.replace('.corrupted.', '.salvaged.'))
+
+        db.close()
+
+    def _setup(self):
+        """Apply storage profile and create or migrate database schema."""
+        setup(self._db, self._profile)
+        self._key_ids = dict(self._db.execute('SELECT name, id FROM keys'))
+
+    def _key_id(self, key, create=False):
+        """Resolve key to its id.
+
+        :param key: Measurement key
+        :param create: Register key if it does not exist yet
+        :return: Key id or None when the key does not exist
+        """
+        try:
+            return self._key_ids[key]
+        except KeyError:
+            pass
+
+        # Keys may also be registered by the salvage thread.
+        row = self._connection().execute('SELECT id FROM keys WHERE name = ?', (key,)).fetchone()
+        if row is None:
+            if not create:
+                return None
+
+            with self._db:
+                self._db.execute('INSERT OR IGNORE INTO keys (name) VALUES (?)', (key,))
+            row = self._db.execute('SELECT id FROM keys WHERE name = ?', (key,)).fetchone()
+
+        self._key_ids[key] = row[0]
+        return row[0]
 
     def _convert_timestamp(self, timestamp):
         if not timestamp:
@@ -57,40 +357,729 @@ class Log(object):
         :param start_ts: Start datetime
         :param key: Measurement key
         :param include_ts: Include timestamps in results
-        :param only_numeric: Skip non-numeric values
+        :param only_numeric: Skip non-numeric values. Compacted history is
+            returned as the mean of each bucket, timestamped with the bucket
+            start.
         """
-        result = self._db.execute(
-            'SELECT timestamp, value FROM log WHERE timestamp >= ? AND key = ?',
-            (self._convert_timestamp(start_ts), key)
+        key_id = self._key_id(key)
+        if key_id is None:
+            return []
+
+        start_ts = self._convert_timestamp(start_ts)
+        cached = self._cached(key_id, start_ts)
+        if cached is not None:
+            value_index = 3 if only_numeric else 2
+            if include_ts:
+                return [(row[0], row[value_index]) for row in cached if row[value_index] is not None]
+
+            return [row[value_index] for row in cached if row[value_index] is not None]
+
+        if only_numeric:
+            sql = LOG_QUERY_NUMERIC
+        else:
+            sql = 'SELECT timestamp, value FROM log WHERE key_id = :key_id AND timestamp >= :start'
+
+        result, pending = self._select(
+            sql,
+            {'key_id': key_id, 'start': start_ts, 'end': MAX_TIMESTAMP},
+            key_id,
+            start_ts,
+            MAX_TIMESTAMP
         )
 
-        values = []
-        for row in result:
-            value = row[1]
-            if only_numeric:
-                try:
-                    value = float(value)
-                except ValueError:
-                    continue
+        # Include entries that have not been written yet.
+        for row in pending:
+            value = row[3] if only_numeric else row[2]
+            if value is not None:
+                result.append((row[0], value))
 
-            if include_ts:
-                values.append((row[0], value))
+        archived = self._archived(key_id, start_ts, MAX_TIMESTAMP)
+        if archived:
+            if not only_numeric:
+                archived = [(timestamp, format_numeric(value)) for timestamp, value in archived]
+            if not result or archived[-1][0] <= result[0][0]:
+                result = archived + result
             else:
-                values.append(value)
+                result = sorted(archived + result, key=lambda row: row[0])
 
-        return values
+        if include_ts:
+            return result
 
-    def insert(self, key, value, timestamp=None):
-        """Insert new log entry."""
+        return [row[1] for row in result]
+
+    def query_array(self, key, start_ts, end_ts=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Query numeric values as NumPy arrays.
+
+        Rows are streamed from the database in chunks of `chunk_size` rows
+        into preallocated arrays.
+
+        :param key: Measurement key
+        :param start_ts: Start datetime
+        :param end_ts: Optional end datetime (exclusive)
+        :param chunk_size: Number of rows fetched at once
+        :return: Tuple (timestamps, values) of int64 and float64 arrays,
+            ordered by timestamp
+        """
+        count, chunks = self._numeric_chunks(key, start_ts, end_ts, chunk_size)
+
+        timestamps = np.empty(count, dtype=np.int64)
+        values = np.empty(count, dtype=np.float64)
+        position = 0
+        for rows in chunks:
+            rows = rows[:count - position]
+            block = np.array(rows, dtype=np.float64).reshape(-1, 2)
+            timestamps[position:position + len(rows)] = block[:, 0]
+            values[position:position + len(rows)] = block[:, 1]
+            position += len(rows)
+
+        timestamps = timestamps[:position]
+        values = values[:position]
+
+        # Entries that have not been written yet may be out of order.
+        if position > 1 and (np.diff(timestamps) < 0).any():
+            order = np.argsort(timestamps, kind='mergesort')
+            timestamps = timestamps[order]
+            values = values[order]
+
+        return timestamps, values
+
+    def iter_query_array(self, key, start_ts, end_ts=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over numeric values in chunks of NumPy arrays.
+
+        Use for windows that are too large to be held in memory. The database
+        read transaction is kept open until the iteration completes.
+
+        :param key: Measurement key
+        :param start_ts: Start datetime
+        :param end_ts: Optional end datetime (exclusive)
+        :param chunk_size: Number of rows per chunk
+        :return: Iterator over (timestamps, values) array tuples
+        """
+        _, chunks = self._numeric_chunks(key, start_ts, end_ts, chunk_size)
+        for rows in chunks:
+            block = np.array(rows, dtype=np.float64).reshape(-1, 2)
+            yield block[:, 0].astype(np.int64), block[:, 1]
+
+    def iter_entries(self, keys=None, start_ts=None, end_ts=None, cursor=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over log entries ordered by timestamp and id.
+
+        Entries are streamed from the database in chunks of `chunk_size` rows
+        per key. Archived samples have an id of 0 and their values are
+        reformatted from floats. Only entries older than all entries that are
+        still buffered or suppressed by a write policy are returned, so
+        exports resumed from the last cursor do not miss any entries. The
+        exception are entries salvaged from a corrupted log, which keep their
+        original timestamps and are not returned after a cursor past them;
+        export the affected window again without a cursor to include them.
+
+        :param keys: Optional list of measurement keys, defaults to all keys
+        :param start_ts: Optional start datetime
+        :param end_ts: Optional end datetime (exclusive)
+        :param cursor: Optional (timestamp, id) tuple of the last entry that
+            was already returned. A cursor pointing at an archived sample
+            repeats all archived samples with its timestamp.
+        :param chunk_size: Number of rows fetched at once
+        :return: Iterator over (timestamp, id, key, value) tuples
+        """
+        self._sync_handover()
+        db = self._connection()
+        if db is self._db and self._writer is None:
+            self.flush()
+
+        if keys is None:
+            keys = [row[0] for row in db.execute('SELECT name FROM keys ORDER BY name')]
+
+        start_ts = self._convert_timestamp(start_ts)
+        written_ts = self._written_until()
+        end_ts = min(self._convert_timestamp(end_ts), written_ts) if end_ts is not None else written_ts
+
+        # Entries must sort after the lower bound.
+        lower = (start_ts, -1)
+        if cursor is not None:
+            lower = max(lower, (cursor[0], cursor[1] if cursor[1] else -1))
+
+        streams = []
+        for key in keys:
+            key_id = self._key_id(key)
+            if key_id is None:
+                continue
+
+            streams.append(self._iter_archived_entries(key, key_id, lower, end_ts))
+            streams.append(self._iter_raw_entries(key, key_id, lower, end_ts, chunk_size))
+
+        return heapq.merge(*streams)
+
+    def _iter_archived_entries(self, key, key_id, lower, end_ts):
+        """Stream archived entries of a key sorting after lower."""
+        _, chunks = self._archive_chunks(key_id, lower[0], end_ts)
+        for chunk in chunks:
+            for timestamp, value in chunk:
+                if (timestamp, 0) > lower:
+                    yield timestamp, 0, key, format_numeric(value)
+
+    def _iter_raw_entries(self, key, key_id, lower, end_ts, chunk_size):
+        """Stream entries of a key sorting after lower, one chunk at a time."""
+        db = self._connection()
+        while True:
+            rows = db.execute(
+                'SELECT timestamp, id, value FROM log '
+                'WHERE key_id = ? AND timestamp >= ? AND timestamp < ? AND (timestamp > ? OR id > ?) '
+                'ORDER BY timestamp, id LIMIT ?',
+                (key_id, lower[0], end_ts, lower[0], lower[1], chunk_size)
+            ).fetchall()
+
+            for timestamp, entry_id, value in rows:
+                yield timestamp, entry_id, key, value
+
+            if len(rows) < chunk_size:
+                return
+            lower = rows[-1][:2]
+
+    def _written_until(self):
+        """Return the timestamp before which all entries have been written."""
+        timestamps = [self._convert_timestamp(datetime.datetime.now())]
+        # Suppressed samples are written with their own timestamps on close.
+        timestamps.extend(self._filter.suppressed_timestamps())
+        with self._handover_lock:
+            timestamps.extend(self._convert_timestamp(entry[2]) for entry in self._handover)
+        if self._writer is not None:
+            with self._pending_lock:
+                timestamps.extend(row[0] for batch in self._pending for row in batch)
+        else:
+            timestamps.extend(row[0] for row in list(self._buffer))
+
+        return min(timestamps)
+
+    def _numeric_chunks(self, key, start_ts, end_ts, chunk_size):
+        """Stream numeric (timestamp, value) rows in chunks.
+
+        :return: Tuple (count, chunks), where chunks is an iterator over lists
+            of at most `chunk_size` rows
+        """
+        if not HAVE_NUMPY:
+            raise RuntimeError("NumPy is required for array queries.")
+
+        key_id = self._key_id(key)
+        if key_id is None:
+            return 0, iter([])
+
+        start_ts = self._convert_timestamp(start_ts)
+        end_ts = self._convert_timestamp(end_ts) if end_ts is not None else MAX_TIMESTAMP
+
+        cached = self._cached(key_id, start_ts)
+        if cached is not None:
+            rows = [(row[0], row[3]) for row in cached if row[0] < end_ts and row[3] is not None]
+            return len(rows), (rows[offset:offset + chunk_size] for offset in range(0, len(rows), chunk_size))
+
+        db = self._connection()
+        if self._writer is None and db is self._db:
+            # Make sure buffered entries are visible.
+            self.flush()
+
+        params = {'key_id': key_id, 'start': start_ts, 'end': end_ts}
+        with self._commit_lock:
+            count = db.execute(LOG_COUNT_NUMERIC, params).fetchone()[0]
+            # Fetching the first chunk starts the read transaction, so later
+            # chunks are consistent with the count.
+            cursor = db.execute(LOG_QUERY_NUMERIC, params)
+            first = cursor.fetchmany(chunk_size)
+            pending = [(row[0], row[3]) for row in self._pending_rows(key_id, start_ts, end_ts) if row[3] is not None]
+
+        archived_count, archived = self._archive_chunks(key_id, start_ts, end_ts)
+
+        def chunks():
+            for rows in archived:
+                for offset in range(0, len(rows), chunk_size):
+                    yield rows[offset:offset + chunk_size]
+
+            rows = first
+            while rows:
+                yield rows
+                rows = cursor.fetchmany(chunk_size)
+
+            # Include entries that have not been written yet.
+            for offset in range(0, len(pending), chunk_size):
+                yield pending[offset:offset + chunk_size]
+
+        return archived_count + count + len(pending), chunks()
+
+    def aggregate(self, start_ts, key, end_ts=None):
+        """Compute statistics of numeric values.
+
+        Whole minutes are answered from the rollup table, only the rows at the
+        edges of the window are read from the log itself. Compacted buckets
+        are attributed to the window containing their start.
+
+        :param start_ts: Start datetime
+        :param key: Measurement key
+        :param end_ts: Optional end datetime (exclusive)
+        :return: Tuple (count, average, min, max), where the statistics are
+            None when there are no numeric values
+        """
+        key_id = self._key_id(key)
+        if key_id is None:
+            return 0, None, None, None
+
+        start_ts = self._convert_timestamp(start_ts)
+        end_ts = self._convert_timestamp(end_ts) if end_ts is not None else MAX_TIMESTAMP
+
+        policy = self._filter.policies.get(key)
+        if policy is not None:
+            return self._aggregate_weighted(key_id, policy, start_ts, end_ts)
+
+        return self._aggregate_written(key_id, start_ts, end_ts)
+
+    def _aggregate_written(self, key_id, start_ts, end_ts):
+        """Compute statistics of the numeric values written to the log."""
+        cached = self._cached(key_id, start_ts)
+        if cached is not None:
+            result = [(1, row[3], row[3], row[3]) for row in cached if row[0] < end_ts and row[3] is not None]
+        else:
+            first_bucket = start_ts + (-start_ts % ROLLUP_WIDTH)
+            last_bucket = max(first_bucket, end_ts - end_ts % ROLLUP_WIDTH)
+            if first_bucket > end_ts:
+                first_bucket = last_bucket = end_ts
+
+            result, pending = self._select(
+                LOG_AGGREGATE,
+                {
+                    'key_id': key_id,
+                    'start': start_ts,
+                    'end': end_ts,
+                    'first_bucket': first_bucket,
+                    'last_bucket': last_bucket,
+                },
+                key_id,
+                start_ts,
+                end_ts
+            )
+
+            # Include entries that have not been written yet.
+            result.extend((1, row[3], row[3], row[3]) for row in pending if row[3] is not None)
+
+            # Archive chunks that extend past the window are filtered by sample.
+            result.extend(
+                (1, value, value, value)
+                for _, value in self._archived(key_id, start_ts, end_ts, partial_only=True)
+            )
+
+        count = 0
+        total = 0.0
+        min_value = None
+        max_value = None
+        for part_count, part_total, part_min, part_max in result:
+            if not part_count:
+                continue
+
+            count += part_count
+            total += part_total
+            min_value = part_min if min_value is None else min(min_value, part_min)
+            max_value = part_max if max_value is None else max(max_value, part_max)
+
+        if not count:
+            return 0, None, None, None
+
+        return count, total / count, min_value, max_value
+
+    def query_downsampled(self, key, start_ts, end_ts=None, max_points=DEFAULT_MAX_POINTS):
+        """Query numeric values reduced for charting.
+
+        The window is split into `max_points` / 2 slots and the minimum and
+        maximum sample of each slot is returned, which preserves spikes.
+        Slots of a minute or longer are computed from the rollup table, so
+        long windows do not read raw rows.
+
+        :param key: Measurement key
+        :param start_ts: Start datetime
+        :param end_ts: Optional end datetime (exclusive), defaults to now
+        :param max_points: Maximum number of returned points
+        :return: List of (timestamp, value) tuples, ordered by timestamp
+        """
+        key_id = self._key_id(key)
+        if key_id is None:
+            return []
+
+        start_ts = self._convert_timestamp(start_ts)
+        if end_ts is None:
+            end_ts = self._convert_timestamp(datetime.datetime.now()) + 1
+        else:
+            end_ts = self._convert_timestamp(end_ts)
+        if end_ts <= start_ts:
+            return []
+
+        slots = max(1, max_points // 2)
+        width = max(1, -(-(end_ts - start_ts) // slots))
+        params = {'key_id': key_id, 'start': start_ts, 'end': end_ts, 'width': width}
+
+        # Rollups include all written raw samples, but are too coarse for
+        # short slots. Compacted rollups are always needed.
+        if width >= ROLLUP_WIDTH:
+            sql = LOG_DOWNSAMPLE_ROLLUP
+            params['min_width'] = 0
+        else:
+            sql = LOG_DOWNSAMPLE_RAW + 'UNION ALL' + LOG_DOWNSAMPLE_ROLLUP
+            params['min_width'] = ROLLUP_WIDTH
+
+        result, pending = self._select(sql, params, key_id, start_ts, end_ts)
+
+        # Samples that are not in the database tables are reduced here.
+        samples = [(row[0], row[3]) for row in pending if row[3] is not None]
+        samples.extend(self._archived(key_id, start_ts, end_ts))
+        result.extend(((timestamp - start_ts) // width, timestamp, value) for timestamp, value in samples)
+
+        extremes = {}
+        for slot, timestamp, value in result:
+            if value is None:
+                continue
+
+            low, high = extremes.setdefault(slot, [(timestamp, value), (timestamp, value)])
+            if value < low[1]:
+                extremes[slot][0] = (timestamp, value)
+            if value > high[1]:
+                extremes[slot][1] = (timestamp, value)
+
+        points = []
+        for slot in sorted(extremes):
+            low, high = sorted(extremes[slot])
+            points.append(low)
+            if high != low:
+                points.append(high)
+
+        return points
+
+    def write_policy(self, key):
+        """Return the write policy applied to a key or None."""
+        return self._filter.policies.get(key)
+
+    def _aggregate_weighted(self, key_id, policy, start_ts, end_ts):
+        """Compute statistics, weighting each value by how long it held.
+
+        The value written last before the window is carried into it. Each
+        value holds until the next one, but at most `heartbeat` seconds and
+        never past the end of the window or the current time. The count
+        includes suppressed samples, which are attributed to the window
+        containing the start of their bucket.
+        """
+        hold = policy.heartbeat
+        window_start = start_ts - (hold or 0)
+        end_ts = min(end_ts, self._convert_timestamp(datetime.datetime.now()))
+
+        cached = self._cached(key_id, window_start)
+        if cached is not None:
+            rows = [(row[0], row[3]) for row in cached if row[3] is not None]
+        else:
+            rows, pending = self._select(
+                LOG_QUERY_NUMERIC,
+                {'key_id': key_id, 'start': window_start, 'end': end_ts},
+                key_id,
+                window_start,
+                end_ts
+            )
+
+            # Include entries that have not been written yet.
+            rows.extend((row[0], row[3]) for row in pending if row[3] is not None)
+            rows.extend(self._archived(key_id, window_start, end_ts))
+            rows.sort()
+
+        # Suppressed samples are still valid readings.
+        suppressed = self._filter.last_suppressed(key_id)
+        if suppressed is not None and (not rows or suppressed[0] > rows[-1][0]):
+            rows.append((suppressed[0], suppressed[3]))
+
+        average, min_value, max_value = weighted_statistics(rows, start_ts, end_ts, hold)
+        if average is None:
+            return 0, None, None, None
+
+        count = self._aggregate_written(key_id, start_ts, end_ts)[0] + self._count_suppressed(key_id, start_ts, end_ts)
+        return count, average, min_value, max_value
+
+    def _count_suppressed(self, key_id, start_ts, end_ts):
+        """Count samples suppressed by the write policy of a key in a window."""
+        count = self._connection().execute(
+            'SELECT total(count) FROM log_suppressed WHERE key_id = ? AND bucket >= ? AND bucket < ?',
+            (key_id, start_ts, end_ts)
+        ).fetchone()[0]
+        count += self._filter.count(key_id, start_ts, end_ts)
+        return int(count)
+
+    def _archive_chunks(self, key_id, start_ts, end_ts, partial_only=False):
+        """Find archive chunks overlapping a window.
+
+        :param partial_only: Only include chunks that extend past the window
+        :return: Tuple (count, chunks), where chunks is an iterator over lists
+            of (timestamp, value) samples within the window, one per chunk
+        """
+        db = self._connection()
+        rows = db.execute(
+            'SELECT id, start_timestamp, end_timestamp, count FROM log_archive '
+            'WHERE key_id = ? AND start_timestamp < ? AND end_timestamp >= ? ORDER BY start_timestamp',
+            (key_id, end_ts, start_ts)
+        ).fetchall()
+
+        def samples(chunk_id):
+            row = db.execute('SELECT data FROM log_archive WHERE id = ?', (chunk_id,)).fetchone()
+            if row is None:
+                # Removed by compaction in the meantime.
+                return []
+
+            timestamps, values = decode_chunk(row[0])
+            return [
+                (timestamp, value) for timestamp, value in zip(timestamps, values)
+                if start_ts <= timestamp < end_ts
+            ]
+
+        # Chunks that extend past the window are decoded right away, so they
+        # can be counted.
+        count = 0
+        chunks = []
+        for chunk_id, first, last, chunk_count in rows:
+            if first >= start_ts and last < end_ts:
+                if not partial_only:
+                    chunks.append(chunk_id)
+                    count += chunk_count
+            else:
+                chunk = samples(chunk_id)
+                chunks.append(chunk)
+                count += len(chunk)
+
+        return count, (samples(chunk) if not isinstance(chunk, list) else chunk for chunk in chunks)
+
+    def _archived(self, key_id, start_ts, end_ts, partial_only=False):
+        """Return archived (timestamp, value) samples within a window."""
+        _, chunks = self._archive_chunks(key_id, start_ts, end_ts, partial_only)
+        return [sample for chunk in chunks for sample in chunk]
+
+    def _cached(self, key_id, start_ts):
+        """Return cached entries of a key starting at the given timestamp.
+
+        :return: List of entries or None when the window is not fully cached
+        """
+        self._sync_handover()
+        if self._handover_rows(key_id, start_ts, MAX_TIMESTAMP):
+            # Entries handed over to the owner thread are not cached yet.
+            return None
+
+        return self._cache.get(key_id, start_ts)
+
+    def _select(self, sql, params, key_id, start_ts, end_ts):
+        """Execute a query.
+
+        :return: Tuple (rows, pending), where pending contains entries for the
+            given key id and time window that have not been written yet
+        """
+        self._sync_handover()
+        db = self._connection()
+        if self._writer is None:
+            # Make sure buffered entries are visible.
+            if db is self._db:
+                self.flush()
+            return db.execute(sql, params).fetchall(), self._handover_rows(key_id, start_ts, end_ts)
+
+        with self._commit_lock:
+            result = db.execute(sql, params).fetchall()
+            pending = self._pending_rows(key_id, start_ts, end_ts)
+
+        return result, pending
+
+    def _pending_rows(self, key_id, start_ts, end_ts):
+        """Return entries for the given key id and time window that are queued
+        for the writer thread or handed over to the owner thread."""
+        rows = self._handover_rows(key_id, start_ts, end_ts)
+        if self._writer is None:
+            return rows
+
+        with self._pending_lock:
+            rows.extend(
+                row for batch in self._pending for row in batch
+                if row[1] == key_id and start_ts <= row[0] < end_ts
+            )
+        return rows
+
+    def _sync_handover(self):
+        """Queue entries handed over by other threads, so queries of the owner
+        thread see them."""
+        if self._handover and threading.current_thread() is self._owner:
+            self.insert_many([])
+
+    def _handover_rows(self, key_id, start_ts, end_ts):
+        """Return entries for the given key id and time window that are handed
+        over to the owner thread, prepared like written rows."""
+        with self._handover_lock:
+            entries = list(self._handover)
+
+        rows = []
+        for key, value, timestamp in entries:
+            if self._key_ids.get(key) != key_id:
+                continue
+
+            timestamp = self._convert_timestamp(timestamp)
+            if start_ts <= timestamp < end_ts:
+                rows.append((timestamp, key_id, str(value), numeric(value)))
+        return rows
+
+    def _prepare(self, key, value, timestamp=None):
+        """Prepare log entry for insertion."""
         if timestamp is None:
             timestamp = datetime.datetime.now()
 
-        with self._db:
-            self._db.execute(
-                'INSERT INTO log (timestamp, key, value) VALUES(?, ?, ?)',
-                (self._convert_timestamp(timestamp), key, str(value))
-            )
+        return (self._convert_timestamp(timestamp), self._key_id(key, create=True), str(value), numeric(value))
+
+    def insert(self, key, value, timestamp=None):
+        """Insert new log entry."""
+        self.insert_many([(key, value, timestamp)])
+
+    def insert_many(self, entries):
+        """Insert multiple log entries in a single transaction.
+
+        :param entries: Iterable of (key, value) or (key, value, timestamp)
+            tuples
+        """
+        if threading.current_thread() is not self._owner:
+            # The database connection and write state belong to the owner
+            # thread, timestamps are taken now.
+            now = datetime.datetime.now()
+            with self._handover_lock:
+                self._handover.extend(
+                    (entry[0], entry[1], entry[2] if entry[2:] and entry[2] else now) for entry in entries
+                )
+            return
+
+        # A budget interruption half way through would lose or duplicate
+        # entries, so it is raised once the entries are queued.
+        with deferred():
+            with self._handover_lock:
+                entries = self._handover + list(entries)
+                self._handover = []
+
+            rows = []
+            for entry in entries:
+                row = self._prepare(*entry)
+                if self._filter.should_write(entry[0], row):
+                    rows.append(row)
+
+            self._append(rows)
+
+    def _append(self, rows):
+        """Append prepared rows to the write buffer and flush if needed."""
+        if not rows:
+            return
+
+        self._cache.insert(rows)
+
+        if self._writer is not None:
+            with self._pending_lock:
+                self._pending.append(rows)
+            # Blocks when the queue is full.
+            self._queue.put(rows)
+            return
+
+        if not self._buffer:
+            self._buffer_started = time.time()
+        self._buffer.extend(rows)
+
+        if len(self._buffer) >= self._buffer_size or time.time() - self._buffer_started >= self._buffer_age:
+            self.flush()
+
+    def flush(self):
+        """Commit all buffered entries.
+
+        When the writer thread is enabled, this waits until all entries queued
+        before the call have been committed.
+        """
+        if self._handover and threading.current_thread() is self._owner:
+            # Queue entries handed over by other threads.
+            self.insert_many([])
+
+        if self._writer is not None:
+            barrier = threading.Event()
+            self._queue.put(barrier)
+            while not barrier.wait(1):
+                if not self._writer.is_alive():
+                    print("ERROR: Log writer thread is not running.")
+                    return
+            return
+
+        if not self._buffer:
+            return
+
+        with deferred():
+            with self._db:
+                self._db.executemany(LOG_INSERT, self._buffer)
+
+            self._buffer = []
+            self._buffer_started = None
+
+    def _writer_loop(self):
+        """Writer thread entry point."""
+        db = self._connect()
+        stop = False
+        while not stop:
+            batches = []
+            barriers = []
+            count = 0
+
+            # Collect batches until the buffer thresholds are reached.
+            item = self._queue.get()
+            deadline = time.time() + self._buffer_age
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, list):
+                    batches.append(item)
+                    count += len(item)
+                else:
+                    barriers.append(item)
+
+                if stop or barriers or count >= self._buffer_size:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+
+            if batches:
+                with self._commit_lock:
+                    try:
+                        with db:
+                            db.executemany(LOG_INSERT, [row for batch in batches for row in batch])
+                    except sqlite3.Error:
+                        print("ERROR: Failed to write {} log entries.".format(count))
+                        traceback.print_exc()
+
+                    with self._pending_lock:
+                        for batch in batches:
+                            self._pending.remove(batch)
+
+            for barrier in barriers:
+                barrier.set()
+
+        db.close()
 
     def close(self):
         """Close log."""
+        # Take entries handed over by other threads, as write policies may
+        # suppress them.
+        self.insert_many([])
+
+        # Write the last readings, so the final values are not extended. They
+        # are no longer counted as suppressed.
+        self._append(self._filter.release())
+
+        if self._salvage is not None:
+            self._salvage_stop.set()
+            self._salvage.join()
+            self._salvage = None
+
+        self.flush()
+
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+        with self._db:
+            for key_id, buckets in self._filter.take_counts().items():
+                self._merge_suppressed(key_id, ROLLUP_WIDTH, buckets)
+
         self._db.close()
@@ -18,23 +18,29 @@ def create_measurements_message(boot, timestamp, measurements):
     In case there is no measurements to report in the given time
     interval, None is returned.
 
+    Measurements published during this wake cycle are taken from the
+    measurement bus, older ones from the log.
+
     :param boot: Boot instance
     :param timestamp: Measuerements start timestamp
     :param measurements: List of measurement types to include, where each
         element is a MeasurementConfig instance
     """
+    bus = getattr(boot, 'bus', None)
     have_measurements = False
     message = io.BytesIO()
     for config in measurements:
-        values = boot.log.query(timestamp, config.log_type, only_numeric=True)
+        statistics = bus.aggregate(timestamp, config.log_type) if bus is not None else None
+        if statistics is None:
+            statistics = boot.log.aggregate(timestamp, config.log_type)
+        count, average, min_value, max_value = statistics
         converter = config.conversion or int
 
         # Compute statistics.
-        if values:
-            count = len(values)
-            average = converter(sum(values) / count)
-            min_value = converter(min(values))
-            max_value = converter(max(values))
+        if count:
+            average = converter(average)
+            min_value = converter(min_value)
+            max_value = converter(max_value)
             have_measurements = True
         else:
             count = 0
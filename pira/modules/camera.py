@@ -12,6 +12,17 @@ from ..hardware import bq2429x
 # Image storage location.
 CAMERA_STORAGE_PATH = '/data/camera'
 
+# Persistent state.
+STATE_LAST_SNAPSHOT = 'camera.last_snapshot'
+
+
+def snapshot_interval():
+    """Interval between snapshots or None when disabled."""
+    try:
+        return datetime.timedelta(minutes=int(os.environ.get('SNAPSHOT_INTERVAL', 'off')))
+    except ValueError:
+        return None
+
 
 class Module(object):
     def __init__(self, boot):
@@ -30,10 +41,7 @@ class Module(object):
         except ValueError:
             self.video_duration_min = None
 
-        try:
-            self.snapshot_interval= datetime.timedelta(minutes=int(self.snapshot_interval_conf))
-        except ValueError:
-            self.snapshot_interval = None
+        self.snapshot_interval = snapshot_interval()
 
         self.light_level = 0.0
         try:
@@ -114,6 +122,13 @@ class Module(object):
         )
         self._recording_start = now
 
+    @staticmethod
+    def is_due(boot):
+        """Check if a snapshot should be taken in this wake cycle."""
+        interval = snapshot_interval()
+        last_snapshot = boot.state[STATE_LAST_SNAPSHOT]
+        return interval is None or last_snapshot is None or datetime.datetime.now() - last_snapshot >= interval
+
     def process(self, modules):
         # This runs if camera is initialized
         if self._camera:
@@ -167,6 +182,7 @@ class Module(object):
         if self._check_light_conditions():
             now = datetime.datetime.now()
             self._last_snapshot = now
+            self._boot.state[STATE_LAST_SNAPSHOT] = now
 
             self._camera.capture(
                 os.path.join(
@@ -179,8 +195,8 @@ class Module(object):
                         minute=now.minute,
                         second=now.second,
                         light=self.light_level,
-                        voltage=float(self._boot.sensor_mcp.get_voltage()),
-                        temperature=float(self._boot.rtc.temperature),
+                        voltage=self._boot.sensors.voltage,
+                        temperature=float(self._boot.sensors.temperature),
                     )
                 ),
                 format='jpeg'
@@ -1,26 +1,36 @@
 from __future__ import print_function
 
 from ..hardware import bq2429x
+from .ultrasonic import LOG_ULTRASONIC_DISTANCE
 
 
 class Module(object):
+    # Measurements that are reported when published by a loaded module.
+    subscribes = [LOG_ULTRASONIC_DISTANCE]
+
     def __init__(self, boot):
         self._boot = boot
+        self._distance = None
+        boot.bus.subscribe(LOG_ULTRASONIC_DISTANCE, self._update_distance)
+
+    def _update_distance(self, sample):
+        self._distance = sample
 
     def process(self, modules):
         print('===============================================')
-        print('BQ2429x  : status - VBUS_STAT : ' + str(self._boot.sensor_bq.get_status(bq2429x.VBUS_STAT)))
-        print('BQ2429x  : status - CHRG_STAT : ' + str(self._boot.sensor_bq.get_status(bq2429x.CHRG_STAT)))
-        print('BQ2429x  : status - PG_STAT ---- : ' + str(self._boot.sensor_bq.get_status(bq2429x.PG_STAT)))
-        print('MCP3021  : status - voltage --: ' + str(self._boot.sensor_mcp.get_voltage()) + 'V')
+        print('BQ2429x  : status - VBUS_STAT : ' + str(self._boot.sensors.charger_status(bq2429x.VBUS_STAT)))
+        print('BQ2429x  : status - CHRG_STAT : ' + str(self._boot.sensors.charger_status(bq2429x.CHRG_STAT)))
+        print('BQ2429x  : status - PG_STAT ---- : ' + str(self._boot.sensors.charger_status(bq2429x.PG_STAT)))
+        print('MCP3021  : status - voltage --: {:.3f}V'.format(self._boot.sensors.voltage))
         print('Charging : {}'.format(self._boot.is_charging))
         print('RTC      : {}'.format(self._boot.rtc.current_time))
-        print('Temp.    : {}'.format(self._boot.rtc.temperature))
+        print('Temp.    : {}'.format(self._boot.sensors.temperature))
+        print('I2C saved: {}'.format(self._boot.sensors.i2c_transactions_saved))
         print('RTC Stat.: {}'.format(bin(self._boot.rtc.status)[2:]))
 
         # Report distance measured by ultrasonic module if enabled.
-        if 'pira.modules.ultrasonic' in modules:
-            print('Distance : {}'.format(modules['pira.modules.ultrasonic'].distance))
+        if self._distance is not None:
+            print('Distance : {} ({})'.format(self._distance.value, self._distance.timestamp))
 
     def shutdown(self, modules):
         """Shutdown module."""
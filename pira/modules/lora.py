@@ -11,9 +11,11 @@ import RPi.GPIO as gpio
 from ..hardware import devices, lora
 from ..const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE
 from ..messages import create_measurements_message
+from .ultrasonic import LOG_ULTRASONIC_DISTANCE, MEASUREMENT_ULTRASONIC_DISTANCE
 
 # Persistent state.
 STATE_FRAME_COUNTER = 'lora.frame_counter'
+STATE_LAST_TRANSMISSION = 'lora.last_transmission'
 
 
 class LoRa(lora.LoRa):
@@ -23,6 +25,11 @@ class LoRa(lora.LoRa):
 
 
 class Module(object):
+    # Measurements that are reported when published by a loaded module.
+    subscribes = [LOG_ULTRASONIC_DISTANCE]
+    # Time budget (in seconds), transmission may take up to 30 seconds.
+    budget = 45
+
     def __init__(self, boot):
         self._boot = boot
         self._lora = None
@@ -40,6 +47,14 @@ class Module(object):
         except:
             self._enabled = False
 
+    @staticmethod
+    def is_due(boot):
+        """Check if the processing interval has passed since the last transmission."""
+        interval = boot.module_intervals.get(__name__) or boot.loop_interval
+        last_transmission = boot.state[STATE_LAST_TRANSMISSION]
+        return last_transmission is None or \
+            datetime.datetime.now() - last_transmission >= datetime.timedelta(seconds=interval)
+
     def _decode_hex(self, name, length):
         """Decode hex-encoded environment variable."""
         value = [ord(x) for x in os.environ.get(name, '').decode('hex')]
@@ -94,8 +109,7 @@ class Module(object):
             MEASUREMENT_DEVICE_VOLTAGE,
         ]
 
-        if 'pira.modules.ultrasonic' in modules:
-            from .ultrasonic import MEASUREMENT_ULTRASONIC_DISTANCE
+        if self._boot.bus.publishers(LOG_ULTRASONIC_DISTANCE):
             measurements.append(MEASUREMENT_ULTRASONIC_DISTANCE)
 
         message = create_measurements_message(self._boot, self._last_update, measurements)
@@ -131,6 +145,7 @@ class Module(object):
         self._lora.clear_irq_flags(TxDone=1)
 
         self._last_update = datetime.datetime.now()
+        self._boot.state[STATE_LAST_TRANSMISSION] = self._last_update
         self._frame_counter += 1
         self._boot.state[STATE_FRAME_COUNTER] = self._frame_counter % 2**16
 
@@ -15,7 +15,16 @@ from ..messages import create_measurements_message
 from ..hardware import bq2429x
 
 
+# Timeout (in seconds) for pushing data.
+NODEWATCHER_TIMEOUT = 20
+
+
 class Module(object):
+    @staticmethod
+    def is_due(boot):
+        """Pushing data needs wifi, which is not started in a lean wake cycle."""
+        return False
+
     def __init__(self, boot):
         self._boot = boot
 
@@ -27,13 +36,13 @@ class Module(object):
                 'device_temperature': {
                     'name': 'Temperature',
                     'unit': 'C',
-                    'value': str(self._boot.rtc.temperature),
+                    'value': str(self._boot.sensors.temperature),
                     'group': 'temperature'
                 },
                 'device_voltage': {
                     'name': 'Voltage',
                     'unit': 'V',
-                    'value': str(self._boot.sensor_mcp.get_voltage()),
+                    'value': str(self._boot.sensors.voltage),
                     'group': 'voltage'
                 }
             }
@@ -71,7 +80,8 @@ class Module(object):
                 headers={
                     'X-Nodewatcher-Signature-Algorithm': 'hmac-sha256',
                     'X-Nodewatcher-Signature': signature,
-                }
+                },
+                timeout=NODEWATCHER_TIMEOUT
             )
             print("Nodewatcher data pushed successfully")
             #print("Nodewatcher data pushed successfully: {} {} {}".format(nodewatcher_uri,body,signature))
@@ -13,22 +13,35 @@ import RPi.GPIO as gpio
 from ..hardware import devices, rockblock
 from ..const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE
 from ..messages import create_measurements_message
+from .ultrasonic import LOG_ULTRASONIC_DISTANCE, MEASUREMENT_ULTRASONIC_DISTANCE
 
 # Persistent state.
 STATE_POWERED_ON_TIME = 'rockblock.powered_on_time'
 STATE_RETRIES = 'rockblock.retries'
 
 
+def report_interval():
+    """Reporting interval (in hours)."""
+    try:
+        return int(os.environ.get('ROCKBLOCK_REPORT_INTERVAL', '24'))
+    except ValueError:
+        print("ERROR: Malformed Rockblock reporting interval.")
+        return 24
+
+
 class Module(object):
+    # Measurements that are reported when published by a loaded module.
+    subscribes = [LOG_ULTRASONIC_DISTANCE]
+    # Time budget (in seconds), waiting for signal and retrying sessions takes a while.
+    budget = 600
+    # Process in a background job, so the main loop keeps running while we wait.
+    background = True
+
     def __init__(self, boot):
         self._boot = boot
 
         # Power on interval (in hours).
-        try:
-            self._interval = int(os.environ.get('ROCKBLOCK_REPORT_INTERVAL', '24'))
-        except ValueError:
-            print("ERROR: Malformed Rockblock reporting interval.")
-            self._interval = 24
+        self._interval = report_interval()
 
         # Maximum number of retries.
         try:
@@ -38,13 +51,22 @@ class Module(object):
 
         self._power = False
 
+    @staticmethod
+    def is_due(boot):
+        """Check if measurements should be reported in this wake cycle."""
+        powered_on_time = boot.state[STATE_POWERED_ON_TIME]
+        return powered_on_time is None or \
+            datetime.datetime.now() - powered_on_time >= datetime.timedelta(hours=report_interval())
+
     def process(self, modules):
         # Check if we have powered on the modem today.
         current_time = datetime.datetime.now()
         powered_on_time = self._boot.state[STATE_POWERED_ON_TIME]
         if powered_on_time is not None and current_time - powered_on_time < datetime.timedelta(hours=self._interval):
             print("Already transmitted measurements today, not powering up Rockblock.")
-            return
+            # Check again when the reporting interval has passed.
+            next_report = powered_on_time + datetime.timedelta(hours=self._interval)
+            return (next_report - current_time).total_seconds()
 
         # Power up modem. We leave it powered on until a message is successfully delivered or
         # we go back to sleep (whichever comes first).
@@ -71,8 +93,7 @@ class Module(object):
             MEASUREMENT_DEVICE_VOLTAGE,
         ]
 
-        if 'pira.modules.ultrasonic' in modules:
-            from .ultrasonic import MEASUREMENT_ULTRASONIC_DISTANCE
+        if self._boot.bus.publishers(LOG_ULTRASONIC_DISTANCE):
             measurements.append(MEASUREMENT_ULTRASONIC_DISTANCE)
 
         message = create_measurements_message(self._boot, powered_on_time, measurements)
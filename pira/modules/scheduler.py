@@ -11,6 +11,10 @@ except ImportError:
 
 
 class Module(object):
+    # The wakeup alarm must be programmed before halting, even when other
+    # modules have used up the shutdown time.
+    shutdown_required = True
+
     def __init__(self, boot):
         self._boot = boot
         self._ready = False
@@ -80,6 +84,14 @@ class Module(object):
         except ValueError:
             return None
 
+    def _parse_voltage(self, voltage):
+        """Parse voltage threshold string (in volts)."""
+        try:
+            return float(voltage)
+        except ValueError:
+            print("WARNING: Ignoring malformed voltage threshold.")
+            return 0.0
+
     def process(self, modules):
         """Check if we need to shutdown."""
         if not self._ready:
@@ -96,13 +108,13 @@ class Module(object):
             return
 
         # Check voltage to configure boot interval
-        voltage = self._boot.sensor_mcp.get_voltage()
+        voltage = self._boot.sensors.voltage
 
-        if not voltage > os.environ.get('POWER_THRESHOLD_HALF', '0'):
+        if not voltage > self._parse_voltage(os.environ.get('POWER_THRESHOLD_HALF', '0')):
             # Lower voltage then half threshold, doubling the sleep length
             self._off_duration = self._off_duration * 2
             print("Low voltage warning, doubling sleep duration")
-        elif not voltage > os.environ.get('POWER_THRESHOLD_QUART', '0'):
+        elif not voltage > self._parse_voltage(os.environ.get('POWER_THRESHOLD_QUART', '0')):
             # Less voltage then quarter threshold, quadrupling the sleep length
             self._off_duration = self._off_duration * 4
             print("Low voltage warning, quadrupling sleep duration")
@@ -11,6 +11,9 @@ MEASUREMENT_ULTRASONIC_DISTANCE = MeasurementConfig(LOG_ULTRASONIC_DISTANCE, int
 
 
 class Module(object):
+    # Measurements published on the measurement bus.
+    publishes = [LOG_ULTRASONIC_DISTANCE]
+
     # Last measured distance that can be accessed by other modules.
     distance = None
 
@@ -25,8 +28,8 @@ class Module(object):
             print("ERROR: Ultrasonic device not connected.")
             return
 
-        # Record measurement in log.
-        self._boot.log.insert(LOG_ULTRASONIC_DISTANCE, self.distance)
+        # Record measurement in log and make it available to other modules.
+        self._boot.bus.publish(LOG_ULTRASONIC_DISTANCE, self.distance)
 
     def shutdown(self, modules):
         """Shutdown module."""
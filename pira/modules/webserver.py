@@ -1,15 +1,123 @@
 from __future__ import print_function
 
+import datetime
+import json
 import os
 import SimpleHTTPServer
 import SocketServer
 import threading
+import traceback
+import urlparse
+
+from .. import export
 
 WEBSERVER_PORT = 80
 WEBSERVER_DIRECTORY = '/data'
 
+# Path of the downsampled log query endpoint.
+WEBSERVER_LOG_PATH = '/api/log'
+# Path of the log export endpoint.
+WEBSERVER_EXPORT_PATH = '/api/export'
+
+
+class RequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Serves files, downsampled log queries and log exports.
+
+    Log queries take the parameters `key`, `start` and `end` (UNIX
+    timestamps) and `points` and return a JSON list of [timestamp, value]
+    pairs, for example:
+
+        /api/log?key=device.voltage&start=1500000000&points=500
+
+    Log exports take the optional parameters `format` (`csv` or
+    `columnar`), `keys` (comma separated), `start`, `end` and `cursor` and
+    stream the entries in the given format (see pira.export), for example:
+
+        /api/export?format=columnar&cursor=1500000000:1234
+    """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == WEBSERVER_EXPORT_PATH:
+            return self._export(urlparse.parse_qs(url.query))
+        if url.path != WEBSERVER_LOG_PATH:
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+        params = urlparse.parse_qs(url.query)
+        try:
+            key = params['key'][0]
+            start = datetime.datetime.fromtimestamp(int(params.get('start', [0])[0]))
+            end = params.get('end')
+            if end:
+                end = datetime.datetime.fromtimestamp(int(end[0]))
+            else:
+                end = None
+            points = int(params.get('points', [500])[0])
+        except (KeyError, ValueError):
+            self.send_error(400, "Expected parameters key, start, end and points.")
+            return
+
+        try:
+            result = self.server.log.query_downsampled(key, start, end, max_points=points)
+        except:
+            print("Error while querying log.")
+            traceback.print_exc()
+            self.send_error(500)
+            return
+
+        body = json.dumps(result)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _export(self, params):
+        """Stream log export."""
+        try:
+            output_format = params.get('format', ['csv'])[0]
+            if output_format not in ('csv', 'columnar'):
+                raise ValueError
+            keys = params.get('keys')
+            if keys:
+                keys = keys[0].split(',')
+            start = params.get('start')
+            if start:
+                start = datetime.datetime.fromtimestamp(int(start[0]))
+            end = params.get('end')
+            if end:
+                end = datetime.datetime.fromtimestamp(int(end[0]))
+            cursor = params.get('cursor')
+            if cursor:
+                cursor = export.parse_cursor(cursor[0])
+        except ValueError:
+            self.send_error(400, "Expected parameters format, keys, start, end and cursor.")
+            return
+
+        self.send_response(200)
+        if output_format == 'csv':
+            self.send_header('Content-Type', 'text/csv')
+            exporter = export.export_csv
+        else:
+            self.send_header('Content-Type', 'application/octet-stream')
+            exporter = export.export_columnar
+        self.end_headers()
+
+        # The client resumes from the last complete entry or block when the
+        # connection breaks.
+        try:
+            exporter(self.server.log, self.wfile, keys or None, start or None, end or None, cursor or None)
+        except:
+            print("Error while exporting log.")
+            traceback.print_exc()
+
 
 class Module(object):
+    @staticmethod
+    def is_due(boot):
+        """Serving files needs wifi, which is not started in a lean wake cycle."""
+        return False
+
     def __init__(self, boot):
         self._boot = boot
 
@@ -24,8 +132,9 @@ class Module(object):
         os.chdir(WEBSERVER_DIRECTORY)
         httpd = SocketServer.TCPServer(
             ("", WEBSERVER_PORT),
-            SimpleHTTPServer.SimpleHTTPRequestHandler
+            RequestHandler
         )
+        httpd.log = self._boot.log
         httpd.serve_forever()
 
     def process(self, modules):
@@ -0,0 +1,411 @@
+"""Retention and archiving of old log entries.
+
+Old raw samples are either moved into compressed archive chunks or replaced
+by rollup buckets of increasing width, in small steps, so the work can be
+spread over many wake cycles.
+"""
+import collections
+import datetime
+import sqlite3
+import time
+
+from .archive import encode_chunk, decode_chunk
+from .schema import ROLLUP_WIDTH
+
+# Retention policy. Raw samples older than `raw` are replaced by rollup
+# buckets of increasing width. `tiers` is a list of (width, age) tuples, where
+# buckets of the given width (in seconds) are kept until they are older than
+# age. An age of None keeps the last tier forever and a `raw` of None disables
+# compaction for the key. Tier widths must be multiples of each other.
+RetentionPolicy = collections.namedtuple('RetentionPolicy', ['raw', 'tiers'])
+
+DEFAULT_RETENTION_POLICY = RetentionPolicy(
+    datetime.timedelta(days=7),
+    [
+        (600, datetime.timedelta(days=90)),
+        (3600, None),
+    ]
+)
+
+RETENTION_POLICIES = {
+    # System events are rare and not numeric, keep them.
+    'system': RetentionPolicy(None, []),
+}
+
+# Maximum number of rows rewritten by a single compaction run.
+DEFAULT_COMPACT_ROWS = 500
+
+# Numeric samples older than this are moved into compressed archive chunks
+# of at most ARCHIVE_CHUNK_ROWS samples. Archive runs stop after moving about
+# DEFAULT_ARCHIVE_ROWS samples.
+DEFAULT_ARCHIVE_AGE = datetime.timedelta(days=1)
+ARCHIVE_CHUNK_ROWS = 1024
+DEFAULT_ARCHIVE_ROWS = 4096
+
+
+def _seconds(delta):
+    """Convert timedelta to whole seconds."""
+    return int(delta.total_seconds())
+
+
+class Retention(object):
+    """Retention methods of Log.
+
+    Expects the database connection of the owner thread in `_db`, the commit
+    lock in `_commit_lock`, the key ids in `_key_ids` and the storage profile
+    in `_profile`.
+    """
+
+    def compact(self, max_rows=DEFAULT_COMPACT_ROWS, timeout=None, now=None):
+        """Apply retention policies incrementally.
+
+        Raw samples past their retention are replaced by downsampled rollup
+        buckets in small transactions, stopping after rewriting about
+        `max_rows` rows or after `timeout` seconds, so repeated calls spread
+        the work over many wake cycles.
+
+        :param max_rows: Maximum number of rows to rewrite
+        :param timeout: Optional time limit in seconds
+        :param now: Current datetime, defaults to now
+        :return: Tuple (rows, bytes) reclaimed, turning archive chunks into
+            rollup buckets is not counted as reclaimed rows
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        now = self._convert_timestamp(now)
+
+        # Make sure buffered entries are not compacted twice.
+        if self._writer is None:
+            self.flush()
+
+        started = time.time()
+        used_before = self._used_bytes()
+        budget = max_rows
+        reclaimed = 0
+        for key, key_id in sorted(self._key_ids.items()):
+            policy = RETENTION_POLICIES.get(key, DEFAULT_RETENTION_POLICY)
+            if policy.raw is None:
+                continue
+
+            processed, removed = self._compact_key(key_id, policy, now, budget)
+            budget -= processed
+            reclaimed += removed
+            if budget <= 0 or (timeout is not None and time.time() - started >= timeout):
+                break
+
+        self._vacuum()
+        return max(0, reclaimed), max(0, used_before - self._used_bytes())
+
+    def archive(self, age=None, max_rows=DEFAULT_ARCHIVE_ROWS, timeout=None, now=None):
+        """Move old numeric samples into compressed archive chunks.
+
+        Samples older than `age` are encoded in chunks of whole minutes and
+        their per-minute rollups are dropped, as the chunk keeps statistics
+        of its samples. Non-numeric entries and keys excluded from retention
+        stay in the log. Archived samples are replaced by rollup buckets by
+        `compact` like raw ones.
+
+        :param age: Minimum age of archived samples as timedelta
+        :param max_rows: Approximate maximum number of samples to archive
+        :param timeout: Optional time limit in seconds
+        :param now: Current datetime, defaults to now
+        :return: Tuple (rows, bytes) with the number of archived samples and
+            reclaimed bytes
+        """
+        if age is None:
+            age = DEFAULT_ARCHIVE_AGE
+        if now is None:
+            now = datetime.datetime.now()
+        horizon = self._convert_timestamp(now) - _seconds(age)
+        horizon -= horizon % ROLLUP_WIDTH
+
+        # Make sure buffered entries are archived as well.
+        if self._writer is None:
+            self.flush()
+
+        started = time.time()
+        used_before = self._used_bytes()
+        archived = 0
+        for key, key_id in sorted(self._key_ids.items()):
+            if RETENTION_POLICIES.get(key, DEFAULT_RETENTION_POLICY).raw is None:
+                continue
+
+            while archived < max_rows and (timeout is None or time.time() - started < timeout):
+                count = self._archive_key(key_id, horizon)
+                if not count:
+                    break
+                archived += count
+
+            if archived >= max_rows or (timeout is not None and time.time() - started >= timeout):
+                break
+
+        self._vacuum()
+        return archived, used_before - self._used_bytes()
+
+    def _archive_key(self, key_id, horizon):
+        """Archive the oldest numeric samples of a key into a single chunk.
+
+        :return: Number of archived samples
+        """
+        rows = self._db.execute(
+            'SELECT timestamp, numeric_value FROM log '
+            'WHERE key_id = ? AND timestamp < ? AND numeric_value IS NOT NULL ORDER BY timestamp LIMIT ?',
+            (key_id, horizon, ARCHIVE_CHUNK_ROWS)
+        ).fetchall()
+        if not rows:
+            return 0
+
+        if len(rows) == ARCHIVE_CHUNK_ROWS:
+            # Only archive whole minutes, as their rollups are dropped.
+            boundary = rows[-1][0] - rows[-1][0] % ROLLUP_WIDTH
+            whole = [row for row in rows if row[0] < boundary]
+            if whole:
+                rows = whole
+            else:
+                rows = self._db.execute(
+                    'SELECT timestamp, numeric_value FROM log '
+                    'WHERE key_id = ? AND timestamp < ? AND numeric_value IS NOT NULL ORDER BY timestamp',
+                    (key_id, boundary + ROLLUP_WIDTH)
+                ).fetchall()
+
+        timestamps = [row[0] for row in rows]
+        values = [row[1] for row in rows]
+        data = encode_chunk(timestamps, values)
+
+        with self._commit_lock, self._db:
+            self._db.execute(
+                'INSERT INTO log_archive (key_id, start_timestamp, end_timestamp, count, total, min, max, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key_id, timestamps[0], timestamps[-1], len(rows), sum(values), min(values), max(values),
+                 sqlite3.Binary(data))
+            )
+            self._db.execute(
+                'DELETE FROM log WHERE key_id = ? AND timestamp >= ? AND timestamp <= ? AND numeric_value IS NOT NULL',
+                (key_id, timestamps[0], timestamps[-1])
+            )
+            self._db.execute(
+                'DELETE FROM log_rollup WHERE key_id = ? AND width = ? AND bucket >= ? AND bucket <= ?',
+                (key_id, ROLLUP_WIDTH, timestamps[0] - timestamps[0] % ROLLUP_WIDTH, timestamps[-1])
+            )
+
+        return len(rows)
+
+    def _vacuum(self):
+        """Return free pages to the filesystem."""
+        if self._profile.auto_vacuum == 'incremental':
+            # Each step of this pragma frees a single page, executescript runs it
+            # to completion.
+            with self._commit_lock:
+                self._db.executescript('PRAGMA incremental_vacuum;')
+
+    def _compact_key(self, key_id, policy, now, budget):
+        """Apply retention policy to a single key.
+
+        :return: Tuple (processed, removed) with the number of rows rewritten
+            and the net number of rows removed
+        """
+        processed = 0
+        removed = 0
+        raw_horizon = now - _seconds(policy.raw)
+
+        # Turn archived samples past retention into rollup buckets of the first
+        # tier, or drop them without tiers.
+        width = policy.tiers[0][0] if policy.tiers else None
+        while processed < budget:
+            restored = self._unarchive(key_id, raw_horizon - raw_horizon % (width or 1), width)
+            if not restored:
+                break
+            processed += restored
+
+        # Merge rollup buckets into wider ones, tier by tier.
+        horizon = raw_horizon
+        for width, age in policy.tiers:
+            for coarsen in (self._coarsen, self._coarsen_suppressed):
+                merged, created = coarsen(key_id, width, horizon - horizon % width, budget - processed)
+                processed += merged
+                removed += merged - created
+            if age is None:
+                break
+
+            horizon = now - _seconds(age)
+        else:
+            # Drop buckets that are older than the last tier.
+            for table in ('log_rollup', 'log_suppressed'):
+                with self._commit_lock, self._db:
+                    count = self._db.execute(
+                        'DELETE FROM {0} WHERE key_id = ? AND bucket IN ('
+                        'SELECT bucket FROM {0} WHERE key_id = ? AND bucket + width <= ? '
+                        'ORDER BY bucket LIMIT ?)'.format(table),
+                        (key_id, key_id, horizon, max(0, budget - processed))
+                    ).rowcount
+                processed += count
+                removed += count
+
+        # Remove raw samples, but only where their rollups have been merged, so
+        # that queries never miss compacted history.
+        frontier = raw_horizon
+        if policy.tiers:
+            width = policy.tiers[0][0]
+            frontier -= frontier % width
+            unmerged = self._db.execute(
+                'SELECT min(bucket) FROM log_rollup WHERE key_id = ? AND width < ? AND bucket < ?',
+                (key_id, width, frontier)
+            ).fetchone()[0]
+            if unmerged is not None:
+                frontier = unmerged
+
+        with self._commit_lock, self._db:
+            count = self._db.execute(
+                'DELETE FROM log WHERE id IN ('
+                'SELECT id FROM log WHERE key_id = ? AND timestamp < ? ORDER BY timestamp LIMIT ?)',
+                (key_id, frontier, max(0, budget - processed))
+            ).rowcount
+        processed += count
+        removed += count
+
+        return processed, removed
+
+    def _coarsen(self, key_id, width, horizon, limit):
+        """Merge rollup buckets narrower than width that start before horizon.
+
+        :return: Tuple (merged, created) with the number of merged buckets and
+            the number of newly created wide buckets
+        """
+        if limit <= 0:
+            return 0, 0
+
+        rows = self._db.execute(
+            'SELECT bucket, count, total, min, max FROM log_rollup '
+            'WHERE key_id = ? AND width < ? AND bucket < ? ORDER BY bucket LIMIT ?',
+            (key_id, width, horizon, limit)
+        ).fetchall()
+        if not rows:
+            return 0, 0
+
+        groups = collections.OrderedDict()
+        for bucket, count, total, min_value, max_value in rows:
+            group = groups.setdefault(bucket - bucket % width, [0, 0.0, min_value, max_value])
+            group[0] += count
+            group[1] += total
+            group[2] = min(group[2], min_value)
+            group[3] = max(group[3], max_value)
+
+        with self._commit_lock, self._db:
+            self._db.executemany(
+                'DELETE FROM log_rollup WHERE key_id = ? AND bucket = ?',
+                [(key_id, row[0]) for row in rows]
+            )
+            created = self._merge_rollups(key_id, width, groups)
+
+        return len(rows), created
+
+    def _coarsen_suppressed(self, key_id, width, horizon, limit):
+        """Merge suppressed sample counts narrower than width that start before
+        horizon.
+
+        :return: Tuple (merged, created) with the number of merged buckets and
+            the number of newly created wide buckets
+        """
+        if limit <= 0:
+            return 0, 0
+
+        rows = self._db.execute(
+            'SELECT bucket, count FROM log_suppressed '
+            'WHERE key_id = ? AND width < ? AND bucket < ? ORDER BY bucket LIMIT ?',
+            (key_id, width, horizon, limit)
+        ).fetchall()
+        if not rows:
+            return 0, 0
+
+        counts = collections.OrderedDict()
+        for bucket, count in rows:
+            group = bucket - bucket % width
+            counts[group] = counts.get(group, 0) + count
+
+        with self._commit_lock, self._db:
+            self._db.executemany(
+                'DELETE FROM log_suppressed WHERE key_id = ? AND bucket = ?',
+                [(key_id, row[0]) for row in rows]
+            )
+            created = self._merge_suppressed(key_id, width, counts)
+
+        return len(rows), created
+
+    def _unarchive(self, key_id, horizon, width):
+        """Replace the oldest archive chunk ending before horizon by rollup
+        buckets of the given width.
+
+        :param width: Bucket width, the chunk is dropped when it is None
+        :return: Number of samples in the chunk
+        """
+        row = self._db.execute(
+            'SELECT id, count, data FROM log_archive WHERE key_id = ? AND end_timestamp < ? '
+            'ORDER BY start_timestamp LIMIT 1',
+            (key_id, horizon)
+        ).fetchone()
+        if row is None:
+            return 0
+
+        chunk_id, count, data = row
+        groups = collections.OrderedDict()
+        if width is not None:
+            timestamps, values = decode_chunk(data)
+            for timestamp, value in zip(timestamps, values):
+                group = groups.setdefault(timestamp - timestamp % width, [0, 0.0, value, value])
+                group[0] += 1
+                group[1] += value
+                group[2] = min(group[2], value)
+                group[3] = max(group[3], value)
+
+        with self._commit_lock, self._db:
+            self._db.execute('DELETE FROM log_archive WHERE id = ?', (chunk_id,))
+            self._merge_rollups(key_id, width, groups)
+
+        return count
+
+    def _merge_rollups(self, key_id, width, groups):
+        """Merge statistics into rollup buckets, within a transaction.
+
+        :param groups: Mapping of bucket start to [count, total, min, max]
+        :return: Number of newly created buckets
+        """
+        created = 0
+        for bucket, (count, total, min_value, max_value) in groups.items():
+            created += self._db.execute(
+                'INSERT OR IGNORE INTO log_rollup (key_id, bucket, width, count, total, min, max) '
+                'VALUES (?, ?, ?, 0, 0, ?, ?)',
+                (key_id, bucket, width, min_value, max_value)
+            ).rowcount
+            self._db.execute(
+                'UPDATE log_rollup SET count = count + ?, total = total + ?, min = min(min, ?), max = max(max, ?) '
+                'WHERE key_id = ? AND bucket = ?',
+                (count, total, min_value, max_value, key_id, bucket)
+            )
+
+        return created
+
+    def _merge_suppressed(self, key_id, width, counts):
+        """Merge suppressed sample counts into buckets, within a transaction.
+
+        :param counts: Mapping of bucket start to number of suppressed samples
+        :return: Number of newly created buckets
+        """
+        created = 0
+        for bucket, count in counts.items():
+            created += self._db.execute(
+                'INSERT OR IGNORE INTO log_suppressed (key_id, bucket, width, count) VALUES (?, ?, ?, 0)',
+                (key_id, bucket, width)
+            ).rowcount
+            self._db.execute(
+                'UPDATE log_suppressed SET count = count + ? WHERE key_id = ? AND bucket = ?',
+                (count, key_id, bucket)
+            )
+
+        return created
+
+    def _used_bytes(self):
+        """Return the number of bytes used by database pages holding data."""
+        page_size = self._db.execute('PRAGMA page_size').fetchone()[0]
+        page_count = self._db.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = self._db.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free_pages) * page_size
@@ -0,0 +1,223 @@
+"""Integrity check and salvage of corrupted log databases.
+
+A corrupted log is moved aside and replaced by a new one, into which all
+readable rows of the corrupted file are copied in the background.
+"""
+from __future__ import print_function
+
+import glob
+import hashlib
+import numbers
+import os
+import sqlite3
+import time
+import zlib
+
+from .archive import decode_chunk
+from .schema import numeric
+
+# Number of rows copied at once when salvaging a corrupted log.
+SALVAGE_BATCH_SIZE = 500
+
+# Unreadable rows are skipped in steps that double after SALVAGE_BATCH_SIZE
+# consecutive failures, up to SALVAGE_MAX_STEP ids. When the number of rows
+# in a corrupted log is unknown, salvage gives up after SALVAGE_MAX_FAILURES
+# consecutive failures.
+SALVAGE_MAX_STEP = 2 ** 20
+SALVAGE_MAX_FAILURES = SALVAGE_BATCH_SIZE + 100
+
+
+def check(db, timeout):
+    """Run a quick integrity check, giving up after timeout seconds.
+
+    :raises sqlite3.DatabaseError: When the database is corrupted, which
+        is the only case raising this exact class
+    """
+    if timeout <= 0:
+        return
+
+    deadline = time.time() + timeout
+    db.set_progress_handler(lambda: time.time() > deadline, 10000)
+    try:
+        result = db.execute('PRAGMA quick_check').fetchall()
+    except sqlite3.OperationalError:
+        if time.time() <= deadline:
+            raise
+
+        print("Log integrity check did not complete in {} seconds, skipping.".format(timeout))
+        return
+    finally:
+        db.set_progress_handler(None, 0)
+
+    if result != [('ok',)]:
+        raise sqlite3.DatabaseError("integrity check failed: {}".format(result[0][0]))
+
+
+def quarantine(filename):
+    """Move a corrupted database (and its journals) aside."""
+    corrupted = '{}.corrupted.{}'.format(filename, hashlib.md5(os.urandom(4)).hexdigest())
+    os.rename(filename, corrupted)
+
+    for suffix in ('-wal', '-journal'):
+        try:
+            os.rename(filename + suffix, corrupted + suffix)
+        except OSError:
+            pass
+
+    try:
+        os.remove(filename + '-shm')
+    except OSError:
+        pass
+
+
+def corrupted_files(filename):
+    """Return paths of corrupted databases of a log that wait for salvage."""
+    return [
+        path for path in sorted(glob.glob(filename + '.corrupted.*'))
+        if not path.endswith(('-wal', '-journal'))
+    ]
+
+
+def salvage_file(db, path, stop):
+    """Copy readable rows of a corrupted database into the log.
+
+    Rows that are already present are skipped, so salvage can be resumed.
+
+    :param db: Connection to the log
+    :param path: Path of the corrupted database
+    :param stop: Event that interrupts the salvage when set
+    :return: Number of copied rows
+    """
+    source = sqlite3.connect(path)
+    try:
+        tables = set(row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        if 'log' not in tables:
+            return 0
+
+        key_names = {}
+        if 'keys' in tables:
+            try:
+                key_names = dict(source.execute('SELECT id, name FROM keys'))
+            except sqlite3.DatabaseError:
+                print("WARNING: Failed to read keys from '{}'.".format(path))
+            sql = 'SELECT id, timestamp, key_id, value FROM log WHERE id > ? ORDER BY id LIMIT ?'
+        else:
+            sql = 'SELECT id, timestamp, key, value FROM log WHERE id > ? ORDER BY id LIMIT ?'
+
+        try:
+            max_id = source.execute('SELECT max(id) FROM log').fetchone()[0] or 0
+        except sqlite3.DatabaseError:
+            max_id = None
+
+        key_ids = {}
+        copied = 0
+        failures = 0
+        last_id = 0
+        batch = SALVAGE_BATCH_SIZE
+        while not stop.is_set() and (max_id is None or last_id < max_id):
+            if max_id is None and failures >= SALVAGE_MAX_FAILURES:
+                print("WARNING: Giving up on unreadable rows in '{}' after id {}.".format(path, last_id))
+                break
+
+            try:
+                rows = source.execute(sql, (last_id, batch)).fetchall()
+            except sqlite3.DatabaseError:
+                if batch > 1:
+                    # Narrow down the unreadable range.
+                    batch //= 2
+                    continue
+
+                # Skip the unreadable row. Steps grow after many failures, so
+                # that large damaged ranges are passed quickly.
+                failures += 1
+                last_id += _skip_step(failures)
+                continue
+
+            if not rows:
+                break
+
+            # A damaged index may return rows out of order, never go backwards.
+            rows = [row for row in rows if isinstance(row[0], numbers.Integral) and row[0] > last_id]
+            if not rows:
+                failures += 1
+                last_id += _skip_step(failures)
+                continue
+
+            failures = 0
+            batch = SALVAGE_BATCH_SIZE
+            last_id = max(row[0] for row in rows)
+
+            entries = []
+            for _, timestamp, key, value in rows:
+                if key_names:
+                    key = key_names.get(key)
+                if key is None or not isinstance(timestamp, numbers.Real):
+                    continue
+
+                if key not in key_ids:
+                    db.execute('INSERT OR IGNORE INTO keys (name) VALUES (?)', (key,))
+                    key_ids[key] = db.execute('SELECT id FROM keys WHERE name = ?', (key,)).fetchone()[0]
+
+                entries.append((timestamp, key_ids[key], value, numeric(value), key_ids[key], timestamp, value))
+
+            with db:
+                copied += sum(
+                    db.execute(
+                        'INSERT INTO log (timestamp, key_id, value, numeric_value) SELECT ?, ?, ?, ? '
+                        'WHERE NOT EXISTS (SELECT 1 FROM log WHERE key_id = ? AND timestamp = ? AND value = ?)',
+                        entry
+                    ).rowcount
+                    for entry in entries
+                )
+
+        if 'log_archive' in tables and not stop.is_set():
+            copied += _salvage_archive(db, source, key_names, path)
+
+        return copied
+    finally:
+        source.close()
+
+
+def _skip_step(failures):
+    """Number of ids skipped after consecutive failures to read a row."""
+    if failures <= SALVAGE_BATCH_SIZE:
+        return 1
+    return min(2 ** (failures - SALVAGE_BATCH_SIZE), SALVAGE_MAX_STEP)
+
+
+def _salvage_archive(db, source, key_names, path):
+    """Copy readable archive chunks of a corrupted database.
+
+    :return: Number of copied samples
+    """
+    try:
+        chunks = source.execute(
+            'SELECT key_id, start_timestamp, end_timestamp, count, total, min, max, data FROM log_archive'
+        ).fetchall()
+    except sqlite3.DatabaseError:
+        print("WARNING: Failed to read archive from '{}'.".format(path))
+        return 0
+
+    copied = 0
+    for chunk in chunks:
+        key = key_names.get(chunk[0])
+        if key is None:
+            continue
+
+        try:
+            decode_chunk(chunk[7])
+        except (zlib.error, ValueError, IndexError, TypeError):
+            continue
+
+        with db:
+            db.execute('INSERT OR IGNORE INTO keys (name) VALUES (?)', (key,))
+            key_id = db.execute('SELECT id FROM keys WHERE name = ?', (key,)).fetchone()[0]
+            if db.execute(
+                'INSERT INTO log_archive (key_id, start_timestamp, end_timestamp, count, total, min, max, data) '
+                'SELECT ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS ('
+                'SELECT 1 FROM log_archive WHERE key_id = ? AND start_timestamp = ? AND end_timestamp = ?)',
+                (key_id,) + tuple(chunk[1:]) + (key_id, chunk[1], chunk[2])
+            ).rowcount:
+                copied += chunk[3]
+
+    return copied
@@ -0,0 +1,299 @@
+"""Log database schema, migrations and storage profiles.
+
+The schema version is tracked in the database user_version and databases
+written by any earlier version are migrated when the log is opened.
+"""
+from __future__ import print_function
+
+import collections
+
+# Log schema.
+LOG_TABLE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS log (
+    id integer primary key,
+    timestamp integer,
+    key varchar,
+    value varchar
+)
+'''
+
+
+def _columns(db, table):
+    """Return column names of a table, empty when it does not exist."""
+    return [row[1] for row in db.execute('PRAGMA table_info({})'.format(table))]
+
+
+def _add_column(table, definition):
+    """Migration step adding a column unless it already exists."""
+    def step(db):
+        if definition.split()[0] not in _columns(db, table):
+            db.execute('ALTER TABLE {} ADD COLUMN {}'.format(table, definition))
+
+    return step
+
+
+def _intern_keys(db):
+    """Migration step replacing key names in the log and rollups by key ids.
+
+    Logs migrated by earlier versions may have been left with only part of
+    this step applied, so the state of each table is checked and the rest of
+    the step is completed.
+    """
+    db.execute('CREATE TABLE IF NOT EXISTS keys (id integer primary key, name varchar unique)')
+
+    columns = _columns(db, 'log')
+    if 'key' in columns:
+        db.execute('INSERT OR IGNORE INTO keys (name) SELECT DISTINCT key FROM log WHERE key IS NOT NULL')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS log_interned (
+                id integer primary key,
+                timestamp integer,
+                key_id integer,
+                value varchar,
+                numeric_value real
+            )
+        ''')
+        db.execute('''
+            INSERT OR IGNORE INTO log_interned (id, timestamp, key_id, value, numeric_value)
+            SELECT log.id, log.timestamp, keys.id, log.value, {}
+            FROM log JOIN keys ON keys.name = log.key
+        '''.format('log.numeric_value' if 'numeric_value' in columns else 'pira_numeric(log.value)'))
+        db.execute('DROP TABLE log')
+    if 'key_id' not in columns:
+        db.execute('ALTER TABLE log_interned RENAME TO log')
+
+    columns = _columns(db, 'log_rollup')
+    if 'key' in columns:
+        db.execute('INSERT OR IGNORE INTO keys (name) SELECT DISTINCT key FROM log_rollup WHERE key IS NOT NULL')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS log_rollup_interned (
+                key_id integer,
+                bucket integer,
+                count integer,
+                total real,
+                min real,
+                max real,
+                PRIMARY KEY (key_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+        db.execute('''
+            INSERT OR IGNORE INTO log_rollup_interned (key_id, bucket, count, total, min, max)
+            SELECT keys.id, log_rollup.bucket, log_rollup.count, log_rollup.total, log_rollup.min, log_rollup.max
+            FROM log_rollup JOIN keys ON keys.name = log_rollup.key
+        ''')
+        db.execute('DROP TABLE log_rollup')
+    if 'key_id' not in columns:
+        db.execute('ALTER TABLE log_rollup_interned RENAME TO log_rollup')
+
+
+# Schema migrations, tracked in the database user_version. Each element is
+# a list of steps that upgrade the schema by one version, in a single
+# transaction. A step is a statement or a function taking the connection.
+# Steps must be safe to repeat, as logs migrated by earlier versions may have
+# been interrupted half way.
+LOG_MIGRATIONS = [
+    # Version 1: replace (timestamp, key) index with a covering (key, timestamp) one.
+    [
+        'DROP INDEX IF EXISTS log_timestamp_key_index',
+        'CREATE INDEX IF NOT EXISTS log_key_timestamp_index ON log (key, timestamp, value)',
+    ],
+    # Version 2: typed numeric values, so numeric queries run inside SQLite.
+    [
+        _add_column('log', 'numeric_value real'),
+        'UPDATE log SET numeric_value = pira_numeric(value)',
+        'DROP INDEX IF EXISTS log_key_timestamp_index',
+        'CREATE INDEX IF NOT EXISTS log_key_timestamp_numeric_index ON log (key, timestamp, numeric_value)',
+    ],
+    # Version 3: per-minute rollups of numeric values, maintained on insert.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS log_rollup (
+            key varchar,
+            bucket integer,
+            count integer,
+            total real,
+            min real,
+            max real,
+            PRIMARY KEY (key, bucket)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS log_rollup_insert AFTER INSERT ON log
+        WHEN new.numeric_value IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO log_rollup (key, bucket, count, total, min, max)
+            VALUES (new.key, new.timestamp - new.timestamp % 60, 0, 0, new.numeric_value, new.numeric_value);
+
+            UPDATE log_rollup
+            SET count = count + 1,
+                total = total + new.numeric_value,
+                min = min(min, new.numeric_value),
+                max = max(max, new.numeric_value)
+            WHERE key = new.key AND bucket = new.timestamp - new.timestamp % 60;
+        END
+        ''',
+        '''
+        INSERT OR REPLACE INTO log_rollup (key, bucket, count, total, min, max)
+        SELECT key, timestamp - timestamp % 60, count(numeric_value), total(numeric_value),
+               min(numeric_value), max(numeric_value)
+        FROM log
+        WHERE numeric_value IS NOT NULL
+        GROUP BY key, timestamp - timestamp % 60
+        ''',
+    ],
+    # Version 4: store keys in a dimension table and reference them by id.
+    [
+        _intern_keys,
+        'CREATE INDEX IF NOT EXISTS log_key_timestamp_numeric_index ON log (key_id, timestamp, numeric_value)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS log_rollup_insert AFTER INSERT ON log
+        WHEN new.numeric_value IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO log_rollup (key_id, bucket, count, total, min, max)
+            VALUES (new.key_id, new.timestamp - new.timestamp % 60, 0, 0, new.numeric_value, new.numeric_value);
+
+            UPDATE log_rollup
+            SET count = count + 1,
+                total = total + new.numeric_value,
+                min = min(min, new.numeric_value),
+                max = max(max, new.numeric_value)
+            WHERE key_id = new.key_id AND bucket = new.timestamp - new.timestamp % 60;
+        END
+        ''',
+    ],
+    # Version 5: rollup buckets of different widths, created by compaction.
+    [
+        _add_column('log_rollup', 'width integer NOT NULL DEFAULT 60'),
+    ],
+    # Version 6: compressed chunks of archived numeric samples.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS log_archive (
+            id integer primary key,
+            key_id integer,
+            start_timestamp integer,
+            end_timestamp integer,
+            count integer,
+            total real,
+            min real,
+            max real,
+            data blob
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS log_archive_key_start_index ON log_archive (key_id, start_timestamp)',
+    ],
+    # Version 7: number of samples not written due to write policies, per bucket.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS log_suppressed (
+            key_id integer,
+            bucket integer,
+            width integer NOT NULL DEFAULT 60,
+            count integer,
+            PRIMARY KEY (key_id, bucket)
+        ) WITHOUT ROWID
+        ''',
+    ],
+]
+
+# Width of rollup buckets (in seconds).
+ROLLUP_WIDTH = 60
+
+# SQLite storage profile. A page size or auto vacuum mode of None keeps the
+# existing setting.
+StorageProfile = collections.namedtuple(
+    'StorageProfile',
+    ['journal_mode', 'synchronous', 'page_size', 'mmap_size', 'auto_vacuum']
+)
+
+STORAGE_PROFILES = {
+    # SQLite defaults: rollback journal with full synchronous writes.
+    'legacy': StorageProfile('delete', 'full', None, 0, None),
+    # Write-ahead log, only syncing on checkpoints. Survives power loss without
+    # corruption, but may lose the last few transactions.
+    'sdcard': StorageProfile('wal', 'normal', 4096, 32 * 1024 * 1024, 'incremental'),
+    # No syncing at all, for benchmarks and units with a reliable power supply.
+    'fast': StorageProfile('wal', 'off', 4096, 64 * 1024 * 1024, 'incremental'),
+}
+AUTO_VACUUM_MODES = {'none': 0, 'full': 1, 'incremental': 2}
+DEFAULT_STORAGE_PROFILE = 'sdcard'
+
+
+def numeric(value):
+    """Convert value to float, returning None for non-numeric values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_numeric(value):
+    """Format archived numeric value as a log value."""
+    if value.is_integer():
+        return str(int(value))
+
+    return repr(value)
+
+
+def migrate(db, steps):
+    """Apply the steps of a schema migration."""
+    for step in steps:
+        if callable(step):
+            step(db)
+        else:
+            db.execute(step)
+
+
+def setup(db, profile):
+    """Apply storage profile and create or migrate database schema.
+
+    :param db: Database connection
+    :param profile: StorageProfile
+    """
+    page_size = profile.page_size
+    auto_vacuum = profile.auto_vacuum
+    if not db.execute('SELECT count(*) FROM sqlite_master').fetchone()[0]:
+        # New database, page layout can be set before creating the schema.
+        if page_size:
+            db.execute('PRAGMA page_size = {}'.format(page_size))
+        if auto_vacuum:
+            db.execute('PRAGMA auto_vacuum = {}'.format(auto_vacuum))
+    elif (page_size and db.execute('PRAGMA page_size').fetchone()[0] != page_size) or \
+            (auto_vacuum and db.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_MODES[auto_vacuum]):
+        # Page size can only be changed outside WAL mode and, like auto vacuum,
+        # requires a rebuild.
+        print("Changing log page layout, this may take a while.")
+        db.execute('PRAGMA journal_mode = delete')
+        if page_size:
+            db.execute('PRAGMA page_size = {}'.format(page_size))
+        if auto_vacuum:
+            db.execute('PRAGMA auto_vacuum = {}'.format(auto_vacuum))
+        db.execute('VACUUM')
+
+    db.execute('PRAGMA journal_mode = {}'.format(profile.journal_mode))
+
+    # Create database schema. Later versions replace the log table, so it
+    # is only created for new databases.
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if not version:
+        with db:
+            db.execute(LOG_TABLE_SCHEMA)
+
+    # Apply migrations. Python 2 sqlite3 commits before schema statements,
+    # so transactions are managed explicitly.
+    db.create_function('pira_numeric', 1, numeric)
+    isolation_level = db.isolation_level
+    db.isolation_level = None
+    try:
+        for version, steps in enumerate(LOG_MIGRATIONS[version:], version + 1):
+            print("Migrating log schema to version {}.".format(version))
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                migrate(db, steps)
+                db.execute('PRAGMA user_version = {}'.format(version))
+            except:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+    finally:
+        db.isolation_level = isolation_level
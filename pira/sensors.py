@@ -0,0 +1,83 @@
+from __future__ import print_function
+
+import collections
+import os
+import threading
+
+from .trace import monotonic
+
+# Default time (in seconds) for which a reading is reused.
+DEFAULT_SENSOR_TTL = 10
+
+# Number of I2C transactions needed for a single reading.
+I2C_TRANSACTIONS = {
+    'voltage': 50,
+    'temperature': 2,
+    'charger_status': 1,
+}
+
+
+class Sensors(object):
+    """Device readings shared by the core and all modules.
+
+    Each device is read at most once within the TTL, the main loop refreshes
+    all readings at the start of every measurement tick.
+    """
+
+    def __init__(self, boot, ttl=None):
+        """Construct sensor snapshot.
+
+        :param boot: Boot instance with initialized device drivers
+        :param ttl: Time in seconds for which readings are reused
+        """
+        if ttl is None:
+            try:
+                ttl = float(os.environ.get('SENSOR_TTL', DEFAULT_SENSOR_TTL))
+            except ValueError:
+                print("ERROR: Malformed sensor TTL.")
+                ttl = DEFAULT_SENSOR_TTL
+
+        self._boot = boot
+        self._ttl = ttl
+        self._readings = {}
+        self._lock = threading.Lock()
+        self.reads = collections.Counter()
+        self.hits = collections.Counter()
+
+    def _get(self, name, read, *args):
+        """Return cached reading or read the device."""
+        key = (name,) + args
+        with self._lock:
+            reading = self._readings.get(key)
+            if reading is not None and monotonic() - reading[0] < self._ttl:
+                self.hits[name] += 1
+                return reading[1]
+
+            value = read(*args)
+            self._readings[key] = (monotonic(), value)
+            self.reads[name] += 1
+            return value
+
+    def refresh(self):
+        """Discard all readings, so they are read again on first use."""
+        with self._lock:
+            self._readings.clear()
+
+    @property
+    def voltage(self):
+        """Battery voltage in volts, 0 when the ADC can not be read."""
+        return self._get('voltage', lambda: float(self._boot.sensor_mcp.get_voltage()))
+
+    @property
+    def temperature(self):
+        """RTC temperature in degrees Celsius."""
+        return self._get('temperature', lambda: self._boot.rtc.temperature)
+
+    def charger_status(self, status_type):
+        """Charger status of given type (e.g. `bq2429x.CHRG_STAT`)."""
+        return self._get('charger_status', self._boot.sensor_bq.get_status, status_type)
+
+    @property
+    def i2c_transactions_saved(self):
+        """Number of I2C transactions avoided by reusing readings."""
+        return sum(I2C_TRANSACTIONS[name] * hits for name, hits in self.hits.items())
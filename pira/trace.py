@@ -0,0 +1,145 @@
+from __future__ import print_function
+
+import contextlib
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+import traceback
+
+# Monotonic clock for measuring durations, Python 2 only has the wall clock.
+monotonic = getattr(time, 'monotonic', time.time)
+
+# Trace storage location.
+TRACE_DIRECTORY = '/data/traces'
+
+# Default number of trace files that are kept.
+DEFAULT_TRACE_RETENTION = 20
+
+# Maximum number of events recorded in a single trace, further events are dropped.
+MAX_TRACE_EVENTS = 20000
+
+
+class Tracer(object):
+    """Records timed spans of a wake cycle.
+
+    Traces are written in the Chrome trace event format, one file per boot,
+    and can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self, directory=TRACE_DIRECTORY, retention=None):
+        """Construct tracer.
+
+        :param directory: Directory where traces are stored
+        :param retention: Number of trace files that are kept, `0` disables
+            tracing
+        """
+        if retention is None:
+            try:
+                retention = int(os.environ.get('TRACE_RETENTION', DEFAULT_TRACE_RETENTION))
+            except ValueError:
+                print("ERROR: Malformed trace retention.")
+                retention = DEFAULT_TRACE_RETENTION
+
+        self.enabled = retention > 0
+        self.dropped = 0
+        self.metadata = {}
+        self._directory = directory
+        self._retention = retention
+        self._started = monotonic()
+        self._boot_time = datetime.datetime.now()
+        self._filename = os.path.join(directory, 'trace-{}.json'.format(self._boot_time.strftime('%Y%m%d-%H%M%S')))
+        self._pid = os.getpid()
+        self._threads = {}
+        self._events = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, category='boot', **args):
+        """Record the duration of a block of code."""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.complete(name, start, monotonic() - start, category, **args)
+
+    def complete(self, name, start, duration, category='boot', **args):
+        """Record a span.
+
+        :param name: Span name
+        :param start: Start time as returned by `monotonic`
+        :param duration: Duration in seconds
+        :param category: Span category
+        """
+        self._record({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self._started) * 1e6,
+            'dur': duration * 1e6,
+            'args': args,
+        })
+
+    def instant(self, name, category='boot', **args):
+        """Record a point in time."""
+        self._record({
+            'name': name,
+            'cat': category,
+            'ph': 'i',
+            's': 'p',
+            'ts': (monotonic() - self._started) * 1e6,
+            'args': args,
+        })
+
+    def _record(self, event):
+        if not self.enabled:
+            return
+
+        thread = threading.current_thread()
+        event['pid'] = self._pid
+        event['tid'] = thread.ident
+        with self._lock:
+            if len(self._events) >= MAX_TRACE_EVENTS:
+                self.dropped += 1
+                return
+
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = thread.name
+            self._events.append(event)
+
+    def save(self):
+        """Write trace file and remove the oldest trace files."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'args': {'name': 'pira'}})
+        for tid, name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}})
+
+        metadata = dict(self.metadata)
+        metadata['boot_time'] = self._boot_time.isoformat()
+        metadata['dropped_events'] = self.dropped
+
+        try:
+            try:
+                os.makedirs(self._directory)
+            except OSError:
+                pass
+
+            # Replace the previous version of this trace atomically.
+            with open(self._filename + '.tmp', 'w') as trace_file:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata}, trace_file)
+            os.rename(self._filename + '.tmp', self._filename)
+
+            traces = sorted(glob.glob(os.path.join(self._directory, 'trace-*.json')), key=os.path.getmtime)
+            for filename in traces[:-self._retention]:
+                os.remove(filename)
+        except (IOError, OSError):
+            print("Error while saving trace.")
+            traceback.print_exc()
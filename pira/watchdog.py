@@ -0,0 +1,83 @@
+from __future__ import print_function
+
+import contextlib
+import signal
+import threading
+
+# Interval (in seconds) at which an overrunning call is interrupted again, in
+# case a module catches the exception and carries on.
+WATCHDOG_REPEAT = 1.0
+
+# Deferred sections of the current thread, see deferred().
+_sections = threading.local()
+
+
+class BudgetExceeded(Exception):
+    """Raised in a call that has exceeded its time budget."""
+
+
+class Watchdog(object):
+    """Enforces time budgets of calls made in the main thread.
+
+    When a budget runs out, SIGALRM interrupts the call by raising
+    BudgetExceeded, which also interrupts blocking sleeps, serial reads and
+    socket operations. Budgets can not be nested.
+    """
+
+    def __init__(self):
+        """Construct watchdog, must be called from the main thread."""
+        self._armed = False
+        self._thread = threading.current_thread()
+        signal.signal(signal.SIGALRM, self._alarm)
+
+    def _alarm(self, signum, frame):
+        if not self._armed:
+            return
+        if getattr(_sections, 'depth', 0):
+            # Raised when the deferred section is left.
+            _sections.pending = True
+            return
+        raise BudgetExceeded()
+
+    @contextlib.contextmanager
+    def budget(self, seconds):
+        """Interrupt the block of code after the given number of seconds.
+
+        :param seconds: Time budget, no budget is enforced when it is None
+            or when not called from the main thread
+        """
+        if seconds is None or threading.current_thread() is not self._thread:
+            yield
+            return
+
+        self._armed = True
+        signal.setitimer(signal.ITIMER_REAL, max(seconds, 0.001), WATCHDOG_REPEAT)
+        try:
+            yield
+        finally:
+            self._armed = False
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            _sections.pending = False
+
+
+@contextlib.contextmanager
+def deferred():
+    """Defer budget interruptions until the block of code has completed.
+
+    Used around writes that must not be left half done. An interruption that
+    arrives inside the block is raised when the outermost block is left.
+    """
+    depth = getattr(_sections, 'depth', 0)
+    _sections.depth = depth + 1
+    try:
+        yield
+    except BaseException:
+        if not depth:
+            _sections.pending = False
+        raise
+    finally:
+        _sections.depth = depth
+
+    if not depth and getattr(_sections, 'pending', False):
+        _sections.pending = False
+        raise BudgetExceeded()
@@ -0,0 +1,150 @@
+"""Change-only logging of numeric measurements.
+
+Keys with a write policy are only written when their value changes, and
+their statistics weight each value by how long it held.
+"""
+import collections
+
+from .schema import ROLLUP_WIDTH
+
+# Write policy. A numeric sample is not written when it differs from the
+# last written sample of the key by at most `deadband` or when it comes less
+# than `min_interval` seconds after it, unless `heartbeat` seconds (None for
+# never) have passed since. The last value of a key is considered to hold
+# until the next written sample, but at most `heartbeat` seconds. Suppressed
+# samples are only counted. The deadband of quantized readings must be below
+# the quantum, otherwise single steps are lost.
+WritePolicy = collections.namedtuple('WritePolicy', ['deadband', 'min_interval', 'heartbeat'])
+
+WRITE_POLICIES = {
+    # Averaged 10-bit ADC readings, jitter by a few millivolts.
+    'device.voltage': WritePolicy(0.02, 0, 600),
+    # DS3231 temperature is quantized to 0.25 degrees, only write changes.
+    'device.temperature': WritePolicy(0.1, 0, 600),
+}
+
+
+def weighted_statistics(samples, start_ts, end_ts, hold=None):
+    """Compute statistics, weighting each value by how long it held.
+
+    Each value holds until the next sample, but at most `hold` seconds and
+    never past the end of the window. The value of the last sample before
+    the window is carried into it.
+
+    :param samples: List of (timestamp, value) tuples ordered by timestamp,
+        with timestamps in seconds
+    :param start_ts: Start timestamp
+    :param end_ts: End timestamp (exclusive)
+    :param hold: Maximum number of seconds a value holds, None for no limit
+    :return: Tuple (average, min, max) of the values in effect during the
+        window, None when there are none
+    """
+    values = []
+    weights = []
+    for index, (timestamp, value) in enumerate(samples):
+        if timestamp >= end_ts:
+            break
+
+        held_until = samples[index + 1][0] if index + 1 < len(samples) else end_ts
+        held_until = min(held_until, end_ts)
+        if hold:
+            held_until = min(held_until, timestamp + hold)
+
+        weight = max(0, held_until - max(timestamp, start_ts))
+        if timestamp < start_ts and not weight:
+            # Not in effect during the window.
+            continue
+
+        values.append(value)
+        weights.append(weight)
+
+    if not values:
+        return None, None, None
+
+    total_weight = sum(weights)
+    if total_weight:
+        average = sum(value * weight for value, weight in zip(values, weights)) / total_weight
+    else:
+        average = sum(values) / len(values)
+
+    return average, min(values), max(values)
+
+
+class WriteFilter(object):
+    """Applies write policies to prepared log rows.
+
+    The last suppressed row of each key is kept, so it can be written when
+    the log is closed, and suppressed rows are counted per rollup bucket.
+    Only used by the thread that owns the log, other threads may read.
+    """
+
+    def __init__(self, policies):
+        """Construct filter.
+
+        :param policies: Mapping of key to WritePolicy
+        """
+        self.policies = policies
+        self._last_written = {}
+        self._suppressed = {}
+        self._counts = collections.Counter()
+        self.suppressed_count = 0
+
+    def should_write(self, key, row):
+        """Apply the write policy of a key to a prepared row."""
+        policy = self.policies.get(key)
+        if policy is None or row[3] is None:
+            return True
+
+        key_id = row[1]
+        last = self._last_written.get(key_id)
+        if last is not None:
+            elapsed = row[0] - last[0]
+            if 0 <= elapsed and (policy.heartbeat is None or elapsed < policy.heartbeat) and \
+                    (elapsed < policy.min_interval or abs(row[3] - last[3]) <= policy.deadband):
+                self._suppressed[key_id] = row
+                self._counts[key_id, row[0] - row[0] % ROLLUP_WIDTH] += 1
+                self.suppressed_count += 1
+                return False
+
+        self._last_written[key_id] = row
+        self._suppressed.pop(key_id, None)
+        return True
+
+    def last_suppressed(self, key_id):
+        """Return the last suppressed row of a key if it is newer than the
+        last written one, otherwise None."""
+        return self._suppressed.get(key_id)
+
+    def suppressed_timestamps(self):
+        """Return timestamps of the suppressed rows that are kept."""
+        return [row[0] for row in list(self._suppressed.values())]
+
+    def count(self, key_id, start_ts, end_ts):
+        """Count suppressed rows of a key in buckets starting in a window."""
+        return sum(
+            count for (counted_key_id, bucket), count in list(self._counts.items())
+            if counted_key_id == key_id and start_ts <= bucket < end_ts
+        )
+
+    def release(self):
+        """Return the last suppressed row of each key, so it can be written.
+
+        Released rows are no longer counted as suppressed.
+        """
+        rows = sorted(self._suppressed.values())
+        for row in rows:
+            self._counts[row[1], row[0] - row[0] % ROLLUP_WIDTH] -= 1
+        self._suppressed = {}
+        return rows
+
+    def take_counts(self):
+        """Return and reset the counts of suppressed rows.
+
+        :return: Mapping of key id to a mapping of bucket to count
+        """
+        counts = collections.defaultdict(collections.Counter)
+        for (key_id, bucket), count in self._counts.items():
+            if count > 0:
+                counts[key_id][bucket] += count
+        self._counts.clear()
+        return counts
@@ -0,0 +1,49 @@
+"""Stand-ins for the Raspberry Pi hardware libraries.
+
+Only installed when the real libraries can not be imported, so the boot
+sequence can be tested on development machines.
+"""
+import importlib
+import sys
+import types
+
+
+class _Pi(object):
+    """pigpio connection without a daemon."""
+
+    def __getattr__(self, name):
+        return lambda *args: 0
+
+
+class _SMBus(object):
+    """I2C bus without devices."""
+
+    def __init__(self, bus=None):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args: 0
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    """Install fake hardware libraries that are not available."""
+    fakes = [
+        ('RPi', {}),
+        ('RPi.GPIO', {'HIGH': 1, 'LOW': 0}),
+        ('pigpio', {'INPUT': 0, 'OUTPUT': 1, 'FALLING_EDGE': 1, 'pi': _Pi}),
+        ('smbus', {'SMBus': _SMBus}),
+    ]
+    for name, attributes in fakes:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            sys.modules[name] = _module(name, **attributes)
+            if '.' in name:
+                parent, child = name.rsplit('.', 1)
+                setattr(sys.modules[parent], child, sys.modules[name])
@@ -0,0 +1,68 @@
+from __future__ import print_function
+
+import random
+import unittest
+import zlib
+
+from pira import archive
+
+
+class ChunkTest(unittest.TestCase):
+    def roundtrip(self, timestamps, values):
+        chunk = archive.encode_chunk(timestamps, values)
+        self.assertEqual(archive.decode_chunk(chunk), (timestamps, values))
+        return bytearray(zlib.decompress(chunk))
+
+    def test_decimal_values(self):
+        timestamps = [1500000000 + 30 * index + random.randint(-1, 1) for index in range(1000)]
+        values = [round(3.7 + random.uniform(-0.5, 0.5), 3) for _ in timestamps]
+        data = self.roundtrip(timestamps, values)
+
+        self.assertEqual(data[0], archive.ENCODING_DECIMAL)
+        count, position = archive.read_varint(data, 1)
+        self.assertEqual((count, data[position]), (1000, 3))
+        # Regular timestamps and slowly changing values take a few bytes.
+        self.assertLess(len(data), 4 * len(values))
+
+    def test_integer_values(self):
+        data = self.roundtrip([0, 60, 120, 180], [0.0, -5.0, 2.0 ** 52, -2.0 ** 52])
+        self.assertEqual(data[0], archive.ENCODING_DECIMAL)
+
+    def test_float_values(self):
+        values = [random.random() for _ in range(100)]
+        values.extend([float('inf'), float('-inf'), 1e300, -0.0, 2.0 ** 60])
+        data = self.roundtrip(list(range(len(values))), values)
+        self.assertEqual(data[0], archive.ENCODING_XOR)
+
+    def test_not_a_number(self):
+        chunk = archive.encode_chunk([0, 1], [1.0, float('nan')])
+        _, values = archive.decode_chunk(chunk)
+        self.assertEqual(values[0], 1.0)
+        self.assertNotEqual(values[1], values[1])
+
+    def test_empty_chunk(self):
+        self.roundtrip([], [])
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            archive.decode_chunk(zlib.compress(b'\x07\x00'))
+
+    def test_varint(self):
+        output = bytearray()
+        numbers = [0, 1, 127, 128, 300, 2 ** 35, 2 ** 64 - 1]
+        for number in numbers:
+            archive.write_varint(output, number)
+
+        position = 0
+        for number in numbers:
+            value, position = archive.read_varint(output, position)
+            self.assertEqual(value, number)
+        self.assertEqual(position, len(output))
+
+        for number in [0, 1, -1, 63, -64, 2 ** 40, -2 ** 40]:
+            self.assertGreaterEqual(archive.zigzag(number), 0)
+            self.assertEqual(archive.unzigzag(archive.zigzag(number)), number)
+
+
+if __name__ == '__main__':
+    unittest.main()
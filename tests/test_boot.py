@@ -0,0 +1,340 @@
+from __future__ import print_function
+
+import collections
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from pira import log as pira_log
+from pira.bus import MeasurementBus
+from pira.const import LOG_WATCHDOG_OVERRUN, LOG_SHUTDOWN_DURATION, LOG_SHUTDOWN_ABANDONED
+from pira.trace import Tracer, monotonic
+
+from . import fakes
+
+fakes.install()
+try:
+    from pira import boot as pira_boot
+except SyntaxError:
+    # The hardware drivers only run on Python 2.
+    pira_boot = None
+
+EPOCH = datetime.datetime(2000, 1, 1)
+
+
+class Stop(Exception):
+    """Ends the main loop at the first shutdown."""
+
+
+class FakeModule(object):
+    """Module recording its calls in `boot.events`."""
+    init_delay = 0
+    shutdown_delay = 0
+    result = None
+
+    def __init__(self, boot):
+        self.boot = boot
+        self.record('init')
+        if self.init_delay:
+            time.sleep(self.init_delay)
+        self.record('init done')
+
+    def record(self, event):
+        self.boot.events.append((event, self.name, monotonic()))
+
+    def process(self, modules):
+        self.record('process')
+        return self.result
+
+    def shutdown(self, modules):
+        self.record('shutdown')
+        if self.shutdown_delay:
+            time.sleep(self.shutdown_delay)
+        self.record('shutdown done')
+
+
+def package(name, **attributes):
+    """Module package with a Module class of the given attributes."""
+    attributes['name'] = name
+    module = types.ModuleType(name)
+    module.Module = type('Module', (FakeModule,), attributes)
+    return module
+
+
+@unittest.skipIf(pira_boot is None, "Boot requires Python 2")
+class BootTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.packages = []
+        self.release = threading.Event()
+
+        self.boot = pira_boot.Boot()
+        self.boot.tracer = Tracer(self.directory, retention=0)
+        self.boot.log = pira_log.Log(os.path.join(self.directory, 'log.db'), check_timeout=0, cache_size=0)
+        self.boot.bus = MeasurementBus(self.boot.log)
+        self.boot.events = []
+        self.boot.modules = collections.OrderedDict()
+
+    def tearDown(self):
+        # Let threads that were left behind finish.
+        self.release.set()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        for name in self.packages:
+            del sys.modules[name]
+        self.boot.log.close()
+        shutil.rmtree(self.directory)
+
+    def add(self, name, **attributes):
+        """Add an initialized module."""
+        module = package(name, **attributes).Module(self.boot)
+        self.boot.modules[name] = module
+        self.boot._budgets[name] = attributes.get('budget', 60)
+        return module
+
+    def register(self, name, **attributes):
+        """Register an importable module package."""
+        name = 'tests.fake_{}'.format(name)
+        sys.modules[name] = package(name, **attributes)
+        self.packages.append(name)
+        return name
+
+    def events(self, event):
+        return [name for recorded, name, _ in self.boot.events if recorded == event]
+
+    def times(self, event, name):
+        return [at for recorded, module, at in self.boot.events if recorded == event and module == name]
+
+    def blocking(self, modules):
+        self.release.wait()
+
+    def logged(self, key):
+        return self.boot.log.query(EPOCH, key)
+
+
+class SchedulerTest(BootTestCase):
+    def run_loop(self, modules, stop_after=None):
+        """Run the main loop until the first shutdown.
+
+        :return: Running time in seconds
+        """
+        started = monotonic()
+        self.boot.enabled_modules = modules
+        self.boot._measure = lambda: self.boot.events.append(('measure', None, monotonic()))
+
+        def housekeeping():
+            if stop_after is not None and monotonic() - started >= stop_after:
+                self.boot.shutdown = True
+
+        self.boot._housekeeping = housekeeping
+
+        def stop():
+            raise Stop()
+
+        self.boot._perform_shutdown = stop
+        with self.assertRaises(Stop):
+            self.boot.process()
+        return monotonic() - started
+
+    def test_intervals(self):
+        os.environ['LOOP_INTERVAL'] = '0.2'
+        fast = self.register('fast', interval=0.05)
+        requested = self.register('requested', result=0.1)
+        duration = self.run_loop([fast, requested], stop_after=0.5)
+
+        self.assertLess(duration, 1.5)
+        runs = collections.Counter(self.events('process'))
+        self.assertGreaterEqual(runs[fast], 8)
+        self.assertLessEqual(runs[fast], 2 * duration / 0.05)
+        self.assertGreaterEqual(runs[requested], 4)
+        self.assertLessEqual(runs[requested], 2 * duration / 0.1)
+        self.assertLess(len(self.events('measure')), runs[requested])
+
+        # Device measurements are taken before modules are processed.
+        self.assertLess(self.times('measure', None)[0], self.times('process', fast)[0])
+
+    def test_lean_profile(self):
+        self.boot.profile = pira_boot.Boot.BOOT_PROFILE_LEAN
+        due = self.register('due', is_due=staticmethod(lambda boot: True))
+        not_due = self.register('not_due', is_due=staticmethod(lambda boot: False))
+        always = self.register('always')
+        duration = self.run_loop([due, not_due, always])
+
+        # Every task runs once, then the unit goes back to sleep.
+        self.assertLess(duration, 1)
+        self.assertEqual(self.events('init'), [due, always])
+        self.assertEqual(self.events('process'), [due, always])
+        self.assertEqual(len(self.events('measure')), 1)
+
+    def test_select_profile(self):
+        boot = self.boot
+        boot.reason = pira_boot.Boot.BOOT_REASON_TIMER
+        self.assertEqual(boot._select_profile(), pira_boot.Boot.BOOT_PROFILE_FULL)
+
+        os.environ['BOOT_PROFILE'] = 'auto'
+        self.assertEqual(boot._select_profile(), pira_boot.Boot.BOOT_PROFILE_LEAN)
+        boot.reason = pira_boot.Boot.BOOT_REASON_CHARGER
+        self.assertEqual(boot._select_profile(), pira_boot.Boot.BOOT_PROFILE_FULL)
+        boot.reason = pira_boot.Boot.BOOT_REASON_RTC
+        os.environ['SLEEP_NEVER'] = '1'
+        self.assertEqual(boot._select_profile(), pira_boot.Boot.BOOT_PROFILE_FULL)
+
+        os.environ['BOOT_PROFILE'] = 'unknown'
+        self.assertEqual(boot._select_profile(), pira_boot.Boot.BOOT_PROFILE_FULL)
+
+
+class InitializationTest(BootTestCase):
+    def imported(self, *modules):
+        return collections.OrderedDict((module.__name__, module) for module in modules)
+
+    def test_concurrent(self):
+        started = monotonic()
+        modules = self.boot._initialize_modules(self.imported(
+            package('a', init_delay=0.3),
+            package('b', init_delay=0.3),
+            package('c', init_delay=0.3),
+        ))
+
+        self.assertLess(monotonic() - started, 0.6)
+        self.assertEqual(list(modules), ['a', 'b', 'c'])
+
+    def test_dependencies(self):
+        modules = self.boot._initialize_modules(self.imported(
+            package('report', subscribes=['distance']),
+            package('alarm', depends=['report']),
+            package('sensor', publishes=['distance'], init_delay=0.1),
+        ))
+
+        self.assertEqual(list(modules), ['sensor', 'report', 'alarm'])
+        self.assertGreaterEqual(self.times('init', 'report')[0], self.times('init done', 'sensor')[0])
+        self.assertGreaterEqual(self.times('init', 'alarm')[0], self.times('init done', 'report')[0])
+
+    def test_circular_dependencies(self):
+        modules = self.boot._initialize_modules(self.imported(
+            package('a', depends=['b']),
+            package('b', depends=['a']),
+        ))
+        self.assertEqual(list(modules), ['a', 'b'])
+
+    def test_failures(self):
+        os.environ['MODULE_INIT_TIMEOUT'] = '0.2'
+        release = self.release
+
+        def fail(self, boot):
+            raise ValueError("no device")
+
+        def block(self, boot):
+            release.wait()
+
+        started = monotonic()
+        modules = self.boot._initialize_modules(self.imported(
+            package('failing', __init__=fail),
+            package('blocking', __init__=block),
+            package('working'),
+        ))
+
+        self.assertLess(monotonic() - started, 1)
+        self.assertEqual(list(modules), ['working'])
+
+
+class BudgetTest(BootTestCase):
+    def test_interrupted_module(self):
+        os.environ['MODULE_MAX_OVERRUNS'] = '2'
+        module = self.add('slow', budget=0.1)
+        module.process = lambda modules: time.sleep(5)
+
+        started = monotonic()
+        self.assertIsNone(self.boot._process_module('slow', module))
+        self.assertIsNone(self.boot._process_module('slow', module))
+        self.assertLess(monotonic() - started, 2)
+
+        overruns = self.logged(LOG_WATCHDOG_OVERRUN)
+        self.assertEqual(len(overruns), 2)
+        self.assertTrue(overruns[0].startswith('slow processing'))
+        self.assertIn('slow', self.boot._skipped)
+
+    def test_failing_module(self):
+        module = self.add('failing')
+        module.process = lambda modules: 1 / 0
+        self.assertIsNone(self.boot._process_module('failing', module))
+        self.assertEqual(self.logged(LOG_WATCHDOG_OVERRUN), [])
+
+    def test_background_module(self):
+        module = self.add('transport', budget=0.1)
+        module.process = lambda modules: self.release.wait(5) and 42
+        self.boot._background.add('transport')
+
+        # The main loop only starts the job and checks on it later.
+        started = monotonic()
+        self.assertEqual(self.boot._process_module('transport', module), 0.1)
+        self.assertLess(monotonic() - started, 0.1)
+        time.sleep(0.2)
+        self.assertEqual(self.boot._process_module('transport', module), pira_boot.BACKGROUND_POLL_INTERVAL)
+        self.assertEqual(len(self.logged(LOG_WATCHDOG_OVERRUN)), 1)
+
+        self.release.set()
+        self.boot._jobs['transport'].wait(5)
+        self.assertEqual(self.boot._process_module('transport', module), 42)
+        self.assertEqual(len(self.boot._jobs), 0)
+
+    def test_abandoned_background_job(self):
+        module = self.add('transport')
+        module.process = self.blocking
+        self.boot._background.add('transport')
+        self.boot._process_module('transport', module)
+
+        started = monotonic()
+        self.boot._finish_background_jobs(monotonic() + 0.1)
+        self.assertLess(monotonic() - started, 0.5)
+        self.assertIn('transport', self.boot._jobs)
+
+
+class ShutdownTest(BootTestCase):
+    def test_concurrent(self):
+        self.add('a', shutdown_delay=0.3)
+        self.add('b', shutdown_delay=0.3)
+        self.add('c', shutdown_after=['a'], shutdown_delay=0.1)
+
+        started = monotonic()
+        self.boot._shutdown_modules(monotonic() + 5)
+        self.assertLess(monotonic() - started, 0.65)
+
+        self.assertEqual(sorted(self.events('shutdown done')), ['a', 'b', 'c'])
+        self.assertGreaterEqual(self.times('shutdown', 'c')[0], self.times('shutdown done', 'a')[0])
+        self.assertEqual(len(self.logged(LOG_SHUTDOWN_DURATION)), 3)
+
+    def test_deadline(self):
+        self.add('stuck').shutdown = self.blocking
+        self.add('scheduler', shutdown_required=True, shutdown_delay=0.4)
+
+        started = monotonic()
+        self.boot._shutdown_modules(monotonic() + 0.2)
+        self.assertLess(monotonic() - started, 1)
+
+        # Required shutdowns run past the deadline, others are left behind.
+        self.assertEqual(self.events('shutdown done'), ['scheduler'])
+        self.assertEqual(self.logged(LOG_SHUTDOWN_ABANDONED), ['stuck'])
+
+    def test_budget(self):
+        self.add('slow', budget=0.1).shutdown = self.blocking
+        self.boot._shutdown_modules(monotonic() + 5)
+
+        self.assertEqual(self.logged(LOG_SHUTDOWN_ABANDONED), [])
+        self.assertTrue(self.logged(LOG_WATCHDOG_OVERRUN)[0].startswith('slow shutdown'))
+
+    def test_circular_order(self):
+        self.add('a', shutdown_after=['b'])
+        self.add('b', shutdown_after=['a'])
+        self.boot._shutdown_modules(monotonic() + 5)
+        self.assertEqual(sorted(self.events('shutdown done')), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from __future__ import print_function
+
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from pira import bus as pira_bus
+from pira import log as pira_log
+
+
+class MeasurementBusTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = pira_log.Log(os.path.join(self.directory, 'log.db'), check_timeout=0, write_policies=True)
+        self.start = datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(hours=1)
+        self.bus = pira_bus.MeasurementBus(self.log)
+        # Samples are published with past timestamps.
+        self.bus._started = self.start
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.directory)
+
+    def publish(self, key, values, offset=0):
+        for index, value in enumerate(values):
+            self.bus.publish(key, value, self.start + datetime.timedelta(seconds=offset + 30 * index))
+
+    def assertStatistics(self, statistics, expected, count=True):
+        if count:
+            self.assertEqual(statistics[0], expected[0])
+        self.assertAlmostEqual(statistics[1], expected[1])
+        self.assertEqual(statistics[2:], expected[2:])
+
+    def test_weighted_like_log(self):
+        generator = random.Random(1)
+        values = [20.0]
+        for _ in range(99):
+            values.append(values[-1] + generator.choice([-0.25, 0, 0, 0, 0.25]))
+        self.publish('device.temperature', values)
+        self.assertGreater(self.log.suppressed_count, 0)
+
+        for offset in (0, 900, 907, 1800):
+            start = self.start + datetime.timedelta(seconds=offset)
+            # The log counts suppressed samples per minute.
+            self.assertStatistics(
+                self.bus.aggregate(start, 'device.temperature'),
+                self.log.aggregate(start, 'device.temperature'),
+                count=not offset % 60
+            )
+
+    def test_unweighted_like_log(self):
+        self.publish('test.value', [1, 2, 3, 10])
+        self.assertStatistics(self.bus.aggregate(self.start, 'test.value'), (4, 4.0, 1.0, 10.0))
+        self.assertStatistics(self.log.aggregate(self.start, 'test.value'), (4, 4.0, 1.0, 10.0))
+
+    def test_history_before_bus(self):
+        # The value in effect at the start of the window is not known.
+        self.bus._started = self.start + datetime.timedelta(minutes=10)
+        self.publish('device.temperature', [20.0] * 10, offset=600)
+        self.assertIsNone(self.bus.aggregate(self.start + datetime.timedelta(minutes=5), 'device.temperature'))
+
+        # Values published more than a heartbeat before the window no longer hold.
+        self.assertStatistics(
+            self.bus.aggregate(self.start + datetime.timedelta(minutes=30), 'device.temperature'),
+            (0, None, None, None)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+from __future__ import print_function
+
+import csv
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from pira import export
+from pira import log as pira_log
+
+START = datetime.datetime(2020, 1, 1)
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = pira_log.Log(os.path.join(self.directory, 'log.db'), check_timeout=0, cache_size=0)
+        entries = []
+        for index in range(500):
+            timestamp = START + datetime.timedelta(seconds=30 * index)
+            entries.append(('device.voltage', 3.5 + index % 10 / 100.0, timestamp))
+            entries.append(('device.temperature', 20 + index % 3, timestamp))
+            if index % 100 == 0:
+                entries.append(('system', 'boot', timestamp))
+        self.log.insert_many(entries)
+        # Samples of the first day are read from archive chunks.
+        self.log.archive(age=datetime.timedelta(hours=2), now=START + datetime.timedelta(hours=4))
+        self.start_ts = int(START.strftime('%s'))
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.directory)
+
+    def expected(self):
+        entries = [(timestamp, key, value) for timestamp, _, key, value in self.log.iter_entries()]
+        self.assertEqual(len(entries), 1005)
+        return entries
+
+    def read_csv(self, data):
+        rows = list(csv.reader(io.StringIO(data.decode('utf-8')) if str is not bytes else io.BytesIO(data)))
+        self.assertEqual(rows[0], ['timestamp', 'id', 'key', 'value'])
+        if str is bytes:
+            rows = [[item.decode('utf-8') for item in row] for row in rows]
+        return [(int(row[0]), row[2], row[3]) for row in rows[1:]]
+
+    def test_iter_entries(self):
+        entries = list(self.log.iter_entries())
+        self.assertEqual(entries, sorted(entries))
+        self.assertEqual(len([entry for entry in entries if entry[1] == 0]), 2 * 240)
+        self.assertEqual(entries[0][0], self.start_ts)
+
+        # Entries after a cursor, in chunks.
+        cursor = entries[700][:2]
+        self.assertEqual(list(self.log.iter_entries(cursor=cursor, chunk_size=7)), entries[701:])
+
+        window = list(self.log.iter_entries(['system'], START + datetime.timedelta(hours=1)))
+        self.assertEqual([entry[3] for entry in window], ['boot'] * 3)
+
+    def test_csv(self):
+        output = io.BytesIO()
+        cursor = export.export_csv(self.log, output, block_rows=100)
+        entries = self.read_csv(output.getvalue())
+        self.assertEqual(entries, self.expected())
+
+        # Resumed export starts after the cursor.
+        text = export.format_cursor(cursor)
+        self.assertEqual(export.parse_cursor(text), cursor)
+        self.log.insert('system', 'halt', START + datetime.timedelta(days=1))
+        output = io.BytesIO()
+        export.export_csv(self.log, output, cursor=export.parse_cursor(text))
+        self.assertEqual(self.read_csv(output.getvalue()), [(self.start_ts + 86400, 'system', 'halt')])
+
+    def test_columnar(self):
+        output = io.BytesIO()
+        cursor = export.export_columnar(self.log, output, block_rows=128)
+        blocks = list(export.read_columnar(io.BytesIO(output.getvalue())))
+        self.assertEqual(len(blocks), 8)
+        self.assertEqual(blocks[-1][0], cursor)
+
+        entries = [entry for _, block in blocks for entry in block]
+        expected = [
+            (timestamp, key, float(value) if key != 'system' else value)
+            for timestamp, key, value in self.expected()
+        ]
+        self.assertEqual(sorted(entries), sorted(expected))
+
+        # Cut off blocks are ignored and the export is resumed from the last
+        # complete one.
+        data = output.getvalue()
+        truncated = list(export.read_columnar(io.BytesIO(data[:len(data) * 3 // 4])))
+        self.assertLess(len(truncated), len(blocks))
+        output = io.BytesIO()
+        export.export_columnar(self.log, output, cursor=truncated[-1][0])
+        resumed = [entry for _, block in export.read_columnar(io.BytesIO(output.getvalue())) for entry in block]
+        self.assertEqual(sorted([entry for _, block in truncated for entry in block] + resumed), sorted(entries))
+
+    def test_not_columnar(self):
+        with self.assertRaises(ValueError):
+            list(export.read_columnar(io.BytesIO(b'timestamp,id,key,value\r\n')))
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(ValueError):
+            export.parse_cursor('123')
+
+
+if __name__ == '__main__':
+    unittest.main()
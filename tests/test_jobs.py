@@ -0,0 +1,45 @@
+from __future__ import print_function
+
+import threading
+import time
+import unittest
+
+from pira import jobs
+
+
+class JobTest(unittest.TestCase):
+    def test_result(self):
+        done = []
+        job = jobs.Job('job', lambda value: value * 2, (21,), done.append)
+        self.assertTrue(job.wait(5))
+        self.assertTrue(job.done)
+        self.assertEqual(job.result, 42)
+        self.assertIsNone(job.exc_info)
+        self.assertGreaterEqual(job.duration, 0)
+
+        # Completion callbacks run in the job thread right after the call.
+        for _ in range(100):
+            if done:
+                break
+            time.sleep(0.01)
+        self.assertEqual(done, [job])
+
+    def test_exception(self):
+        def fail():
+            raise ValueError("failed")
+
+        job = jobs.Job('job', fail)
+        self.assertTrue(job.wait(5))
+        self.assertIs(job.exc_info[0], ValueError)
+
+    def test_timeout(self):
+        event = threading.Event()
+        job = jobs.Job('job', event.wait)
+        self.assertFalse(job.wait(0.01))
+        self.assertFalse(job.done)
+        event.set()
+        self.assertTrue(job.wait(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,317 @@
+from __future__ import print_function
+
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from pira import log as pira_log
+from pira import schema
+
+START = datetime.datetime(2020, 1, 1)
+KEY = 'test.value'
+
+
+def seconds(offset):
+    return START + datetime.timedelta(seconds=offset)
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'log.db')
+        self.logs = []
+
+    def tearDown(self):
+        for log in self.logs:
+            log.close()
+        shutil.rmtree(self.directory)
+
+    def open_log(self, **kwargs):
+        kwargs.setdefault('check_timeout', 0)
+        kwargs.setdefault('cache_size', 0)
+        log = pira_log.Log(self.filename, **kwargs)
+        self.logs.append(log)
+        return log
+
+    def close_log(self, log):
+        self.logs.remove(log)
+        log.close()
+
+    def execute(self, sql, *args):
+        """Run a statement on a separate connection."""
+        db = sqlite3.connect(self.filename)
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def written(self):
+        return self.execute('SELECT count(*) FROM log')[0][0]
+
+
+class BufferTest(LogTestCase):
+    def test_group_commit(self):
+        log = self.open_log(buffer_size=10, buffer_age=3600, writer_thread=False)
+        log.insert_many([(KEY, index, seconds(index)) for index in range(9)])
+        self.assertEqual(self.written(), 0)
+
+        log.insert(KEY, 9, seconds(9))
+        self.assertEqual(self.written(), 10)
+
+    def test_buffer_age(self):
+        log = self.open_log(buffer_size=1000, buffer_age=0, writer_thread=False)
+        log.insert(KEY, 1, seconds(0))
+        self.assertEqual(self.written(), 1)
+
+    def test_queries_include_buffered_entries(self):
+        log = self.open_log(buffer_size=1000, buffer_age=3600, writer_thread=False)
+        log.insert_many([(KEY, index, seconds(index)) for index in range(5)])
+
+        self.assertEqual(log.query(START, KEY), ['0', '1', '2', '3', '4'])
+        self.assertEqual(log.aggregate(START, KEY), (5, 2.0, 0.0, 4.0))
+
+    def test_close_writes_buffer(self):
+        log = self.open_log(buffer_size=1000, buffer_age=3600, writer_thread=False)
+        log.insert_many([(KEY, index, seconds(index)) for index in range(5)])
+        self.close_log(log)
+
+        self.assertEqual(self.written(), 5)
+
+
+class WriterThreadTest(LogTestCase):
+    def test_flush_waits_for_writer(self):
+        log = self.open_log(buffer_size=1000, buffer_age=3600, writer_thread=True)
+        log.insert_many([(KEY, index, seconds(index)) for index in range(5)])
+        self.assertEqual(len(log.query(START, KEY)), 5)
+
+        log.flush()
+        self.assertEqual(self.written(), 5)
+
+    def test_full_queue(self):
+        log = self.open_log(buffer_size=3, buffer_age=3600, writer_thread=True, queue_size=1)
+        for index in range(100):
+            log.insert(KEY, index, seconds(index))
+        self.assertEqual(log.query(START, KEY), [str(index) for index in range(100)])
+        self.close_log(log)
+
+        self.assertEqual(self.written(), 100)
+
+
+class StorageProfileTest(LogTestCase):
+    def pragma(self, name):
+        return self.execute('PRAGMA {}'.format(name))[0][0]
+
+    def test_profiles(self):
+        self.close_log(self.open_log(profile='legacy'))
+        self.assertEqual(self.pragma('journal_mode'), 'delete')
+
+        # Existing databases are converted to the page layout of the profile.
+        log = self.open_log(profile='sdcard')
+        log.insert(KEY, 1, START)
+        self.close_log(log)
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('page_size'), 4096)
+        self.assertEqual(self.pragma('auto_vacuum'), schema.AUTO_VACUUM_MODES['incremental'])
+        self.assertEqual(self.execute('SELECT value FROM log'), [('1',)])
+
+    def test_unknown_profile(self):
+        self.close_log(self.open_log(profile='unknown'))
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+
+    def test_covering_index(self):
+        self.close_log(self.open_log())
+        plan = ' '.join(row[-1] for row in self.execute(
+            'EXPLAIN QUERY PLAN SELECT timestamp, numeric_value FROM log WHERE key_id = 1 AND timestamp >= 0'
+        ))
+        self.assertIn('COVERING INDEX log_key_timestamp_numeric_index', plan)
+
+
+class NumericValueTest(LogTestCase):
+    def test_numeric_values(self):
+        log = self.open_log()
+        log.insert_many([(KEY, '1.5', seconds(0)), (KEY, 'error', seconds(1)), (KEY, 3, seconds(2))])
+        log.flush()
+
+        self.assertEqual(self.execute('SELECT value, numeric_value FROM log ORDER BY id'), [
+            ('1.5', 1.5), ('error', None), ('3', 3.0),
+        ])
+        self.assertEqual(log.query(START, KEY), ['1.5', 'error', '3'])
+        self.assertEqual(log.query(START, KEY, only_numeric=True), [1.5, 3.0])
+        self.assertEqual(log.aggregate(START, KEY), (2, 2.25, 1.5, 3.0))
+
+
+class RollupTest(LogTestCase):
+    def test_rollups(self):
+        log = self.open_log()
+        log.insert_many([(KEY, index, seconds(index * 7)) for index in range(100)])
+        log.insert(KEY, 'error', seconds(30))
+        log.flush()
+
+        rows = self.execute('SELECT bucket, count, min, max FROM log_rollup ORDER BY bucket')
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(sum(row[1] for row in rows), 100)
+        self.assertEqual(rows[0][1:], (9, 0.0, 8.0))
+
+    def test_aggregate(self):
+        log = self.open_log()
+        samples = [(index * 7, random.uniform(-10, 10)) for index in range(300)]
+        log.insert_many([(KEY, value, seconds(offset)) for offset, value in samples])
+        log.flush()
+
+        for start, end in [(0, 2100), (45, 1234), (61, 119), (300, 300), (1000, 5000)]:
+            values = [value for offset, value in samples if start <= offset < end]
+            count, average, min_value, max_value = log.aggregate(seconds(start), KEY, seconds(end))
+            self.assertEqual(count, len(values))
+            if values:
+                self.assertAlmostEqual(average, sum(values) / len(values))
+                self.assertEqual(min_value, min(values))
+                self.assertEqual(max_value, max(values))
+            else:
+                self.assertEqual((average, min_value, max_value), (None, None, None))
+
+    def test_unknown_key(self):
+        log = self.open_log()
+        self.assertEqual(log.aggregate(START, KEY), (0, None, None, None))
+
+
+class MigrationTest(LogTestCase):
+    def create(self, version):
+        """Create a database with the schema of the given version."""
+        db = sqlite3.connect(self.filename)
+        db.create_function('pira_numeric', 1, schema.numeric)
+        db.execute(schema.LOG_TABLE_SCHEMA)
+        timestamp = int(START.strftime('%s'))
+        db.executemany('INSERT INTO log (timestamp, key, value) VALUES (?, ?, ?)', [
+            (timestamp + index, KEY if index % 2 else 'other', str(index)) for index in range(200)
+        ])
+        db.execute('INSERT INTO log (timestamp, key, value) VALUES (?, ?, ?)', (timestamp, 'system', 'boot'))
+        for steps in schema.LOG_MIGRATIONS[:version]:
+            schema.migrate(db, steps)
+        db.execute('PRAGMA user_version = {}'.format(version))
+        db.commit()
+        db.close()
+
+    def check(self):
+        log = self.open_log()
+        self.assertEqual(self.execute('PRAGMA user_version')[0][0], len(schema.LOG_MIGRATIONS))
+        self.assertEqual(log.query(START, KEY), [str(index) for index in range(1, 200, 2)])
+        self.assertEqual(log.query(START, 'system'), ['boot'])
+        self.assertEqual(log.aggregate(START, KEY), (100, 100.0, 1.0, 199.0))
+        self.assertEqual(log.aggregate(seconds(60), KEY, seconds(120)), (30, 90.0, 61.0, 119.0))
+        self.assertEqual(sorted(row[0] for row in self.execute('SELECT name FROM keys')), ['other', 'system', KEY])
+        self.assertNotIn('key', [row[1] for row in self.execute('PRAGMA table_info(log)')])
+
+        log.insert(KEY, 200, seconds(200))
+        self.assertEqual(log.aggregate(START, KEY)[0], 101)
+
+    def test_original_schema(self):
+        self.create(0)
+        self.check()
+
+    def test_rollup_schema(self):
+        self.create(3)
+        self.check()
+
+    def test_repeated_key_interning(self):
+        # Key interning applied by an interrupted migration is completed.
+        self.create(3)
+        db = sqlite3.connect(self.filename)
+        db.create_function('pira_numeric', 1, schema.numeric)
+        schema.migrate(db, schema.LOG_MIGRATIONS[3])
+        db.commit()
+        db.close()
+        self.check()
+
+    def test_reopen(self):
+        self.create(0)
+        self.close_log(self.open_log())
+        self.check()
+
+
+class CacheTest(LogTestCase):
+    def test_recent_window(self):
+        log = self.open_log(cache_size=100, cache_age=3600)
+        now = datetime.datetime.now()
+        log.insert_many([(KEY, index, now + datetime.timedelta(seconds=index)) for index in range(10)])
+
+        self.assertEqual(log.query(now, KEY), [str(index) for index in range(10)])
+        later = now + datetime.timedelta(seconds=5)
+        self.assertEqual(log.query(later, KEY, only_numeric=True), [5.0, 6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(log.aggregate(now, KEY, now + datetime.timedelta(seconds=4)), (4, 1.5, 0.0, 3.0))
+        self.assertEqual(log.cache_hits, 3)
+        self.assertEqual(log.cache_misses, 0)
+
+        # Windows starting before the log was opened are read from the database.
+        self.assertEqual(len(log.query(now - datetime.timedelta(minutes=1), KEY)), 10)
+        self.assertEqual(log.cache_misses, 1)
+
+    def test_evicted_entries(self):
+        log = self.open_log(cache_size=5, cache_age=3600)
+        now = datetime.datetime.now()
+        log.insert_many([(KEY, index, now + datetime.timedelta(seconds=index)) for index in range(10)])
+
+        self.assertEqual(log.query(now + datetime.timedelta(seconds=6), KEY), ['6', '7', '8', '9'])
+        self.assertEqual(log.query(now, KEY), [str(index) for index in range(10)])
+        self.assertEqual((log.cache_hits, log.cache_misses), (1, 1))
+
+
+@unittest.skipUnless(pira_log.HAVE_NUMPY, "NumPy is not installed")
+class ArrayQueryTest(LogTestCase):
+    def test_query_array(self):
+        log = self.open_log(buffer_size=1000, buffer_age=3600)
+        log.insert_many([(KEY, index / 2.0, seconds(index)) for index in range(0, 500, 2)])
+        log.insert(KEY, 'error', seconds(3))
+        log.flush()
+        # Buffered entries out of order.
+        log.insert_many([(KEY, 0.5, seconds(1)), (KEY, 600, seconds(600))])
+
+        timestamps, values = log.query_array(KEY, START, seconds(1000), chunk_size=16)
+        self.assertEqual(str(timestamps.dtype), 'int64')
+        self.assertEqual(len(values), 252)
+        self.assertEqual(list(timestamps[:3] - timestamps[0]), [0, 1, 2])
+        self.assertEqual(list(values[:3]), [0.0, 0.5, 1.0])
+        self.assertEqual(values[-1], 600.0)
+
+        timestamps, values = log.query_array(KEY, seconds(100), seconds(110))
+        self.assertEqual(list(values), [50.0, 51.0, 52.0, 53.0, 54.0])
+
+        chunks = list(log.iter_query_array(KEY, START, seconds(500), chunk_size=100))
+        self.assertEqual(sum(len(chunk[1]) for chunk in chunks), 251)
+        self.assertTrue(all(len(chunk[1]) <= 100 for chunk in chunks))
+
+
+class DownsampledQueryTest(LogTestCase):
+    def test_query_downsampled(self):
+        log = self.open_log()
+        samples = [(index * 10, 20 + (index % 7)) for index in range(8640)]
+        samples[1234] = (12340, 100)
+        samples[5678] = (56780, -50)
+        log.insert_many([(KEY, value, seconds(offset)) for offset, value in samples])
+        log.flush()
+
+        end = seconds(86400)
+        for max_points in (20, 500, 20000):
+            points = log.query_downsampled(KEY, START, end, max_points=max_points)
+            self.assertLessEqual(len(points), max_points)
+            self.assertEqual(points, sorted(points))
+            values = [value for _, value in points]
+            self.assertIn(100, values)
+            self.assertIn(-50, values)
+
+        # Slots shorter than the samples return every sample.
+        points = log.query_downsampled(KEY, seconds(12000), seconds(12500), max_points=200)
+        self.assertEqual([value for _, value in points], [value for _, value in samples[1200:1250]])
+
+    def test_empty_window(self):
+        log = self.open_log()
+        log.insert(KEY, 1, START)
+        self.assertEqual(log.query_downsampled(KEY, seconds(10), seconds(10)), [])
+        self.assertEqual(log.query_downsampled('unknown', START, seconds(10)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils', 'log-benchmark.py')
+
+
+class LogBenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_suite(self):
+        results = os.path.join(self.directory, 'results.json')
+        subprocess.check_output([
+            sys.executable, SCRIPT, 'insert', 'suite',
+            '--rows', '50', '--months', '0.05', '--loops', '20', '--json', results, '--dir', self.directory,
+        ], stderr=subprocess.STDOUT)
+
+        with open(results) as results_file:
+            document = json.load(results_file)
+        self.assertEqual(document['loops'], 20)
+        self.assertGreater(document['results']['insert_many']['rows'], 0)
+        self.assertEqual(sorted(document['results']['query']), sorted(document['results']['aggregate']))
+        # Temporary databases are removed.
+        self.assertEqual(os.listdir(self.directory), ['results.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+from __future__ import print_function
+
+import glob
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from pira import log as pira_log
+
+
+def write_unreadable_log(filename):
+    """Write a log database of which only the schema can be read."""
+    db = sqlite3.connect(filename)
+    db.execute('PRAGMA page_size = 1024')
+    db.execute('CREATE TABLE log (id integer primary key, timestamp integer, key varchar, value varchar)')
+    db.executemany(
+        'INSERT INTO log (timestamp, key, value) VALUES (?, ?, ?)',
+        [(index, 'test.value', index) for index in range(2000)]
+    )
+    db.commit()
+    db.close()
+
+    size = os.path.getsize(filename)
+    with open(filename, 'r+b') as handle:
+        handle.seek(1024)
+        handle.write(b'\xff' * (size - 1024))
+
+
+class CorruptionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'log.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_corrupted_database_is_quarantined(self):
+        with open(self.filename, 'wb') as handle:
+            handle.write(b'not a database' * 1024)
+
+        log = pira_log.Log(self.filename, check_timeout=0)
+        log.insert('test.value', 1)
+        log.close()
+
+        self.assertEqual(len(glob.glob(self.filename + '.corrupted.*')), 1)
+
+    def test_operational_errors_are_raised(self):
+        # The database can not be opened, but it is not corrupted.
+        os.mkdir(self.filename)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            pira_log.Log(self.filename, check_timeout=1)
+
+        self.assertTrue(os.path.isdir(self.filename))
+        self.assertEqual(glob.glob(self.filename + '.corrupted.*'), [])
+
+    def test_unreadable_rows_are_skipped(self):
+        write_unreadable_log(self.filename + '.corrupted.test')
+
+        log = pira_log.Log(self.filename, check_timeout=0)
+        log._salvage.join(60)
+        self.assertFalse(log._salvage.is_alive())
+        log.close()
+
+        self.assertEqual(glob.glob(self.filename + '.corrupted.*'), [])
+        self.assertEqual(len(glob.glob(self.filename + '.salvaged.*')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
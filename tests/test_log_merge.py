@@ -0,0 +1,93 @@
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from pira import log as pira_log
+
+START = datetime.datetime(2020, 1, 1)
+KEY = 'device.voltage'
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils', 'log-merge.py')
+
+
+class LogMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fleet = os.path.join(self.directory, 'fleet.db')
+        self.unit = os.path.join(self.directory, 'unit.db')
+
+        # Two hours of samples every 10 seconds.
+        log = pira_log.Log(self.unit, check_timeout=0)
+        log.insert_many([
+            (KEY, 3 + (index % 7) * 0.1, START + datetime.timedelta(seconds=10 * index))
+            for index in range(720)
+        ])
+        log.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def merge(self):
+        with open(os.devnull, 'w') as output:
+            subprocess.check_call([sys.executable, SCRIPT, self.fleet, self.unit, '--processes', '1'], stdout=output)
+
+        db = sqlite3.connect(self.fleet)
+        try:
+            return db.execute('SELECT timestamp, numeric_value FROM log ORDER BY timestamp').fetchall()
+        finally:
+            db.close()
+
+    def unit_means(self):
+        db = sqlite3.connect(self.unit)
+        try:
+            return db.execute('SELECT bucket, total / count FROM log_rollup ORDER BY bucket').fetchall()
+        finally:
+            db.close()
+
+    def assertMeans(self, rows, expected):
+        self.assertEqual([row[0] for row in rows], [row[0] for row in expected])
+        for row, expected_row in zip(rows, expected):
+            self.assertAlmostEqual(row[1], expected_row[1])
+
+    def test_compacted_history_replaces_merged_samples(self):
+        self.assertEqual(len(self.merge()), 720)
+
+        log = pira_log.Log(self.unit, check_timeout=0)
+        log.compact(max_rows=10000, now=START + datetime.timedelta(days=10))
+        log.close()
+
+        rows = self.merge()
+        self.assertEqual(len(rows), 12)
+        self.assertMeans(rows, self.unit_means())
+
+    def test_compacted_history_into_new_fleet(self):
+        log = pira_log.Log(self.unit, check_timeout=0)
+        log.compact(max_rows=10000, now=START + datetime.timedelta(days=10))
+        log.close()
+
+        rows = self.merge()
+        self.assertEqual(len(rows), 12)
+        self.assertMeans(rows, self.unit_means())
+
+    def test_minute_buckets_without_samples(self):
+        self.assertEqual(len(self.merge()), 720)
+
+        # Like unarchived history, only the minute rollups are left.
+        db = sqlite3.connect(self.unit)
+        db.execute('DELETE FROM log')
+        db.commit()
+        db.close()
+
+        rows = self.merge()
+        self.assertEqual(len(rows), 120)
+        self.assertMeans(rows, self.unit_means())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from pira import log as pira_log
+
+START = datetime.datetime(2020, 1, 1)
+KEY = 'device.voltage'
+
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = pira_log.Log(os.path.join(self.directory, 'log.db'), check_timeout=0)
+
+        # Two hours of samples every 10 seconds.
+        self.samples = [(START + datetime.timedelta(seconds=10 * index), 3 + (index % 7) * 0.1) for index in range(720)]
+        self.log.insert_many([(KEY, value, timestamp) for timestamp, value in self.samples])
+        self.log.insert('system', 'boot', START)
+        self.log.flush()
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.directory)
+
+    def check_statistics(self):
+        count, average, min_value, max_value = self.log.aggregate(START, KEY, START + datetime.timedelta(days=1))
+        values = [value for _, value in self.samples]
+        self.assertEqual(count, len(values))
+        self.assertAlmostEqual(average, sum(values) / len(values))
+        self.assertAlmostEqual(min_value, min(values))
+        self.assertAlmostEqual(max_value, max(values))
+
+    def test_compact(self):
+        rows, size = self.log.compact(max_rows=10000, now=START + datetime.timedelta(days=10))
+        # Raw samples and minute rollups are replaced by 10 minute rollups.
+        self.assertEqual(rows, 720 + 120 - 12)
+        self.assertGreaterEqual(size, 0)
+
+        self.check_statistics()
+        self.assertEqual(len(self.log.query(START, KEY, only_numeric=True)), 12)
+        self.assertEqual(self.log.query(START, 'system'), ['boot'])
+
+    def test_compact_in_steps(self):
+        now = START + datetime.timedelta(days=10)
+        while self.log.compact(max_rows=50, now=now)[0]:
+            pass
+
+        self.check_statistics()
+        self.assertEqual(len(self.log.query(START, KEY, only_numeric=True)), 12)
+
+    def test_archive(self):
+        rows, size = self.log.archive(now=START + datetime.timedelta(days=2))
+        self.assertEqual(rows, 720)
+        self.assertGreater(size, 0)
+
+        self.check_statistics()
+        self.assertEqual(len(self.log.query(START, KEY)), 720)
+
+    def test_compact_archived(self):
+        self.log.archive(now=START + datetime.timedelta(days=2))
+        rows, size = self.log.compact(max_rows=10000, now=START + datetime.timedelta(days=10))
+        self.assertGreaterEqual(rows, 0)
+        self.assertGreaterEqual(size, 0)
+
+        self.check_statistics()
+        self.assertEqual(len(self.log.query(START, KEY, only_numeric=True)), 12)
+        self.assertEqual(self.log._db.execute('SELECT count(*) FROM log_archive').fetchone()[0], 0)
+        self.assertEqual(
+            self.log._db.execute('SELECT DISTINCT width FROM log_rollup').fetchall(),
+            [(600,)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pira import log as pira_log
+
+START = datetime.datetime(2020, 1, 1)
+KEY = 'test.value'
+
+
+def in_thread(function, *args):
+    """Call function in a separate thread and return its result."""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function(*args)))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+class HandoverTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_log(self, **kwargs):
+        return pira_log.Log(os.path.join(self.directory, 'log.db'), check_timeout=0, **kwargs)
+
+    def check_handover(self, start=START, **kwargs):
+        log = self.open_log(**kwargs)
+        log.insert_many([(KEY, index, start + datetime.timedelta(seconds=index)) for index in range(300)])
+        in_thread(log.insert, KEY, 300, start + datetime.timedelta(seconds=300))
+
+        # Other threads see handed over entries before the owner writes them.
+        self.assertEqual(len(in_thread(log.query, start, KEY)), 301)
+        self.assertEqual(len(log.query(start, KEY)), 301)
+        self.assertEqual(log.aggregate(start, KEY)[0], 301)
+        log.close()
+
+        log = self.open_log(cache_size=0)
+        self.assertEqual(len(log.query(start, KEY)), 301)
+        log.close()
+
+    def test_handover(self):
+        self.check_handover(writer_thread=False, cache_size=0)
+
+    def test_handover_with_writer_thread(self):
+        self.check_handover(writer_thread=True, cache_size=0)
+
+    def test_handover_with_cache(self):
+        # Only entries inserted after opening the log are cached.
+        start = datetime.datetime.now() + datetime.timedelta(minutes=1)
+        self.check_handover(start, writer_thread=True, cache_size=1000, cache_age=3600)
+
+    def test_queries_in_other_threads(self):
+        log = self.open_log(writer_thread=True)
+        log.insert_many([(KEY, index, START + datetime.timedelta(seconds=index)) for index in range(300)])
+        log.flush()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(log.query(START, KEY)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([len(result) for result in results], [300] * 4)
+        log.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+from __future__ import print_function
+
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from pira import log as pira_log
+
+START = datetime.datetime(2020, 1, 1)
+KEY = 'device.temperature'
+
+
+def temperatures(count, seed=1):
+    """Random walk quantized to 0.25 degrees, sampled every 30 seconds."""
+    generator = random.Random(seed)
+    value = 20.0
+    samples = []
+    for index in range(count):
+        value += generator.choice([-0.25, 0, 0, 0, 0.25])
+        samples.append((START + datetime.timedelta(seconds=30 * index), value))
+    return samples
+
+
+class WritePolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open_log(self, name, write_policies):
+        return pira_log.Log(
+            os.path.join(self.directory, name), check_timeout=0, write_policies=write_policies
+        )
+
+    def insert(self, log, samples):
+        log.insert_many([(KEY, value, timestamp) for timestamp, value in samples])
+        log.flush()
+
+    def test_single_steps_are_written(self):
+        log = self.open_log('log.db', True)
+        self.insert(log, [(START, 20.0), (START + datetime.timedelta(seconds=30), 20.25)])
+        self.assertEqual(log.suppressed_count, 0)
+        log.close()
+
+    def test_statistics_match_unfiltered(self):
+        samples = temperatures(100)
+        end = START + datetime.timedelta(seconds=30 * len(samples))
+
+        unfiltered = self.open_log('unfiltered.db', False)
+        self.insert(unfiltered, samples)
+        expected = unfiltered.aggregate(START, KEY, end)
+        unfiltered.close()
+        self.assertEqual(expected[0], 100)
+
+        log = self.open_log('log.db', True)
+        self.insert(log, samples)
+        self.assertGreater(log.suppressed_count, 0)
+
+        count, average, min_value, max_value = log.aggregate(START, KEY, end)
+        self.assertEqual(count, expected[0])
+        self.assertAlmostEqual(average, expected[1])
+        self.assertEqual((min_value, max_value), expected[2:])
+
+        # Suppressed samples are still counted once the log has been reopened.
+        log.close()
+        log = self.open_log('log.db', True)
+        count, average, min_value, max_value = log.aggregate(START, KEY, end)
+        self.assertEqual(count, expected[0])
+        self.assertAlmostEqual(average, expected[1])
+        self.assertEqual((min_value, max_value), expected[2:])
+        log.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
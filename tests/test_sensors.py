@@ -0,0 +1,65 @@
+from __future__ import print_function
+
+import time
+import unittest
+
+from pira import sensors
+
+
+class FakeADC(object):
+    def __init__(self):
+        self.reads = 0
+
+    def get_voltage(self):
+        self.reads += 1
+        return 3.7
+
+
+class FakeBoot(object):
+    def __init__(self):
+        self.sensor_mcp = FakeADC()
+
+
+class SensorsTest(unittest.TestCase):
+    def test_readings_are_shared(self):
+        boot = FakeBoot()
+        snapshot = sensors.Sensors(boot, ttl=60)
+        for _ in range(5):
+            self.assertEqual(snapshot.voltage, 3.7)
+
+        self.assertEqual(boot.sensor_mcp.reads, 1)
+        self.assertEqual((snapshot.reads['voltage'], snapshot.hits['voltage']), (1, 4))
+        self.assertEqual(snapshot.i2c_transactions_saved, 4 * sensors.I2C_TRANSACTIONS['voltage'])
+
+        # Every tick starts with fresh readings.
+        snapshot.refresh()
+        self.assertEqual(snapshot.voltage, 3.7)
+        self.assertEqual(boot.sensor_mcp.reads, 2)
+
+    def test_expired_readings(self):
+        boot = FakeBoot()
+        snapshot = sensors.Sensors(boot, ttl=0.01)
+        snapshot.voltage
+        time.sleep(0.02)
+        snapshot.voltage
+        self.assertEqual(boot.sensor_mcp.reads, 2)
+
+    def test_charger_status_per_type(self):
+        statuses = []
+
+        class Charger(object):
+            def get_status(self, status_type):
+                statuses.append(status_type)
+                return 'status {}'.format(status_type)
+
+        boot = FakeBoot()
+        boot.sensor_bq = Charger()
+        snapshot = sensors.Sensors(boot, ttl=60)
+        self.assertEqual(snapshot.charger_status(1), 'status 1')
+        self.assertEqual(snapshot.charger_status(2), 'status 2')
+        self.assertEqual(snapshot.charger_status(1), 'status 1')
+        self.assertEqual(statuses, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
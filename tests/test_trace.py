@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from pira import trace
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chrome_trace(self):
+        tracer = trace.Tracer(self.directory, retention=5)
+        tracer.metadata['boot_reason'] = 'timer'
+        with tracer.span('setup', 'boot', step=1):
+            time.sleep(0.01)
+        thread = threading.Thread(target=lambda: tracer.instant('done', 'process'), name='worker')
+        thread.start()
+        thread.join()
+        tracer.save()
+
+        filenames = os.listdir(self.directory)
+        self.assertEqual(len(filenames), 1)
+        with open(os.path.join(self.directory, filenames[0])) as trace_file:
+            data = json.load(trace_file)
+
+        events = dict((event['name'], event) for event in data['traceEvents'])
+        self.assertEqual(events['setup']['ph'], 'X')
+        self.assertGreaterEqual(events['setup']['dur'], 10000)
+        self.assertEqual(events['setup']['args'], {'step': 1})
+        self.assertEqual(events['done']['ph'], 'i')
+        self.assertNotEqual(events['done']['tid'], events['setup']['tid'])
+        thread_names = [event['args']['name'] for event in data['traceEvents'] if event['name'] == 'thread_name']
+        self.assertIn('worker', thread_names)
+        self.assertEqual(data['otherData']['boot_reason'], 'timer')
+        self.assertEqual(data['otherData']['dropped_events'], 0)
+
+    def test_retention(self):
+        for index in range(4):
+            filename = os.path.join(self.directory, 'trace-2020010{}-000000.json'.format(index))
+            with open(filename, 'w') as trace_file:
+                trace_file.write('{}')
+            os.utime(filename, (index, index))
+
+        tracer = trace.Tracer(self.directory, retention=2)
+        tracer.instant('boot')
+        tracer.save()
+
+        filenames = sorted(os.listdir(self.directory))
+        self.assertEqual(len(filenames), 2)
+        self.assertEqual(filenames[0], 'trace-20200103-000000.json')
+
+    def test_event_limit(self):
+        tracer = trace.Tracer(self.directory, retention=1)
+        for _ in range(trace.MAX_TRACE_EVENTS + 10):
+            tracer.instant('tick')
+        self.assertEqual(tracer.dropped, 10)
+
+    def test_disabled(self):
+        tracer = trace.Tracer(self.directory, retention=0)
+        with tracer.span('setup'):
+            pass
+        tracer.save()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+from pira import log as pira_log
+from pira import watchdog
+
+EPOCH = datetime.datetime(2000, 1, 1)
+
+
+def interrupt():
+    """Deliver the watchdog alarm right now."""
+    os.kill(os.getpid(), signal.SIGALRM)
+
+
+class InterruptingConnection(object):
+    """Database connection that is interrupted right after a commit."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def __enter__(self):
+        return self._db.__enter__()
+
+    def __exit__(self, *args):
+        result = self._db.__exit__(*args)
+        interrupt()
+        return result
+
+
+class InterruptingQueue(object):
+    """Writer queue that is interrupted before a batch is queued."""
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
+    def put(self, item, *args, **kwargs):
+        if isinstance(item, list):
+            interrupt()
+        return self._queue.put(item, *args, **kwargs)
+
+
+class WatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.watchdog = watchdog.Watchdog()
+
+    def tearDown(self):
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+    def test_budget_interrupts(self):
+        with self.assertRaises(watchdog.BudgetExceeded):
+            with self.watchdog.budget(0.01):
+                signal.pause()
+
+    def test_deferred_section_is_completed(self):
+        completed = []
+        with self.assertRaises(watchdog.BudgetExceeded):
+            with self.watchdog.budget(60):
+                with watchdog.deferred():
+                    interrupt()
+                    completed.append(True)
+                completed.append(False)
+        self.assertEqual(completed, [True])
+
+    def test_no_interruption_outside_budget(self):
+        with watchdog.deferred():
+            interrupt()
+
+
+class InterruptedInsertTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.watchdog = watchdog.Watchdog()
+
+    def tearDown(self):
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        shutil.rmtree(self.directory)
+
+    def open_log(self, **kwargs):
+        return pira_log.Log(os.path.join(self.directory, 'log.db'), check_timeout=0, cache_size=0, **kwargs)
+
+    def test_interrupted_flush(self):
+        log = self.open_log(buffer_size=1, writer_thread=False)
+        log._db = InterruptingConnection(log._db)
+        with self.assertRaises(watchdog.BudgetExceeded):
+            with self.watchdog.budget(60):
+                log.insert('test.value', 1)
+        log._db = log._db._db
+
+        log.insert('test.value', 2)
+        log.flush()
+        self.assertEqual(log.query(EPOCH, 'test.value'), ['1', '2'])
+        log.close()
+
+    def test_interrupted_queueing(self):
+        log = self.open_log(buffer_size=1, writer_thread=True)
+        log._queue = InterruptingQueue(log._queue)
+        with self.assertRaises(watchdog.BudgetExceeded):
+            with self.watchdog.budget(60):
+                log.insert('test.value', 1)
+        log._queue = log._queue._queue
+
+        log.flush()
+        self.assertEqual(log._pending, [])
+        self.assertEqual(log.query(EPOCH, 'test.value'), ['1'])
+        log.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
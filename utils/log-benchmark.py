@@ -0,0 +1,598 @@
+"""Benchmark for the persistent log store (pira.log).
+
+Runs against temporary database files, for example:
+
+    python utils/log-benchmark.py insert --rows 2000
+    python utils/log-benchmark.py profiles --query-rows 1000000
+    python utils/log-benchmark.py keys --months 3
+    python utils/log-benchmark.py cache --loops 2000
+    python utils/log-benchmark.py policy --loops 2000
+    python utils/log-benchmark.py archive --months 3
+    python utils/log-benchmark.py suite --months 6 --json results.json
+
+The suite benchmark writes its results as JSON, so runs before and after a
+change can be compared.
+"""
+from __future__ import print_function, division
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pira import schema  # noqa: E402
+from pira.archive import encode_chunk, decode_chunk  # noqa: E402
+from pira.const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE  # noqa: E402
+from pira.messages import MeasurementConfig, create_measurements_message  # noqa: E402
+from pira.log import Log  # noqa: E402
+from pira.retention import ARCHIVE_CHUNK_ROWS  # noqa: E402
+
+KEYS = ['device.voltage', 'device.temperature', 'ultrasonic.distance']
+
+
+def synthetic_entries(months, start_ts=None):
+    """Generate a synthetic log matching the firmware key patterns.
+
+    Voltage, temperature and distance are sampled every 30 seconds during
+    15 minute wake cycles every 50 minutes, each cycle is framed by system
+    events.
+    """
+    rng = random.Random(42)
+    if start_ts is None:
+        start_ts = datetime.datetime.now() - datetime.timedelta(days=30 * months)
+
+    cycle = datetime.timedelta(minutes=50)
+    for index in range(int(months * 30 * 24 * 60 / 50)):
+        boot_ts = start_ts + index * cycle
+        yield 'system', 'boot', boot_ts
+        yield 'system', 'main_loop', boot_ts
+        for sample in range(30):
+            timestamp = boot_ts + datetime.timedelta(seconds=30 * sample)
+            yield 'device.voltage', '{:.3F}'.format(3.6 + rng.random() * 0.5), timestamp
+            yield 'device.temperature', 20 + rng.randint(-40, 40) * 0.25, timestamp
+            yield 'ultrasonic.distance', rng.randint(300, 5000), timestamp
+        yield 'system', 'shutdown', timestamp
+        yield 'system', 'halt', timestamp
+
+
+def chunked(iterable, size):
+    """Split iterable into lists of the given size."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def percentile(values, fraction):
+    """Return the given percentile of a list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_insert(path, rows, buffer_size, writer_thread=False):
+    """Insert rows one by one and measure per-insert latency."""
+    log = Log(path, buffer_size=buffer_size, buffer_age=3600, writer_thread=writer_thread)
+    start_ts = datetime.datetime.now()
+    latencies = []
+
+    started = time.time()
+    for index in range(rows):
+        timestamp = start_ts + datetime.timedelta(seconds=index * 10)
+        before = time.time()
+        log.insert(KEYS[index % len(KEYS)], 3.7 + (index % 100) / 1000.0, timestamp)
+        latencies.append(time.time() - before)
+    log.close()
+    elapsed = time.time() - started
+
+    return elapsed, latencies
+
+
+def bench_insert_many(path, rows, batch):
+    """Insert rows in batches through insert_many."""
+    log = Log(path)
+    start_ts = datetime.datetime.now()
+    latencies = []
+
+    started = time.time()
+    for offset in range(0, rows, batch):
+        entries = [
+            (KEYS[index % len(KEYS)], 3.7 + (index % 100) / 1000.0, start_ts + datetime.timedelta(seconds=index * 10))
+            for index in range(offset, min(rows, offset + batch))
+        ]
+        before = time.time()
+        log.insert_many(entries)
+        latencies.append((time.time() - before) / len(entries))
+    log.close()
+    elapsed = time.time() - started
+
+    return elapsed, latencies
+
+
+def written_bytes():
+    """Return the number of bytes this process has written so far, if known."""
+    try:
+        with open('/proc/self/io') as io_file:
+            for line in io_file:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+
+
+def bench_profile(path, profile, rows, commits):
+    """Measure write amplification and query latency of a storage profile."""
+    log = Log(path, profile=profile)
+
+    # Populate the log in large batches, one sample every 10 seconds per key.
+    end_ts = datetime.datetime.now()
+    start_ts = end_ts - datetime.timedelta(seconds=rows * 10 // len(KEYS))
+    batch = 10000
+    for offset in range(0, rows, batch):
+        log.insert_many(
+            (KEYS[index % len(KEYS)], 3.7 + (index % 100) / 1000.0,
+             start_ts + datetime.timedelta(seconds=(index // len(KEYS)) * 10))
+            for index in range(offset, min(rows, offset + batch))
+        )
+
+    # Write amplification of single-row commits, as done by the main loop.
+    payload = len('{}{}{}'.format(int(time.time()), KEYS[0], 3.712))
+    before = written_bytes()
+    for index in range(commits):
+        log.insert(KEYS[index % len(KEYS)], 3.712)
+    after = written_bytes()
+    amplification = (after - before) / float(commits * payload) if before is not None else None
+
+    # Query latency for different window sizes.
+    latencies = collections.OrderedDict()
+    for name, window in [('1h', datetime.timedelta(hours=1)), ('1d', datetime.timedelta(days=1)),
+                         ('7d', datetime.timedelta(days=7))]:
+        before = time.time()
+        values = log.query(end_ts - window, KEYS[0], only_numeric=True)
+        latencies[name] = (time.time() - before, len(values))
+
+    log.close()
+    return amplification, latencies
+
+
+def run_profiles(args, workdir):
+    print("Populating {} rows per profile.".format(args.query_rows))
+    for index, profile in enumerate(sorted(schema.STORAGE_PROFILES)):
+        amplification, latencies = bench_profile(
+            os.path.join(workdir, 'profile-{}.db'.format(index)),
+            profile,
+            args.query_rows,
+            args.commits,
+        )
+        print("{:<8} write amplification {:>8}   query {}".format(
+            profile,
+            '{:.1f}x'.format(amplification) if amplification is not None else 'n/a',
+            '   '.join(
+                '{} {:.2f} ms ({} rows)'.format(name, 1000.0 * elapsed, count)
+                for name, (elapsed, count) in latencies.items()
+            ),
+        ))
+
+
+def bench_string_keys(path, months):
+    """Populate a log using the schema before key interning (version 3)."""
+    db = sqlite3.connect(path)
+    db.create_function('pira_numeric', 1, schema.numeric)
+    db.execute(schema.LOG_TABLE_SCHEMA)
+    for steps in schema.LOG_MIGRATIONS[:3]:
+        schema.migrate(db, steps)
+    db.commit()
+
+    rows = 0
+    started = time.time()
+    for chunk in chunked(synthetic_entries(months), 1000):
+        with db:
+            db.executemany(
+                'INSERT INTO log (timestamp, key, value, numeric_value) VALUES (?, ?, ?, ?)',
+                [(int(ts.strftime('%s')), key, str(value), schema.numeric(value)) for key, value, ts in chunk]
+            )
+        rows += len(chunk)
+    elapsed = time.time() - started
+    db.close()
+
+    return rows, elapsed
+
+
+def bench_interned_keys(path, months):
+    """Populate a log through Log.insert_many."""
+    log = Log(path, profile='legacy')
+
+    rows = 0
+    started = time.time()
+    for chunk in chunked(synthetic_entries(months), 1000):
+        log.insert_many(chunk)
+        rows += len(chunk)
+    elapsed = time.time() - started
+    log.close()
+
+    return rows, elapsed
+
+
+def run_keys(args, workdir):
+    for index, (name, bench) in enumerate([('string keys', bench_string_keys), ('interned keys', bench_interned_keys)]):
+        path = os.path.join(workdir, 'keys-{}.db'.format(index))
+        rows, elapsed = bench(path, args.months)
+        size = os.path.getsize(path)
+        print("{:<14} {} rows   {:>8.0f} rows/s   {:>8.2f} MiB   {:>6.1f} bytes/row".format(
+            name, rows, rows / elapsed, size / (1024.0 * 1024.0), size / float(rows)
+        ))
+
+
+def bench_cache(path, loops, cache_size):
+    """Simulate main loop inserts and "since last report" window queries."""
+    log = Log(path, cache_size=cache_size)
+    start_ts = datetime.datetime.now()
+    last_report = start_ts
+    latencies = []
+
+    for index in range(loops):
+        timestamp = start_ts + datetime.timedelta(seconds=30 * index)
+        log.insert_many([
+            ('device.voltage', 3.7, timestamp),
+            ('device.temperature', 21.25, timestamp),
+            ('ultrasonic.distance', 1200, timestamp),
+        ])
+
+        # Report every 10 loops, like LoRa, and daily, like Rockblock.
+        windows = []
+        if index % 10 == 9:
+            windows.append(last_report)
+            last_report = timestamp
+        if index % 100 == 99:
+            windows.append(timestamp - datetime.timedelta(days=1))
+
+        for window in windows:
+            before = time.time()
+            for key in KEYS:
+                log.aggregate(window, key)
+                log.query(window, key, only_numeric=True)
+            latencies.append(time.time() - before)
+
+    hits, misses = log.cache_hits, log.cache_misses
+    log.close()
+    return hits, misses, latencies
+
+
+def run_cache(args, workdir):
+    for index, cache_size in enumerate([0, 1000]):
+        path = os.path.join(workdir, 'cache-{}.db'.format(index))
+
+        # Start with a day of history.
+        log = Log(path)
+        for chunk in chunked(synthetic_entries(1 / 30.0), 5000):
+            log.insert_many(chunk)
+        log.close()
+
+        hits, misses, latencies = bench_cache(path, args.loops, cache_size)
+        print("cache size {:<5}  hit rate {:>5.1f}%   report mean {:>8.3f} ms   p50 {:>8.3f} ms   p99 {:>8.3f} ms".format(
+            cache_size,
+            100.0 * hits / max(1, hits + misses),
+            1000.0 * sum(latencies) / len(latencies),
+            1000.0 * percentile(latencies, 0.5),
+            1000.0 * percentile(latencies, 0.99),
+        ))
+
+
+def drifting_readings(loops):
+    """Generate main loop voltage and temperature readings, every 30 seconds.
+
+    Voltage slowly discharges with ADC noise, temperature follows a slow
+    random walk quantized to 0.25 degrees.
+    """
+    rng = random.Random(42)
+    start_ts = datetime.datetime.now() - datetime.timedelta(seconds=30 * loops)
+    temperature = 20.0
+    for index in range(loops):
+        timestamp = start_ts + datetime.timedelta(seconds=30 * index)
+        temperature += rng.gauss(0, 0.05)
+        voltage = 4.1 - 0.5 * index / loops + rng.gauss(0, 0.005)
+        yield timestamp, '{:.3F}'.format(voltage), round(temperature * 4) / 4.0
+
+
+def run_policy(args, workdir):
+    readings = list(drifting_readings(args.loops))
+    start_ts = readings[0][0]
+
+    for index, write_policies in enumerate([False, True]):
+        path = os.path.join(workdir, 'policy-{}.db'.format(index))
+        log = Log(path, write_policies=write_policies)
+        started = time.time()
+        for timestamp, voltage, temperature in readings:
+            log.insert('device.voltage', voltage, timestamp)
+            log.insert('device.temperature', temperature, timestamp)
+        elapsed = time.time() - started
+
+        rows = sum(len(log.query(None, key)) for key in ('device.voltage', 'device.temperature'))
+        stats = [log.aggregate(start_ts, key) for key in ('device.voltage', 'device.temperature')]
+        log.close()
+
+        print("write policies {:<5}  rows {:>7}   insert {:>8.3f} ms/loop   voltage avg {:.4f}   temperature avg {:.3f}".format(
+            str(write_policies),
+            rows,
+            1000.0 * elapsed / len(readings),
+            stats[0][1],
+            stats[1][1],
+        ))
+
+
+def bench_codec(months):
+    """Measure chunk encode and decode throughput per key."""
+    series = collections.OrderedDict((key, ([], [])) for key in KEYS)
+    for key, value, timestamp in synthetic_entries(months):
+        if key in series:
+            series[key][0].append(int(timestamp.strftime('%s')))
+            series[key][1].append(float(value))
+
+    chunk_rows = ARCHIVE_CHUNK_ROWS
+    for key, (timestamps, values) in series.items():
+        started = time.time()
+        chunks = [
+            encode_chunk(timestamps[offset:offset + chunk_rows], values[offset:offset + chunk_rows])
+            for offset in range(0, len(timestamps), chunk_rows)
+        ]
+        encoded = time.time() - started
+
+        started = time.time()
+        for chunk in chunks:
+            decode_chunk(chunk)
+        decoded = time.time() - started
+
+        print("{:<20} {:>8} rows   encode {:>9.0f} rows/s   decode {:>9.0f} rows/s   {:>5.2f} bytes/row".format(
+            key,
+            len(timestamps),
+            len(timestamps) / encoded,
+            len(timestamps) / decoded,
+            sum(len(chunk) for chunk in chunks) / len(timestamps),
+        ))
+
+
+def run_archive(args, workdir):
+    bench_codec(args.months)
+
+    path = os.path.join(workdir, 'archive.db')
+    log = Log(path, cache_size=0)
+    for chunk in chunked(synthetic_entries(args.months), 5000):
+        log.insert_many(chunk)
+    start_ts = datetime.datetime.now() - datetime.timedelta(days=30 * args.months)
+
+    for name in ['raw', 'archived']:
+        if name == 'archived':
+            started = time.time()
+            rows = 0
+            while True:
+                archived, _ = log.archive(age=datetime.timedelta(0), max_rows=100000)
+                if not archived:
+                    break
+                rows += archived
+            print("archived {} rows in {:.2f} s".format(rows, time.time() - started))
+
+        log.close()
+        size = os.path.getsize(path)
+        log = Log(path, cache_size=0)
+
+        started = time.time()
+        rows = sum(len(log.query(start_ts, key, include_ts=True, only_numeric=True)) for key in KEYS)
+        elapsed = time.time() - started
+        print("{:<8} {:>10} bytes   {:>6.1f} bytes/row   full export {:>9.0f} rows/s".format(
+            name,
+            size,
+            size / rows,
+            rows / elapsed,
+        ))
+
+    log.close()
+
+
+def latency_stats(latencies):
+    """Summarize latencies (in seconds) in milliseconds."""
+    return collections.OrderedDict([
+        ('mean_ms', 1000.0 * sum(latencies) / len(latencies)),
+        ('p50_ms', 1000.0 * percentile(latencies, 0.5)),
+        ('p99_ms', 1000.0 * percentile(latencies, 0.99)),
+    ])
+
+
+def database_bytes(path):
+    """Return the size of a database including its write-ahead log."""
+    return sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+
+
+# Query windows of the suite benchmark.
+SUITE_WINDOWS = [
+    ('1h', datetime.timedelta(hours=1)),
+    ('1d', datetime.timedelta(days=1)),
+    ('7d', datetime.timedelta(days=7)),
+    ('30d', datetime.timedelta(days=30)),
+]
+
+# Measurements reported by the suite benchmark, like the LoRa module does.
+SUITE_MEASUREMENTS = [
+    MEASUREMENT_DEVICE_VOLTAGE,
+    MEASUREMENT_DEVICE_TEMPERATURE,
+    MeasurementConfig('ultrasonic.distance', int),
+]
+
+SuiteBoot = collections.namedtuple('SuiteBoot', ['log'])
+
+
+def bench_suite(path, months, loops):
+    """Measure insert throughput, size growth, open time and query costs."""
+    results = collections.OrderedDict()
+    end_ts = datetime.datetime.now()
+    start_ts = end_ts - datetime.timedelta(days=30 * months)
+
+    # Bulk inserts, one month at a time.
+    log = Log(path)
+    rows = 0
+    elapsed = 0.0
+    growth = []
+    month = 0
+    while month < months:
+        entries = list(synthetic_entries(min(1, months - month), start_ts + datetime.timedelta(days=30 * month)))
+        started = time.time()
+        for chunk in chunked(entries, 1000):
+            log.insert_many(chunk)
+        log.flush()
+        elapsed += time.time() - started
+
+        rows += len(entries)
+        month += 1
+        growth.append(collections.OrderedDict([
+            ('month', month),
+            ('rows', rows),
+            ('bytes', database_bytes(path)),
+        ]))
+
+    results['insert_many'] = collections.OrderedDict([
+        ('rows', rows),
+        ('seconds', elapsed),
+        ('rows_per_second', rows / elapsed),
+    ])
+    results['growth'] = growth
+
+    # Single inserts, as done by the main loop.
+    latencies = []
+    for index in range(loops):
+        timestamp = end_ts + datetime.timedelta(seconds=30 * index)
+        started = time.time()
+        log.insert(KEYS[index % len(KEYS)], 3.712, timestamp)
+        latencies.append(time.time() - started)
+    results['insert'] = latency_stats(latencies)
+    log.close()
+
+    latencies = []
+    for _ in range(max(1, loops // 100)):
+        started = time.time()
+        log = Log(path)
+        latencies.append(time.time() - started)
+        log.close()
+    results['open'] = latency_stats(latencies)
+
+    # Queries with a cold cache, as after a reboot.
+    log = Log(path)
+    boot = SuiteBoot(log)
+    for name, run in [
+        ('query', lambda window, key: log.query(window, key, only_numeric=True)),
+        ('aggregate', lambda window, key: log.aggregate(window, key)),
+        ('measurements_message', lambda window, key: create_measurements_message(boot, window, SUITE_MEASUREMENTS)),
+    ]:
+        results[name] = collections.OrderedDict()
+        for window_name, window in SUITE_WINDOWS:
+            latencies = []
+            for key in KEYS:
+                started = time.time()
+                run(end_ts - window, key)
+                latencies.append(time.time() - started)
+            results[name][window_name] = latency_stats(latencies)
+
+    log.close()
+    return results
+
+
+def run_suite(args, workdir):
+    results = bench_suite(os.path.join(workdir, 'suite.db'), args.months, args.loops)
+
+    print("insert_many {:.0f} rows/s, insert mean {:.3f} ms, open mean {:.3f} ms".format(
+        results['insert_many']['rows_per_second'],
+        results['insert']['mean_ms'],
+        results['open']['mean_ms'],
+    ))
+    for growth in results['growth']:
+        print("month {:>3}: {:>9} rows {:>12} bytes".format(growth['month'], growth['rows'], growth['bytes']))
+    for name in ['query', 'aggregate', 'measurements_message']:
+        print("{:<22} {}".format(name, '   '.join(
+            '{} {:.2f} ms'.format(window, stats['mean_ms']) for window, stats in results[name].items()
+        )))
+
+    if args.json:
+        document = collections.OrderedDict([
+            ('created', datetime.datetime.now().isoformat()),
+            ('python', platform.python_version()),
+            ('sqlite', sqlite3.sqlite_version),
+            ('platform', platform.platform()),
+            ('storage_profile', os.environ.get('LOG_STORAGE_PROFILE', schema.DEFAULT_STORAGE_PROFILE)),
+            ('months', args.months),
+            ('loops', args.loops),
+            ('results', results),
+        ])
+        with open(args.json, 'w') as output:
+            json.dump(document, output, indent=2)
+        print("Results written to '{}'.".format(args.json))
+
+
+def report(name, rows, elapsed, latencies):
+    print("{:<28} {:>10.0f} rows/s   mean {:>8.3f} ms   p50 {:>8.3f} ms   p99 {:>8.3f} ms".format(
+        name,
+        rows / elapsed,
+        1000.0 * sum(latencies) / len(latencies),
+        1000.0 * percentile(latencies, 0.5),
+        1000.0 * percentile(latencies, 0.99),
+    ))
+
+
+def run_insert(args, workdir):
+    runs = [
+        ('per-row commit', lambda path: bench_insert(path, args.rows, 1)),
+        ('buffered ({} rows)'.format(args.buffer), lambda path: bench_insert(path, args.rows, args.buffer)),
+        ('insert_many ({} rows)'.format(args.buffer), lambda path: bench_insert_many(path, args.rows, args.buffer)),
+        ('writer thread', lambda path: bench_insert(path, args.rows, 1, writer_thread=True)),
+    ]
+
+    for index, (name, run) in enumerate(runs):
+        elapsed, latencies = run(os.path.join(workdir, 'insert-{}.db'.format(index)))
+        report(name, args.rows, elapsed, latencies)
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('insert', run_insert),
+    ('profiles', run_profiles),
+    ('keys', run_keys),
+    ('cache', run_cache),
+    ('policy', run_policy),
+    ('archive', run_archive),
+    ('suite', run_suite),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pira.log performance.")
+    parser.add_argument('benchmarks', nargs='*', choices=list(BENCHMARKS), default=['insert'],
+                        help="benchmarks to run")
+    parser.add_argument('--rows', type=int, default=2000, help="number of rows to insert")
+    parser.add_argument('--buffer', type=int, default=50, help="buffer size for the buffered run")
+    parser.add_argument('--query-rows', type=int, default=1000000, help="size of the log used for query benchmarks")
+    parser.add_argument('--commits', type=int, default=200, help="single-row commits for write amplification")
+    parser.add_argument('--months', type=float, default=3, help="length of the synthetic log in months")
+    parser.add_argument('--loops', type=int, default=2000, help="main loop iterations for the cache and policy benchmarks")
+    parser.add_argument('--json', default=None, help="file the suite results are written to")
+    parser.add_argument('--dir', default=None, help="directory for temporary databases (e.g. on the SD card)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pira-log-benchmark-', dir=args.dir)
+    try:
+        for name in args.benchmarks:
+            BENCHMARKS[name](args, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Download new log entries from a PiRA unit.
+
+Entries are fetched from the web server in the columnar format and appended
+to a CSV file. The cursor of the last received block is stored next to the
+output, so repeated runs only download entries added since the last run and
+interrupted downloads resume where they stopped, for example:
+
+    python utils/log-export.py http://192.168.1.10 pira-01.csv
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import os
+import sys
+
+try:
+    from urllib.request import urlopen
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+    from urllib2 import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pira import export  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download new log entries from a PiRA unit.")
+    parser.add_argument('url', help="address of the unit web server")
+    parser.add_argument('output', help="CSV file the entries are appended to")
+    parser.add_argument('--keys', help="comma separated list of keys to download")
+    parser.add_argument('--cursor', help="cursor file, defaults to the output file with a .cursor suffix")
+    args = parser.parse_args()
+
+    cursor_file = args.cursor or args.output + '.cursor'
+    params = {'format': 'columnar'}
+    if args.keys:
+        params['keys'] = args.keys
+    if os.path.exists(cursor_file):
+        with open(cursor_file) as cursor_input:
+            params['cursor'] = cursor_input.read().strip()
+
+    response = urlopen('{}/api/export?{}'.format(args.url.rstrip('/'), urlencode(params)))
+
+    rows = 0
+    new_file = not os.path.exists(args.output)
+    with open(args.output, 'a') as output:
+        writer = csv.writer(output)
+        if new_file:
+            writer.writerow(['timestamp', 'key', 'value'])
+
+        for cursor, entries in export.read_columnar(response):
+            writer.writerows(entries)
+            output.flush()
+            rows += len(entries)
+
+            with open(cursor_file, 'w') as cursor_output:
+                cursor_output.write(export.format_cursor(cursor))
+
+    print("Downloaded {} entries.".format(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+"""Merge log databases of many units into one fleet database.
+
+Unit databases of any schema version written by pira.log are read by a
+pool of worker processes and bulk-loaded into the fleet database, for
+example:
+
+    python utils/log-merge.py fleet.db units/*.db
+    python utils/log-merge.py fleet.db --unit-from-dir units/*/pira-zero-log.db
+
+Entries are deduplicated on (unit, timestamp, key), so the same unit
+database can be merged repeatedly. Non-numeric entries (e.g. system events)
+are also compared by value, so different events within a second are kept.
+
+History that a unit has compacted into rollup buckets is merged as the
+mean of each bucket, timestamped with the bucket start, like numeric queries
+of pira.log return it. The mean replaces the numeric samples of the unit
+within the bucket, including raw samples merged before the unit compacted
+them, so history is never counted twice.
+"""
+from __future__ import print_function, division
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pira.archive import decode_chunk  # noqa: E402
+
+# Number of log rows read by a single reader task.
+TASK_ROWS = 50000
+
+# Number of rows inserted by a single executemany call.
+BATCH_ROWS = 10000
+
+FLEET_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS units (id integer primary key, name varchar unique)',
+    'CREATE TABLE IF NOT EXISTS keys (id integer primary key, name varchar unique)',
+    '''
+    CREATE TABLE IF NOT EXISTS log (
+        id integer primary key,
+        unit_id integer,
+        timestamp integer,
+        key_id integer,
+        value varchar,
+        numeric_value real
+    )
+    ''',
+]
+
+# Deduplication key, numeric samples are compared without their value.
+FLEET_ENTRY = "unit_id, timestamp, key_id, (CASE WHEN numeric_value IS NULL THEN value ELSE '' END)"
+
+FLEET_UNIQUE_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS log_unit_entry_index ON log ({})'.format(FLEET_ENTRY)
+FLEET_QUERY_INDEX = 'CREATE INDEX IF NOT EXISTS log_key_timestamp_index ON log (key_id, timestamp, unit_id)'
+
+
+def numeric(value):
+    """Convert value to float, returning None for non-numeric values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_numeric(value):
+    """Format archived numeric value like pira.log does."""
+    if value.is_integer():
+        return str(int(value))
+
+    return repr(value)
+
+
+def plan_unit(path):
+    """Split reading of a unit database into tasks.
+
+    :return: List of (path, kind, first_id, last_id) tasks or None when the
+        database cannot be read
+    """
+    try:
+        db = sqlite3.connect(path)
+        try:
+            tables = set(row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            if 'log' not in tables:
+                return []
+
+            max_id = db.execute('SELECT max(id) FROM log').fetchone()[0] or 0
+            # Compacted buckets exist since the rollup width column was added.
+            compacted = 'width' in [row[1] for row in db.execute('PRAGMA table_info(log_rollup)')]
+        finally:
+            db.close()
+    except sqlite3.Error as error:
+        print("ERROR: Failed to read '{}': {}".format(path, error))
+        return None
+
+    tasks = [(path, 'log', first_id, first_id + TASK_ROWS) for first_id in range(0, max_id, TASK_ROWS)]
+    if 'log_archive' in tables:
+        tasks.append((path, 'archive', 0, None))
+    if compacted:
+        tasks.append((path, 'rollup', 0, None))
+    return tasks
+
+
+def read_task(task):
+    """Reader process entry point.
+
+    :return: Tuple (task, rows, error), where rows is a list of
+        (timestamp, key, value, numeric_value) tuples, extended by the bucket
+        width for rollup tasks
+    """
+    path, kind, first_id, last_id = task
+    try:
+        db = sqlite3.connect(path)
+        try:
+            tables = set(row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            if kind == 'archive':
+                rows = []
+                chunks = db.execute(
+                    'SELECT keys.name, log_archive.data FROM log_archive JOIN keys ON keys.id = log_archive.key_id'
+                )
+                for key, data in chunks:
+                    timestamps, values = decode_chunk(data)
+                    rows.extend(
+                        (timestamp, key, format_numeric(value), value)
+                        for timestamp, value in zip(timestamps, values)
+                    )
+                return task, rows, None
+
+            if kind == 'rollup':
+                # Minute buckets are compacted history when their raw samples
+                # are gone, e.g. after unarchiving.
+                buckets = db.execute(
+                    'SELECT log_rollup.bucket, keys.name, log_rollup.total / log_rollup.count, log_rollup.width '
+                    'FROM log_rollup JOIN keys ON keys.id = log_rollup.key_id '
+                    'WHERE log_rollup.count > 0 AND (log_rollup.width > 60 OR NOT EXISTS ('
+                    '    SELECT 1 FROM log WHERE log.key_id = log_rollup.key_id AND log.timestamp >= log_rollup.bucket'
+                    '    AND log.timestamp < log_rollup.bucket + log_rollup.width AND log.numeric_value IS NOT NULL'
+                    '))'
+                )
+                rows = [(bucket, key, format_numeric(mean), mean, width) for bucket, key, mean, width in buckets]
+                return task, rows, None
+
+            if 'keys' in tables:
+                sql = (
+                    'SELECT log.timestamp, keys.name, log.value FROM log JOIN keys ON keys.id = log.key_id '
+                    'WHERE log.id > ? AND log.id <= ?'
+                )
+            else:
+                sql = 'SELECT timestamp, key, value FROM log WHERE id > ? AND id <= ?'
+
+            rows = [
+                (timestamp, key, value, numeric(value))
+                for timestamp, key, value in db.execute(sql, (first_id, last_id))
+                if key is not None
+            ]
+            return task, rows, None
+        finally:
+            db.close()
+    except sqlite3.Error as error:
+        return task, [], str(error)
+
+
+def unit_name(path, from_dir):
+    """Derive unit name from database path."""
+    if from_dir:
+        return os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def intern(db, table, cache, name):
+    """Resolve name to its id in a dimension table."""
+    try:
+        return cache[name]
+    except KeyError:
+        pass
+
+    db.execute('INSERT OR IGNORE INTO {} (name) VALUES (?)'.format(table), (name,))
+    cache[name] = db.execute('SELECT id FROM {} WHERE name = ?'.format(table), (name,)).fetchone()[0]
+    return cache[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge unit log databases into a fleet database.")
+    parser.add_argument('fleet', help="fleet database, created when it does not exist")
+    parser.add_argument('units', nargs='+', help="unit log databases")
+    parser.add_argument('--unit-from-dir', action='store_true',
+                        help="name units after the directory of their database instead of the file name")
+    parser.add_argument('--processes', type=int, default=None, help="number of reader processes")
+    args = parser.parse_args()
+
+    started = time.time()
+    db = sqlite3.connect(args.fleet)
+    db.execute('PRAGMA journal_mode = wal')
+    db.execute('PRAGMA synchronous = off')
+    db.execute('PRAGMA cache_size = -65536')
+    for statement in FLEET_SCHEMA:
+        db.execute(statement)
+
+    # Indexes are built once after loading, the unique index is only needed
+    # during the load to deduplicate against entries of earlier merges.
+    empty = db.execute('SELECT id FROM log LIMIT 1').fetchone() is None
+    db.execute('DROP INDEX IF EXISTS log_key_timestamp_index')
+    if empty:
+        db.execute('DROP INDEX IF EXISTS log_unit_entry_index')
+    db.execute('''
+        CREATE TEMP TABLE staging (
+            unit_id integer,
+            timestamp integer,
+            key_id integer,
+            value varchar,
+            numeric_value real
+        )
+    ''')
+    db.execute('''
+        CREATE TEMP TABLE staging_buckets (
+            unit_id integer,
+            key_id integer,
+            bucket integer,
+            width integer,
+            value varchar,
+            numeric_value real,
+            PRIMARY KEY (unit_id, key_id, bucket)
+        )
+    ''')
+    db.commit()
+
+    units = {}
+    keys = {}
+    unit_ids = dict((path, intern(db, 'units', units, unit_name(path, args.unit_from_dir))) for path in args.units)
+
+    pool = multiprocessing.Pool(args.processes)
+    tasks = []
+    failed = set()
+    for path, path_tasks in zip(args.units, pool.imap(plan_unit, args.units)):
+        if path_tasks is None:
+            failed.add(path)
+        else:
+            tasks.extend(path_tasks)
+
+    # Stage all rows without any indexes.
+    read = 0
+    for task, rows, error in pool.imap_unordered(read_task, tasks):
+        path = task[0]
+        if error is not None:
+            print("ERROR: Failed to read '{}': {}".format(path, error))
+            failed.add(path)
+            continue
+
+        unit_id = unit_ids[path]
+        if task[1] == 'rollup':
+            staged = [
+                (unit_id, intern(db, 'keys', keys, key), bucket, width, value, numeric_value)
+                for bucket, key, value, numeric_value, width in rows
+            ]
+            sql = (
+                'INSERT OR IGNORE INTO staging_buckets (unit_id, key_id, bucket, width, value, numeric_value) '
+                'VALUES (?, ?, ?, ?, ?, ?)'
+            )
+        else:
+            staged = [
+                (unit_id, timestamp, intern(db, 'keys', keys, key), value, numeric_value)
+                for timestamp, key, value, numeric_value in rows
+            ]
+            sql = 'INSERT INTO staging (unit_id, timestamp, key_id, value, numeric_value) VALUES (?, ?, ?, ?, ?)'
+        for offset in range(0, len(staged), BATCH_ROWS):
+            db.executemany(sql, staged[offset:offset + BATCH_ROWS])
+        read += len(staged)
+    db.commit()
+    pool.close()
+    pool.join()
+    read_time = time.time() - started
+
+    # Numeric samples within compacted buckets are replaced by the bucket
+    # means, both staged ones and ones merged earlier.
+    before = db.execute('SELECT count(*) FROM log').fetchone()[0]
+    max_width = db.execute('SELECT max(width) FROM staging_buckets').fetchone()[0]
+    dropped = 0
+    removed = 0
+    if max_width is not None:
+        dropped = db.execute(
+            'DELETE FROM staging WHERE numeric_value IS NOT NULL AND EXISTS ('
+            '    SELECT 1 FROM staging_buckets'
+            '    WHERE staging_buckets.unit_id = staging.unit_id AND staging_buckets.key_id = staging.key_id'
+            '    AND staging_buckets.bucket <= staging.timestamp AND staging_buckets.bucket > staging.timestamp - ?'
+            '    AND staging.timestamp < staging_buckets.bucket + staging_buckets.width'
+            ')',
+            (max_width,)
+        ).rowcount
+        if not empty:
+            for unit_id, key_id, bucket, width in db.execute(
+                'SELECT unit_id, key_id, bucket, width FROM staging_buckets'
+            ).fetchall():
+                removed += db.execute(
+                    'DELETE FROM log WHERE unit_id = ? AND timestamp >= ? AND timestamp < ? AND key_id = ? '
+                    'AND numeric_value IS NOT NULL',
+                    (unit_id, bucket, bucket + width, key_id)
+                ).rowcount
+        db.execute(
+            'INSERT INTO staging (unit_id, timestamp, key_id, value, numeric_value) '
+            'SELECT unit_id, bucket, key_id, value, numeric_value FROM staging_buckets'
+        )
+    db.execute('DROP TABLE staging_buckets')
+
+    # Deduplicate into the fleet log.
+    if empty:
+        db.execute(
+            'INSERT INTO log (unit_id, timestamp, key_id, value, numeric_value) '
+            'SELECT unit_id, timestamp, key_id, value, numeric_value FROM staging GROUP BY {}'.format(FLEET_ENTRY)
+        )
+    else:
+        db.execute(
+            'INSERT OR IGNORE INTO log (unit_id, timestamp, key_id, value, numeric_value) '
+            'SELECT unit_id, timestamp, key_id, value, numeric_value FROM staging ORDER BY unit_id, timestamp, key_id'
+        )
+    db.execute('DROP TABLE staging')
+    db.commit()
+    inserted = db.execute('SELECT count(*) FROM log').fetchone()[0] - before + removed
+    merge_time = time.time() - started - read_time
+
+    db.execute(FLEET_UNIQUE_INDEX)
+    db.execute(FLEET_QUERY_INDEX)
+    db.commit()
+    db.close()
+    index_time = time.time() - started - read_time - merge_time
+
+    elapsed = time.time() - started
+    print("Merged {} databases ({} failed): read {} rows, inserted {}, replaced {} by compacted means, "
+          "skipped {} duplicates.".format(
+              len(args.units) - len(failed),
+              len(failed),
+              read,
+              inserted,
+              dropped + removed,
+              read - inserted - dropped,
+          ))
+    print("read {:.2f} s ({:.0f} rows/s), merge {:.2f} s, indexes {:.2f} s, total {:.2f} s ({:.0f} rows/s)".format(
+        read_time,
+        read / max(read_time, 1e-9),
+        merge_time,
+        index_time,
+        elapsed,
+        read / max(elapsed, 1e-9),
+    ))
+
+
+if __name__ == '__main__':
+    main()